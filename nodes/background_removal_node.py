@@ -5,23 +5,83 @@
 """
 
 import torch
+import torch.nn.functional as F
 import numpy as np
-from PIL import Image, ImageOps
-import io
+import math
+from functools import lru_cache
 
 try:
     # Import from same directory
     import sys
     import os
     sys.path.append(os.path.dirname(__file__))
-    from rembg_api import get_processor
+    from rembg_api import get_processor, INFERENCE_BATCH_SIZE
+    from rembg_cache import get_result_cache, frame_digest, result_key
 except ImportError:
     try:
-        from rembg_api import get_processor
+        from rembg_api import get_processor, INFERENCE_BATCH_SIZE
+        from rembg_cache import get_result_cache, frame_digest, result_key
     except ImportError:
         # Fallback if rembg_api is not available
         def get_processor(*args, **kwargs):
             return None
+        def get_result_cache():
+            return None
+        INFERENCE_BATCH_SIZE = 4
+
+# 羽化每轮的模糊半径，以及羽化后吸附到完全不透明/完全透明的阈值
+FEATHER_SIGMA = 0.5
+FEATHER_HIGH = 245.0 / 255.0
+FEATHER_LOW = 10.0 / 255.0
+
+
+@lru_cache(maxsize=32)
+def _gaussian_kernel(sigma, dtype=torch.float32, device='cpu'):
+    """按半径缓存的一维高斯核（与 PIL GaussianBlur 一样以 radius 作为标准差）"""
+    half = max(1, int(math.ceil(sigma * 3.0)))
+    x = torch.arange(-half, half + 1, dtype=torch.float64)
+    kernel = torch.exp(-0.5 * (x / sigma) ** 2)
+    kernel /= kernel.sum()
+    return kernel.to(device=device, dtype=dtype)
+
+
+def blur_masks(masks, sigma):
+    """
+    对整批遮罩做可分离高斯模糊
+    
+    Args:
+        masks: 浮点遮罩 [B, H, W]
+        sigma: 标准差，<=0 时原样返回
+    """
+    if sigma <= 0:
+        return masks
+    kernel = _gaussian_kernel(float(sigma), masks.dtype, str(masks.device))
+    half = kernel.numel() // 2
+    x = masks.unsqueeze(1)
+    x = F.conv2d(F.pad(x, (half, half, 0, 0), mode='replicate'), kernel.view(1, 1, 1, -1))
+    x = F.conv2d(F.pad(x, (0, 0, half, half), mode='replicate'), kernel.view(1, 1, -1, 1))
+    return x.squeeze(1)
+
+
+def post_process_masks(masks, edge_feather, mask_blur):
+    """
+    遮罩后处理: 先整体模糊，再多轮羽化（轻微模糊后将接近0/1的值吸附到0/1）
+    
+    Args:
+        masks: 浮点遮罩 [B, H, W]，取值0-1
+        edge_feather: 羽化轮数
+        mask_blur: 模糊半径
+    
+    Returns:
+        torch.Tensor: 处理后的遮罩 [B, H, W]
+    """
+    masks = blur_masks(masks, mask_blur)
+    for _ in range(int(edge_feather)):
+        masks = blur_masks(masks, FEATHER_SIGMA)
+        masks = torch.where(masks > FEATHER_HIGH, torch.ones_like(masks), masks)
+        masks = torch.where(masks < FEATHER_LOW, torch.zeros_like(masks), masks)
+    return masks.clamp_(0, 1)
+
 
 class AdvancedBackgroundRemoval:
     """高质量背景移除节点"""
@@ -41,6 +101,12 @@ class AdvancedBackgroundRemoval:
             "optional": {
                 "edge_feather": ("INT", {"default": 2, "min": 0, "max": 10}),
                 "mask_blur": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 5.0}),
+                # 每次送入模型的帧数
+                "inference_batch": ("INT", {"default": INFERENCE_BATCH_SIZE, "min": 1, "max": 64}),
+                # 只输出遮罩: image 输出原样返回输入图像，跳过RGBA合成
+                "mask_only": ("BOOLEAN", {"default": False}),
+                # 按输入帧内容缓存结果，相同输入和参数再次执行时直接返回
+                "use_cache": ("BOOLEAN", {"default": True}),
             }
         }
     
@@ -50,7 +116,8 @@ class AdvancedBackgroundRemoval:
     CATEGORY = "kontext_super_prompt/background"
     
     def remove_background(self, image, model, alpha_matting=False, post_processing=True, 
-                         edge_feather=2, mask_blur=1.0):
+                         edge_feather=2, mask_blur=1.0, inference_batch=INFERENCE_BATCH_SIZE,
+                         mask_only=False, use_cache=True):
         """
         移除背景
         
@@ -61,127 +128,107 @@ class AdvancedBackgroundRemoval:
             post_processing: 是否启用后处理
             edge_feather: 边缘羽化程度
             mask_blur: 掩膜模糊程度
+            inference_batch: 推理微批次大小
+            mask_only: 只计算遮罩，image 输出为原输入
+            use_cache: 是否使用逐帧结果缓存
             
         Returns:
             tuple: (处理后的图像, 提取的掩膜)
         """
+        batch_size = image.shape[0]
         try:
             # 获取处理器
             processor = get_processor()
             
-            # 转换输入图像格式
-            batch_size = image.shape[0]
-            results = []
-            masks = []
+            # 整批转换为uint8
+            frames = image[..., :3].clamp(0, 1).mul(255).round().to(torch.uint8).cpu()
+            
+            # 逐帧查询结果缓存，只对未命中的帧推理
+            cache = get_result_cache() if use_cache else None
+            results = [None] * batch_size
+            digests = None
+
+            def frame_key(digest, model_name):
+                return result_key(
+                    digest, model=model_name, alpha_matting=alpha_matting,
+                    post_processing=post_processing, edge_feather=edge_feather,
+                    mask_blur=mask_blur, mask_only=mask_only
+                )
+
+            if cache is not None:
+                digests = [frame_digest(frame) for frame in frames.numpy()]
+                results = [cache.get(frame_key(digest, model)) for digest in digests]
             
-            for i in range(batch_size):
-                # 将张量转换为PIL图像
-                img_tensor = image[i]
-                img_array = (img_tensor.cpu().numpy() * 255).astype(np.uint8)
-                pil_image = Image.fromarray(img_array)
-                
-                # 执行背景移除
-                result_image = processor.remove_background(
-                    pil_image, 
-                    model_name=model, 
-                    alpha_matting=alpha_matting
+            missing = [i for i, result in enumerate(results) if result is None]
+            if missing:
+                computed, used_model = self._compute_results(
+                    processor, frames[missing], model, alpha_matting, post_processing,
+                    edge_feather, mask_blur, inference_batch, mask_only
                 )
-                
-                # 后处理
-                if post_processing:
-                    result_image = self._post_process_image(
-                        result_image, edge_feather, mask_blur
-                    )
-                
-                # 分离RGB和Alpha通道
-                rgb_array = np.array(result_image.convert('RGB'))
-                alpha_array = np.array(result_image)[:, :, 3] if result_image.mode == 'RGBA' else np.full(rgb_array.shape[:2], 255)
-                
-                # 转换回张量格式
-                rgb_tensor = torch.from_numpy(rgb_array.astype(np.float32) / 255.0)
-                alpha_tensor = torch.from_numpy(alpha_array.astype(np.float32) / 255.0)
-                
-                results.append(rgb_tensor)
-                masks.append(alpha_tensor)
+                for i, result in zip(missing, computed):
+                    results[i] = result
+                    # 按实际运行的模型保存；备用算法的结果不缓存，模型恢复后重新推理。
+                    # 保存独立副本，避免缓存条目引用整批输出，使字节预算失效
+                    if cache is not None and used_model is not None:
+                        cache.set(frame_key(digests[i], used_model), result.copy())
             
-            # 堆叠批次
-            result_batch = torch.stack(results, dim=0)
-            mask_batch = torch.stack(masks, dim=0)
+            if cache is not None and len(missing) < batch_size:
+                print(f"[RemBG] 结果缓存命中 {batch_size - len(missing)}/{batch_size} 帧")
             
-            return (result_batch, mask_batch)
+            result_batch = torch.from_numpy(np.stack(results)).to(torch.float32).div_(255.0)
+            if mask_only:
+                return (image, result_batch)
             
-        except Exception as e:
+            # 分离RGB和Alpha通道
+            image_batch = result_batch[..., :3].contiguous()
+            mask_batch = result_batch[..., 3].contiguous()
+            return (image_batch, mask_batch)
+            
+        except Exception:
             # 返回原图像和全白掩膜
             white_mask = torch.ones((batch_size, image.shape[1], image.shape[2]), dtype=torch.float32)
             return (image, white_mask)
     
-    def _post_process_image(self, image, edge_feather, mask_blur):
+    def _compute_results(self, processor, frames, model, alpha_matting, post_processing,
+                         edge_feather, mask_blur, inference_batch, mask_only):
         """
-        后处理图像
+        对一批帧执行背景移除和后处理
         
-        Args:
-            image: PIL图像
-            edge_feather: 边缘羽化程度
-            mask_blur: 掩膜模糊程度
-            
-        Returns:
-            PIL Image: 处理后的图像
-        """
-        try:
-            if image.mode != 'RGBA':
-                return image
-            
-            # 提取alpha通道
-            alpha = image.split()[-1]
-            rgb = image.convert('RGB')
-            
-            # 对alpha通道进行处理
-            if mask_blur > 0:
-                # 高斯模糊
-                from PIL import ImageFilter
-                alpha = alpha.filter(ImageFilter.GaussianBlur(radius=mask_blur))
-            
-            if edge_feather > 0:
-                # 边缘羽化（通过多次膨胀腐蚀实现）
-                alpha = self._feather_edges(alpha, edge_feather)
-            
-            # 重新组合图像
-            result = Image.merge('RGBA', (*rgb.split(), alpha))
-            
-            return result
-            
-        except Exception as e:
-            return image
-    
-    def _feather_edges(self, alpha, feather_amount):
-        """
-        对alpha通道进行边缘羽化
+        结果量化为uint8（与缓存中保存的一致），命中与未命中时输出相同
         
-        Args:
-            alpha: PIL Image alpha通道
-            feather_amount: 羽化程度
-            
         Returns:
-            PIL Image: 羽化后的alpha通道
+            (numpy array, str): mask_only 时为 uint8 遮罩 [B, H, W]，否则为 uint8 RGBA [B, H, W, 4]；
+            以及实际使用的模型名称（使用备用算法时为None）
         """
-        try:
-            from PIL import ImageFilter
-            
-            # 多级羽化
-            result = alpha
-            for i in range(feather_amount):
-                # 轻微模糊
-                result = result.filter(ImageFilter.GaussianBlur(radius=0.5))
-                # 轻微收缩（通过阈值实现）
-                result_array = np.array(result)
-                result_array = np.where(result_array > 245, 255, result_array)
-                result_array = np.where(result_array < 10, 0, result_array)
-                result = Image.fromarray(result_array)
-            
-            return result
-            
-        except Exception:
-            return alpha
+        if mask_only:
+            alpha_batch, used_model = processor.predict_alpha(
+                frames, 
+                model_name=model, 
+                alpha_matting=alpha_matting,
+                batch_size=inference_batch,
+                return_model=True
+            )
+            if not post_processing:
+                return alpha_batch, used_model
+            mask_batch = torch.from_numpy(alpha_batch).to(torch.float32).div_(255.0)
+            mask_batch = post_process_masks(mask_batch, edge_feather, mask_blur)
+            return mask_batch.mul_(255).round_().to(torch.uint8).numpy(), used_model
+        
+        rgba_batch, used_model = processor.remove_background_batch(
+            frames, 
+            model_name=model, 
+            alpha_matting=alpha_matting,
+            batch_size=inference_batch,
+            return_model=True
+        )
+        
+        # 整批后处理遮罩
+        if post_processing:
+            mask_batch = torch.from_numpy(rgba_batch[..., 3]).to(torch.float32).div_(255.0)
+            mask_batch = post_process_masks(mask_batch, edge_feather, mask_blur)
+            rgba_batch = rgba_batch.copy()
+            rgba_batch[..., 3] = mask_batch.mul_(255).round_().to(torch.uint8).numpy()
+        return rgba_batch, used_model
 
 class BackgroundRemovalSettings:
     """背景移除设置节点"""
@@ -1,213 +1,457 @@
 # Super Canvas - 专业画布标注工具
 import torch
 import numpy as np
-import base64
-import cv2
 import time
-from PIL import Image, ImageOps
+import uuid
+import hashlib
+from PIL import Image
 from io import BytesIO
-from threading import Event
+from concurrent.futures import TimeoutError as FutureTimeoutError, CancelledError as FutureCancelledError
 import asyncio
+import os
+import sys
+import threading
 from aiohttp import web
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from kontext_canvas_transport import read_canvas_payload, read_binary_body, apply_tile_delta, CanvasPayloadError
+from kontext_canvas_registry import canvas_registry
+from kontext_canvas_cache import CanvasCache, CanvasCacheView, CanvasDiskCache, CanvasFrame, OUTPUT_DTYPES
+from kontext_canvas_assets import CanvasAssetStore, is_asset_id
+from kontext_canvas_compositor import (
+    composite_layers, render_fabric_scene, render_scene_batch, is_renderable_scene, MissingAssetError,
+    RASTER_TEXT_TYPES, ANNOTATION_TYPES
+)
+from kontext_canvas_resample import (
+    OUTPUT_RESOLUTIONS, DEFAULT_PREVIEW_SIZE, bucket_frame, preview_frame, frame_from_tensor
+)
+from kontext_canvas_scene import CanvasSceneStore, scene_key, scene_asset_ids, scene_state_key, combine_state_digest
+
 # ComfyUI imports
 try:
     from server import PromptServer
     routes = PromptServer.instance.routes
-except ImportError as e:
+except ImportError:
     pass
 
 CATEGORY_TYPE = "🎨 Super Canvas"
 
+def get_canvas_store():
+    """获取Super Canvas共享的字节预算LRU缓存"""
+    if not hasattr(PromptServer.instance, '_kontext_canvas_cache'):
+        PromptServer.instance._kontext_canvas_cache = CanvasCache()
+    return PromptServer.instance._kontext_canvas_cache
+
 def get_canvas_cache():
     """获取Super Canvas节点的临时缓存"""
-    if not hasattr(PromptServer.instance, '_kontext_canvas_node_cache'):
-        PromptServer.instance._kontext_canvas_node_cache = {}
-    return PromptServer.instance._kontext_canvas_node_cache
+    return CanvasCacheView(get_canvas_store(), 'node')
 
 def get_canvas_state_cache():
     """获取画布状态缓存，用于检测内容变化"""
-    if not hasattr(PromptServer.instance, '_kontext_canvas_state_cache'):
-        PromptServer.instance._kontext_canvas_state_cache = {}
-    return PromptServer.instance._kontext_canvas_state_cache
+    return CanvasCacheView(get_canvas_store(), 'state')
 
 def get_canvas_output_cache():
     """获取画布输出缓存，存储上次的计算结果"""
-    if not hasattr(PromptServer.instance, '_kontext_canvas_output_cache'):
-        PromptServer.instance._kontext_canvas_output_cache = {}
-    return PromptServer.instance._kontext_canvas_output_cache
+    return CanvasCacheView(get_canvas_store(), 'output')
+
+def get_canvas_disk_cache():
+    """获取按状态哈希保存画布输出的磁盘缓存，首次获取时在后台线程中预热索引"""
+    if not hasattr(PromptServer.instance, '_kontext_canvas_disk_cache'):
+        cache = CanvasDiskCache()
+        PromptServer.instance._kontext_canvas_disk_cache = cache
+        threading.Thread(target=cache.warm_load, name="kontext-canvas-cache-warm", daemon=True).start()
+    return PromptServer.instance._kontext_canvas_disk_cache
+
+def get_canvas_asset_store():
+    """获取按内容哈希保存图层位图的资源存储"""
+    if not hasattr(PromptServer.instance, '_kontext_canvas_assets'):
+        PromptServer.instance._kontext_canvas_assets = CanvasAssetStore()
+    return PromptServer.instance._kontext_canvas_assets
+
+def get_canvas_scene_store():
+    """获取持久化的画布场景存储"""
+    if not hasattr(PromptServer.instance, '_kontext_canvas_scenes'):
+        PromptServer.instance._kontext_canvas_scenes = CanvasSceneStore()
+    return PromptServer.instance._kontext_canvas_scenes
+
+def save_canvas_scene(node_id, scene, workflow_id=None):
+    """保存场景（按工作流 + 节点索引）并登记其引用的图层资源"""
+    asset_store = get_canvas_asset_store()
+    key = scene_key(node_id, workflow_id)
+    get_canvas_scene_store().save(key, scene, asset_store.get_bytes)
+    asset_store.retain(("scene", key), scene_asset_ids(scene))
+
+def workflow_id_from(extra_pnginfo):
+    """从执行时的 EXTRA_PNGINFO 中取出工作流ID，无法确定时返回None"""
+    workflow = extra_pnginfo.get('workflow') if isinstance(extra_pnginfo, dict) else None
+    if isinstance(workflow, dict) and workflow.get('id'):
+        return str(workflow['id'])
+    return None
 
+def load_scene_asset(asset_id):
+    """读取场景引用的资源；资源存储中没有时从持久化目录恢复"""
+    asset_store = get_canvas_asset_store()
+    rgba = asset_store.get_rgba(asset_id)
+    if rgba is None:
+        data = get_canvas_scene_store().load_asset(asset_id)
+        if data is not None:
+            asset_store.put(data)
+            rgba = asset_store.get_rgba(asset_id)
+    return rgba
+
+def get_canvas_input_cache():
+    """获取上游输入图像的缓存: 像素哈希 -> 资源ID，('node', 节点ID) -> 已推送的资源ID"""
+    return CanvasCacheView(get_canvas_store(), 'input')
+
+def send_to_clients(event, data, timeout=10.0):
+    """
+    从执行线程向前端发送消息，并等待发送完成
+
+    与画布往返请求一样直接在服务器事件循环上发送，保证消息按调用顺序到达前端；
+    无可用事件循环时退回到 send_sync
+    """
+    loop = getattr(PromptServer.instance, 'loop', None)
+    if loop is not None and loop.is_running():
+        try:
+            in_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            in_loop = False
+        if not in_loop:
+            asyncio.run_coroutine_threadsafe(PromptServer.instance.send(event, data), loop).result(timeout)
+            return
+    PromptServer.instance.send_sync(event, data)
+
+def input_image_digest(pixels):
+    """上游图像的内容哈希（包含尺寸，像素字节相同但宽高不同的图像不会冲突）"""
+    hasher = hashlib.sha256()
+    hasher.update(str(pixels.shape).encode('ascii'))
+    hasher.update(memoryview(np.ascontiguousarray(pixels)).cast('B'))
+    return hasher.hexdigest()
+
+def publish_input_image(node_id, image, workflow_id=None):
+    """
+    将上游 IMAGE 保存为内容寻址的图层资源，并通过websocket把资源引用推送给前端
+
+    相同像素只编码一次；节点已收到同一资源时不再推送
+
+    Returns:
+        bool: 是否推送了新的输入图像
+    """
+    frame = frame_from_tensor(image)
+    digest = input_image_digest(frame.pixels)
+    input_cache = get_canvas_input_cache()
+    asset_store = get_canvas_asset_store()
+
+    asset_id = input_cache.get(digest)
+    if asset_id is None or not asset_store.has(asset_id):
+        buffer = BytesIO()
+        Image.fromarray(frame.pixels).save(buffer, format='PNG', compress_level=1)
+        asset_id = asset_store.put(buffer.getvalue())
+        input_cache[digest] = asset_id
+    # 以独立的引用者登记，不受画布场景和合成帧引用更新的影响
+    asset_store.retain(("input", scene_key(node_id, workflow_id)), [asset_id])
+
+    if input_cache.get(('node', node_id)) == asset_id:
+        return False
+    input_cache[('node', node_id)] = asset_id
+    # 等待发送完成，随后的画布状态请求不会先于输入图像到达前端
+    send_to_clients("lrpg_canvas_input_image", {
+        "node_id": node_id,
+        "asset_id": asset_id,
+        "url": f"/lrpg_canvas/asset/{asset_id}",
+        "width": frame.width,
+        "height": frame.height
+    })
+    return True
+
+def get_canvas_frame_cache():
+    """获取每个节点最近一次上传的画布帧，作为增量上传的基准"""
+    return CanvasCacheView(get_canvas_store(), 'frame')
+
+
+def decode_image_uint8(image_data, data_type="image", raw_size=None):
+    """
+    将编码图像解码为 uint8 数组
+
+    Args:
+        image_data: PNG/WebP等编码后的图像字节，或 raw_size 指定尺寸的原始RGBA字节
+        data_type: "image" 返回 (H, W, 3)，"mask" 返回alpha通道 (H, W)，无alpha时返回None
+        raw_size: (width, height)，不为空时按行优先的原始RGBA像素解析
+    """
+    if raw_size is not None:
+        width, height = int(raw_size[0]), int(raw_size[1])
+        if width <= 0 or height <= 0 or len(image_data) != width * height * 4:
+            raise ValueError(f"原始RGBA数据长度与尺寸 {width}x{height} 不匹配")
+        rgba = np.frombuffer(image_data, dtype=np.uint8).reshape(height, width, 4)
+        if data_type == "mask":
+            return rgba[..., 3].copy()
+        return np.ascontiguousarray(rgba[..., :3])
+
+    with Image.open(BytesIO(image_data)) as image:
+        if data_type == "mask":
+            if 'A' not in image.getbands():
+                return None
+            return np.array(image.getchannel('A'))
+
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.array(image)
 
-def base64_to_tensor(base64_string):
-    """将 base64 图像数据转换为 tensor"""
-    try:
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        
-        image_data = base64.b64decode(base64_string)
-        
-        with BytesIO(image_data) as bio:
-            with Image.open(bio) as image:
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                
-                # 转换为numpy数组并归一化
-                image_np = np.array(image).astype(np.float32) / 255.0
-
-                # 处理灰度图像
-                if image_np.ndim == 2:
-                    image_np = np.stack([image_np] * 3, axis=-1)
-                # 处理RGBA图像
-                elif image_np.shape[2] == 4:
-                    image_np = image_np[:, :, :3]
-
-                # 确保图像格式正确 [B, H, W, C]
-                image_np = np.expand_dims(image_np, axis=0)
-                tensor = torch.from_numpy(image_np).float()
-                return tensor
-    
-    except Exception as e:
-        raise
-
-def toBase64ImgUrl(img):
-    bytesIO = BytesIO()
-    img.save(bytesIO, format="png")
-    img_types = bytesIO.getvalue()
-    img_base64 = base64.b64encode(img_types)
-    return f"data:image/png;base64,{img_base64.decode('utf-8')}"
-
-def tensor_to_base64(tensor):
-    if len(tensor.shape) == 3:
-        tensor = tensor.unsqueeze(0)
-    
-    array = (tensor[0].cpu().numpy() * 255).astype(np.uint8)
-    
-    if array.shape[-1] == 1:
-        array = np.repeat(array, 3, axis=-1)
-    elif array.shape[-1] == 4:
-        # RGBA -> BGRA
-        array = array[..., [2,1,0,3]]
-    else:
-        # RGB -> BGR
-        array = array[..., ::-1]
-    
-    array = np.ascontiguousarray(array)
-    
-    try:
-        success, buffer = cv2.imencode('.png', array)
-        if success:
-            return f"data:image/png;base64,{base64.b64encode(buffer).decode('utf-8')}"
-    except Exception as e:
-        pass
-    
-    return None
 
 @routes.post("/lrpg_canvas")
 async def handle_canvas_data(request):
     try:
-        data = await request.json()
+        data = await read_canvas_payload(request)
         node_id = data.get('node_id')
         
         # 存储画布状态用于变化检测
         canvas_state = data.get('canvas_state', None)
+        state_parts = data.get('state_parts')
+        if canvas_state and isinstance(state_parts, dict) and combine_state_digest(state_parts) != canvas_state:
+            # 摘要与对象哈希不一致（数据截断或客户端版本不匹配），不作为变化检测依据，
+            # 图像数据照常处理
+            print(f"[Super Canvas] 节点 {node_id} 的画布状态摘要校验失败，忽略本次状态")
+            canvas_state = None
         if canvas_state and node_id:
             state_cache = get_canvas_state_cache()
             state_cache[node_id] = canvas_state
+
+            # 保存场景（图像以asset_id引用），供无浏览器时在服务端渲染
+            scene = data.get('scene')
+            if isinstance(scene, dict):
+                scene['canvas_state'] = canvas_state
+                await asyncio.get_running_loop().run_in_executor(
+                    None, save_canvas_scene, node_id, scene, data.get('workflow_id')
+                )
             
             # 如果只是状态更新（没有图像数据），直接返回
-            if data.get('main_image') is None:
+            if data.get('main_image') is None and not data.get('delta') and not data.get('compose'):
                 return web.json_response({"status": "success", "message": "State updated"})
         
         if not node_id:
             return web.json_response({"status": "error", "message": "Missing node_id"}, status=400)
 
-        
-        waiting_node = None
-        
-        for i, node in enumerate(LRPGCanvas.active_nodes):
-            event_status = "等待中" if node.waiting_for_response else "已响应"
-            node_id_str = getattr(node, 'node_id', '未知')
-            
-            if node.waiting_for_response and node.node_id == node_id:
-                waiting_node = node
-                break
-
-        if not waiting_node:
-            # 没有等待的节点，直接返回成功
-            return web.Response(status=200)
+        request_id = data.get('request_id')
+        if not canvas_registry.expects(node_id, request_id):
+            # 没有等待的请求或响应已过期，直接返回
+            return web.json_response({"status": "ignored"})
             
         transform_data = data.get('layer_transforms', {})
-        main_image = array_to_tensor(data.get('main_image'), "image")
-        main_mask = array_to_tensor(data.get('main_mask'), "mask")
-        
-        if main_image is not None:
-            pass
-        if main_mask is not None:
-            pass
+        frame_cache = get_canvas_frame_cache()
+
+        delta = data.get('delta')
+        if data.get('compose'):
+            # 服务端合成: 图层位图已按内容哈希上传，只需变换数据
+            canvas_size = transform_data.get('background') or {}
+            try:
+                pixels = await asyncio.get_running_loop().run_in_executor(
+                    None, composite_layers, transform_data, get_canvas_asset_store().get_rgba,
+                    int(canvas_size.get('width', 512)), int(canvas_size.get('height', 512)),
+                    data.get('background')
+                )
+            except MissingAssetError as e:
+                return web.json_response(
+                    {"status": "missing_assets", "missing_assets": e.asset_ids}, status=409
+                )
+            frame = CanvasFrame(pixels)
+            # 记录合成帧引用的资源，避免被淘汰（与场景引用分开登记）
+            get_canvas_asset_store().retain(("compose", scene_key(node_id, data.get('workflow_id'))), [
+                layer.get('asset_id') for layer in transform_data.values()
+                if isinstance(layer, dict)
+            ])
+        elif delta:
+            # 增量上传: 将脏瓦片应用到服务器保存的上一帧
+            base = frame_cache.get(node_id)
+            if base is None or base[0] != delta.get('base_frame'):
+                return web.json_response({"status": "resync", "message": "Base frame missing"}, status=409)
+            pixels = await asyncio.get_running_loop().run_in_executor(
+                None, apply_tile_delta, base[1].pixels, delta, data.get('tiles')
+            )
+            frame = CanvasFrame(pixels)
+        else:
+            # 以uint8画布帧保存，执行时再转换为浮点张量
+            raw_size = None
+            if data.get('image_format') == 'raw':
+                raw_size = (data.get('image_width', 0), data.get('image_height', 0))
+            # 整帧解码耗时较长，放到线程池中执行，避免阻塞事件循环
+            frame = await asyncio.get_running_loop().run_in_executor(
+                None, array_to_frame, data.get('main_image'), data.get('main_mask'), raw_size
+            )
 
         processed_data = {
-            'image': main_image,
-            'mask': main_mask,
+            'frame': frame,
             'transform_data': transform_data
         }
 
-        # 暂存transform_data供后续使用
-        waiting_node.transform_data = transform_data
+        if not canvas_registry.resolve(node_id, processed_data, request_id, request.content_length or 0):
+            return web.json_response({"status": "ignored"})
 
-        waiting_node.processed_data = processed_data
-        waiting_node.response_event.set()
+        # 保存本帧作为下次增量上传的基准
+        frame_id = None
+        if frame is not None:
+            frame_id = uuid.uuid4().hex
+            frame_cache[node_id] = (frame_id, frame)
 
-        return web.json_response({"status": "success"})
+        return web.json_response({"status": "success", "frame_id": frame_id})
 
+    except CanvasPayloadError as e:
+        return web.json_response({"status": "error", "message": str(e)}, status=e.status)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return web.json_response({"status": "error", "message": str(e)}, status=500)
 
+def has_connected_clients():
+    """是否有前端websocket连接；无法判断时视为已连接"""
+    sockets = getattr(PromptServer.instance, 'sockets', None)
+    if sockets is None:
+        return True
+    return len(sockets) > 0
+
+
+async def _canvas_round_trip(waiter):
+    """在服务器事件循环中发送状态请求并等待前端响应（截止时间由执行线程控制）"""
+    await PromptServer.instance.send("lrpg_canvas_get_state", {
+        "node_id": waiter.node_id,
+        "request_id": waiter.request_id
+    })
+    return await asyncio.wrap_future(waiter.future)
+
+
+def _wait_until_deadline(future, waiter, grace=0.0):
+    """等待结果直到 waiter 的截止时间；前端报告进度时截止时间会被延后"""
+    while True:
+        remaining = waiter.deadline + grace - time.monotonic()
+        if remaining <= 0:
+            future.cancel()
+            raise FutureTimeoutError()
+        try:
+            return future.result(timeout=remaining)
+        except FutureTimeoutError:
+            continue
+
+
+def request_canvas_state(waiter, timeout):
+    """
+    从执行线程发起画布往返请求
+
+    等待在服务器事件循环上完成，执行线程只阻塞在结果上；
+    无可用事件循环时退回到 send_sync + 直接等待
+    """
+    waiter.extend(timeout)
+    loop = getattr(PromptServer.instance, 'loop', None)
+    if loop is not None and loop.is_running():
+        future = asyncio.run_coroutine_threadsafe(_canvas_round_trip(waiter), loop)
+        return _wait_until_deadline(future, waiter, grace=1.0)
+
+    PromptServer.instance.send_sync("lrpg_canvas_get_state", {
+        "node_id": waiter.node_id,
+        "request_id": waiter.request_id
+    })
+    return _wait_until_deadline(waiter.future, waiter)
+
+@routes.post("/lrpg_canvas/progress")
+async def handle_canvas_progress(request):
+    """前端仍在渲染/编码/上传画布时定期报告，延后对应请求的超时"""
+    try:
+        data = await request.json()
+        extended = canvas_registry.extend(str(data.get('node_id')), data.get('request_id'))
+        return web.json_response({"status": "success" if extended else "ignored"})
+    except Exception as e:
+        return web.json_response({"status": "error", "message": str(e)}, status=400)
+
+@routes.get("/lrpg_canvas/cache_stats")
+async def handle_canvas_cache_stats(request):
+    """返回画布缓存的命中/淘汰统计"""
+    stats = get_canvas_store().stats()
+    stats['assets'] = get_canvas_asset_store().stats()
+    stats['disk'] = get_canvas_disk_cache().stats()
+    return web.json_response(stats)
+
+@routes.post("/lrpg_canvas/asset")
+async def handle_canvas_asset_upload(request):
+    """上传图层位图，返回服务器计算的内容哈希ID"""
+    try:
+        data = await read_binary_body(request)
+        if not data:
+            return web.json_response({"status": "error", "message": "Empty asset"}, status=400)
+        asset_id = get_canvas_asset_store().put(data)
+        return web.json_response({"status": "success", "asset_id": asset_id})
+    except CanvasPayloadError as e:
+        return web.json_response({"status": "error", "message": str(e)}, status=e.status)
+    except Exception as e:
+        return web.json_response({"status": "error", "message": str(e)}, status=400)
+
+@routes.post("/lrpg_canvas/asset/probe")
+async def handle_canvas_asset_probe(request):
+    """批量检查资源是否已在服务器上，返回缺失的ID"""
+    try:
+        data = await request.json()
+        asset_ids = [asset_id for asset_id in data.get('asset_ids', []) if is_asset_id(asset_id)]
+        return web.json_response({"status": "success", "missing": get_canvas_asset_store().missing(asset_ids)})
+    except Exception as e:
+        return web.json_response({"status": "error", "message": str(e)}, status=400)
+
+@routes.get("/lrpg_canvas/asset/{asset_id}")
+async def handle_canvas_asset_get(request):
+    """按内容哈希读取资源；内容不可变，允许浏览器长期缓存"""
+    asset_id = request.match_info['asset_id']
+    if not is_asset_id(asset_id):
+        return web.Response(status=400)
+    data = get_canvas_asset_store().get_bytes(asset_id)
+    if data is None:
+        return web.Response(status=404)
+    with Image.open(BytesIO(data)) as image:
+        content_type = Image.MIME.get(image.format, 'application/octet-stream')
+    return web.Response(body=data, content_type=content_type, headers={
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'ETag': f'"{asset_id}"'
+    })
+
 # 删除冗余的API端点，前端已有localStorage持久化
 
+# 启动时预热磁盘输出缓存，重放的工作流可直接命中
+get_canvas_disk_cache()
+
+# 画布渲染方式: auto 在保存的场景为最新且可精确渲染时由服务端渲染；
+# browser 总是请求前端；server 总是使用保存的场景
+RENDER_MODES = ["auto", "browser", "server"]
+
 class LRPGCanvas:
-    # 将活动节点列表移到类属性 - 复制lg_tools的做法
-    active_nodes = []
+    # 等待前端响应的节点由全局 canvas_registry 按 node_id / request_id 管理
     
     def __init__(self):
-        self.response_event = Event()
         self.processed_data = None
         self.node_id = None
-        self.waiting_for_response = False
+        self.scene_id = None
         self.transform_data = None  # 临时存储transform数据
-        
-        # 清理已有节点并添加自己 - 完全复制lg_tools的做法
-        LRPGCanvas.clean_nodes()
-        LRPGCanvas.active_nodes.append(self)
-
+        self.output_resolution = "original"
+        self.preview_size = DEFAULT_PREVIEW_SIZE
 
-    @classmethod
-    def clean_nodes(cls):
-        """清理非活动节点 - 完全复制lg_tools的做法"""
-        cls.active_nodes = [node for node in cls.active_nodes 
-                          if node.waiting_for_response and hasattr(node, 'response_event')]
-    
     @classmethod
     def INPUT_TYPES(cls):
-        # 每次加载节点类型时重置活动节点列表 - 完全复制lg_tools的做法
-        cls.active_nodes = []
         return {
             "required": {},
-            "hidden": {"unique_id": "UNIQUE_ID"},
+            "hidden": {"unique_id": "UNIQUE_ID", "extra_pnginfo": "EXTRA_PNGINFO"},
             "optional": {
-                "image": ("IMAGE",)
+                "image": ("IMAGE",),
+                "output_precision": (list(OUTPUT_DTYPES.keys()), {"default": "float32"}),
+                "render_mode": (RENDER_MODES, {"default": "auto"}),
+                "output_resolution": (OUTPUT_RESOLUTIONS, {"default": "original"}),
+                "preview_size": ("INT", {"default": DEFAULT_PREVIEW_SIZE, "min": 64, "max": 2048, "step": 16}),
+                # 将保存的图层布局应用到输入批次的每一帧（在服务端合成）
+                "batch_mode": ("BOOLEAN", {"default": False}),
             }
         }
 
-    RETURN_TYPES = ("IMAGE", "LAYER_INFO")
-    RETURN_NAMES = ("image", "layer_info") 
+    RETURN_TYPES = ("IMAGE", "LAYER_INFO", "IMAGE")
+    RETURN_NAMES = ("image", "layer_info", "preview") 
     FUNCTION = "canvas_execute"
     CATEGORY = CATEGORY_TYPE
     OUTPUT_NODE = True
 
     @classmethod
-    def IS_CHANGED(cls, unique_id, image=None):
+    def IS_CHANGED(cls, unique_id, image=None, **kwargs):
         # 检查画布状态是否改变
         state_cache = get_canvas_state_cache()
         output_cache = get_canvas_output_cache()
@@ -221,200 +465,338 @@ class LRPGCanvas:
         # 如果状态没有变化，返回False表示不需要重新执行
         if current_state and last_cached_state and current_state == last_cached_state:
             return False
+
+        # 磁盘缓存中已有当前内容的输出时，以内容哈希作为稳定的变化标识
+        scene_id = scene_key(unique_id, workflow_id_from(kwargs.get('extra_pnginfo')))
+        state_key = cls._current_state_key(scene_id, current_state)
+        if state_key and state_key in get_canvas_disk_cache():
+            return state_key
         
         # 状态有变化或没有缓存，需要重新执行
         import time
         return float(time.time())
 
-    def canvas_execute(self, unique_id, image=None):
+    def canvas_execute(self, unique_id, image=None, output_precision="float32", render_mode="auto",
+                       output_resolution="original", preview_size=DEFAULT_PREVIEW_SIZE, batch_mode=False,
+                       extra_pnginfo=None):
+        dtype = OUTPUT_DTYPES.get(output_precision, torch.float32)
+        # 保存的场景按工作流 + 节点索引，避免重启后其他工作流中同ID的节点渲染本画布
+        workflow_id = workflow_id_from(extra_pnginfo)
+        self.scene_id = scene_key(unique_id, workflow_id)
+        self.output_resolution = output_resolution
+        self.preview_size = preview_size
         try:
+            # 上游图像变化时推送给前端，画布内容随之改变，不能使用缓存结果
+            connected = has_connected_clients()
+            input_changed = image is not None and connected and publish_input_image(unique_id, image, workflow_id)
+
+            if batch_mode and image is not None:
+                batch_output = self._render_batch(unique_id, image, dtype)
+                if batch_output is not None:
+                    return batch_output
+
             # 检查是否有缓存的输出
             state_cache = get_canvas_state_cache()
             output_cache = get_canvas_output_cache()
             
             current_state = state_cache.get(unique_id, None)
             last_cached_state = output_cache.get(f"{unique_id}_state", None)
+            if input_changed:
+                current_state = last_cached_state = None
             
             # 如果状态没有变化，直接返回缓存的结果
             if current_state and last_cached_state and current_state == last_cached_state:
                 cached_output = output_cache.get(f"{unique_id}_output", None)
                 if cached_output:
-                    return cached_output
+                    return self._materialize(cached_output, dtype)
+
+            # 内存中没有时按场景强哈希查磁盘缓存（服务器重启后重放工作流）
+            state_key = None if input_changed else self._current_state_key(self.scene_id, current_state)
+            if state_key:
+                cached_output = get_canvas_disk_cache().get(state_key)
+                if cached_output is not None:
+                    self._remember_output(unique_id, cached_output)
+                    return self._materialize(cached_output, dtype)
             
             self.node_id = unique_id
-            self.response_event.clear()
             self.processed_data = None
-            self.waiting_for_response = True
-            
-            # 确保节点在活动列表中 - 完全复制lg_tools的做法
-            if self not in LRPGCanvas.active_nodes:
-                LRPGCanvas.active_nodes.append(self)
-            
 
-            # 移除lrpg_data逻辑，直接获取画布状态
-            PromptServer.instance.send_sync(
-                "lrpg_canvas_get_state", {
-                    "node_id": unique_id
-                }
-            )
+            if not input_changed and (render_mode == "server" or not connected or (
+                    render_mode == "auto" and self._scene_is_exact(self.scene_id, current_state))):
+                # 无需前端往返，直接渲染保存的场景
+                rendered = self._render_saved_scene(unique_id, dtype, state_key)
+                if rendered is not None:
+                    return rendered
 
-            if not self.response_event.wait(timeout=30):
-                self.waiting_for_response = False
-                LRPGCanvas.clean_nodes()
-                # 返回默认值而不是None
-                if image is not None:
-                    # 如果有输入图像，返回原图和空的图层信息
-                    empty_layer_info = {
-                        'layers': [],
-                        'canvas_size': {
-                            'width': image.shape[2] if len(image.shape) > 2 else 512,
-                            'height': image.shape[1] if len(image.shape) > 1 else 512
-                        },
-                        'transform_data': {}
-                    }
-                    return (image, empty_layer_info)
-                else:
-                    # 如果没有输入图像，创建默认空图像
-                    import torch
-                    empty_image = torch.zeros((1, 512, 512, 3), dtype=torch.float32)
-                    empty_layer_info = {
-                        'layers': [],
-                        'canvas_size': {'width': 512, 'height': 512},
-                        'transform_data': {}
-                    }
-                    return (empty_image, empty_layer_info)
-
-            self.waiting_for_response = False
-            LRPGCanvas.clean_nodes()
-            
-            if self.processed_data:
-                image = self.processed_data.get('image')
-                mask = self.processed_data.get('mask')
-                transform_data = getattr(self, 'transform_data', {})
-                
-                if image is not None:
-                    bg_height, bg_width = image.shape[1:3]
-                    transform_data['background'] = {
-                        'width': bg_width,
-                        'height': bg_height
-                    }
-                
-                # 构建详细的图层信息
-                layer_info = {
-                    'layers': [],
-                    'canvas_size': {
-                        'width': bg_width,
-                        'height': bg_height
-                    },
-                    'transform_data': transform_data
-                }
-                
-                # 从transform_data中提取图层信息
-                for layer_id, layer_data in transform_data.items():
-                    if layer_id != 'background':
-                        layer_info['layers'].append({
-                            'id': layer_id,
-                            'transform': layer_data,
-                            'visible': layer_data.get('visible', True),
-                            'locked': layer_data.get('locked', False),
-                            'z_index': layer_data.get('z_index', 0)
-                        })
-                
-                # 按z_index排序
-                layer_info['layers'].sort(key=lambda x: x.get('z_index', 0))
-                
-                # 缓存输出结果和状态
-                output_result = (image, layer_info)
-                state_cache = get_canvas_state_cache()
-                output_cache = get_canvas_output_cache()
-                
-                current_state = state_cache.get(unique_id, None)
-                if current_state:
-                    output_cache[f"{unique_id}_state"] = current_state
-                    output_cache[f"{unique_id}_output"] = output_result
-                
-                return output_result
+            if not connected:
+                # 无前端连接（API/批处理模式），立即使用上次的输出
+                return self._fallback_output(unique_id, image, dtype)
+
+            waiter = canvas_registry.begin(unique_id)
+            # 按观测到的往返延迟加上整帧上传所需时间设定截止时间，前端仍在处理时会报告进度以延后
+            timeout = canvas_registry.latency.timeout(unique_id, self._expected_upload_bytes(unique_id, image))
+
+            # 移除lrpg_data逻辑，直接获取画布状态
+            try:
+                self.processed_data = request_canvas_state(waiter, timeout)
+            except (asyncio.TimeoutError, FutureTimeoutError, FutureCancelledError, asyncio.CancelledError):
+                self.processed_data = None
+            finally:
+                canvas_registry.finish(waiter)
+
+            if self.processed_data and self.processed_data.get('frame') is not None:
+                transform_data = self.processed_data.get('transform_data') or {}
+                # 前端随响应保存了最新场景，按其状态计算缓存键
+                state_key = self._current_state_key(self.scene_id, state_cache.get(unique_id, None))
+                return self._finish_output(unique_id, self.processed_data['frame'], transform_data, dtype, state_key)
             
-            # 没有处理数据时返回默认值
-            if image is not None:
-                empty_layer_info = {
-                    'layers': [],
-                    'canvas_size': {
-                        'width': image.shape[2] if len(image.shape) > 2 else 512,
-                        'height': image.shape[1] if len(image.shape) > 1 else 512
-                    },
-                    'transform_data': {}
-                }
-                return (image, empty_layer_info)
-            else:
-                import torch
-                empty_image = torch.zeros((1, 512, 512, 3), dtype=torch.float32)
-                empty_layer_info = {
-                    'layers': [],
-                    'canvas_size': {'width': 512, 'height': 512},
-                    'transform_data': {}
-                }
-                return (empty_image, empty_layer_info)
-
-        except Exception as e:
+            # 没有处理数据时优先使用当前场景的磁盘缓存，否则返回默认值
+            state_key = self._current_state_key(self.scene_id, state_cache.get(unique_id, None))
+            return self._fallback_output(unique_id, image, dtype, state_key)
+
+        except Exception:
             import traceback
             traceback.print_exc()
-            self.waiting_for_response = False
-            LRPGCanvas.clean_nodes()
             # 异常时也返回默认值
-            if image is not None:
-                empty_layer_info = {
-                    'layers': [],
-                    'canvas_size': {
-                        'width': image.shape[2] if len(image.shape) > 2 else 512,
-                        'height': image.shape[1] if len(image.shape) > 1 else 512
-                    },
-                    'transform_data': {}
-                }
-                return (image, empty_layer_info)
-            else:
-                import torch
-                empty_image = torch.zeros((1, 512, 512, 3), dtype=torch.float32)
-                empty_layer_info = {
-                    'layers': [],
-                    'canvas_size': {'width': 512, 'height': 512},
-                    'transform_data': {}
-                }
-                return (empty_image, empty_layer_info)
-
-    def __del__(self):
-        # 确保从活动节点列表中删除 - 完全复制lg_tools的做法
-        if self in LRPGCanvas.active_nodes:
-            LRPGCanvas.active_nodes.remove(self)
-
-def array_to_tensor(array_data, data_type):
-    try:
-        if array_data is None:
-            return None
+            return self._fallback_output(unique_id, image, dtype)
 
-        byte_data = bytes(array_data)
-        image = Image.open(BytesIO(byte_data))
+    def _finish_output(self, unique_id, frame, transform_data, dtype=torch.float32, state_key=None):
+        """由画布帧和变换数据构建图层信息，缓存并返回节点输出；state_key 不为空时同时写入磁盘缓存"""
+        layer_info = self._build_layer_info(unique_id, frame.width, frame.height, transform_data)
         
-        if data_type == "mask":
-            if 'A' in image.getbands():
-                mask = np.array(image.getchannel('A')).astype(np.float32) / 255.0
-                mask = torch.from_numpy(mask)
+        # 缓存uint8画布帧和状态，避免长期持有浮点张量
+        cached_output = (frame, layer_info)
+        self._remember_output(unique_id, cached_output)
+        if state_key:
+            get_canvas_disk_cache().set(state_key, frame, layer_info)
+        
+        return self._materialize(cached_output, dtype)
+
+    def _build_layer_info(self, unique_id, bg_width, bg_height, transform_data, scene=None):
+        """由变换数据构建 LAYER_INFO，scene 为空时使用与当前状态一致的保存场景"""
+        # 暂存transform_data供后续使用
+        self.transform_data = transform_data
+        
+        transform_data['background'] = {
+            'width': bg_width,
+            'height': bg_height
+        }
+        
+        # 构建详细的图层信息
+        layer_info = {
+            'layers': [],
+            'canvas_size': {
+                'width': bg_width,
+                'height': bg_height
+            },
+            'transform_data': transform_data
+        }
+        
+        # 从transform_data中提取图层信息
+        for layer_id, layer_data in transform_data.items():
+            if layer_id != 'background':
+                layer_info['layers'].append({
+                    'id': layer_id,
+                    'transform': layer_data,
+                    'visible': layer_data.get('visible', True),
+                    'locked': layer_data.get('locked', False),
+                    'z_index': layer_data.get('z_index', 0)
+                })
+        
+        # 按z_index排序
+        layer_info['layers'].sort(key=lambda x: x.get('z_index', 0))
+
+        # 附带标注图形（画布坐标），供标注遮罩节点在服务端光栅化
+        if scene is None:
+            scene = self._current_scene(self.scene_id or unique_id, get_canvas_state_cache().get(unique_id, None))
+        if scene is not None:
+            layer_info['annotations'] = [
+                obj for obj in scene.get('objects') or [] if obj.get('type') in ANNOTATION_TYPES
+            ]
+        return layer_info
+
+    @staticmethod
+    def _remember_output(unique_id, cached_output):
+        """记录节点最近一次输出及对应的画布状态"""
+        state_cache = get_canvas_state_cache()
+        output_cache = get_canvas_output_cache()
+        
+        current_state = state_cache.get(unique_id, None)
+        if current_state:
+            output_cache[f"{unique_id}_state"] = current_state
+        # 始终保留最近一次输出，作为无前端响应时的回退结果
+        output_cache[f"{unique_id}_output"] = cached_output
+
+    def _expected_upload_bytes(self, unique_id, image=None):
+        """画布整帧重新上传的字节数上限（未压缩RGBA），用于计算往返截止时间"""
+        width = height = None
+        scene = get_canvas_scene_store().load(self.scene_id or unique_id)
+        if scene is not None:
+            width, height = scene.get('width'), scene.get('height')
+        if not width or not height:
+            last_frame = get_canvas_frame_cache().get(unique_id)
+            if last_frame is not None:
+                width, height = last_frame[1].width, last_frame[1].height
+            elif image is not None:
+                width, height = image.shape[2], image.shape[1]
             else:
-                mask = torch.zeros((image.height, image.width), dtype=torch.float32)
-            return mask.unsqueeze(0)
-            
-        elif data_type == "image":
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+                width = height = 1024
+        return int(width) * int(height) * 4
+
+    @staticmethod
+    def _current_state_key(scene_id, current_state):
+        """
+        返回节点当前画布内容的强哈希
+
+        使用保存的场景计算；前端报告的状态与场景不一致（场景已过期）时返回None。
+        重启后尚未收到前端状态时，保存的场景即为最近已知的画布内容
+        """
+        scene = LRPGCanvas._current_scene(scene_id, current_state)
+        return scene_state_key(scene) if scene is not None else None
+
+    @staticmethod
+    def _current_scene(scene_id, current_state):
+        """返回与前端最新状态一致的保存场景，场景已过期时返回None"""
+        scene = get_canvas_scene_store().load(scene_id)
+        if scene is None:
+            return None
+        if current_state and scene.get('canvas_state') != current_state:
+            return None
+        return scene
 
-            image = np.array(image).astype(np.float32) / 255.0
-            return torch.from_numpy(image)[None,] 
+    @staticmethod
+    def _scene_is_exact(scene_id, current_state):
+        """保存的场景与前端最新状态一致，且不含字体渲染可能不同的文本对象"""
+        scene = get_canvas_scene_store().load(scene_id)
+        if scene is None or not current_state or scene.get('canvas_state') != current_state:
+            return False
+        return not any(obj.get('type') in RASTER_TEXT_TYPES for obj in scene.get('objects') or [])
 
-        return None
+    def _render_saved_scene(self, unique_id, dtype=torch.float32, state_key=None):
+        """在服务端渲染保存的场景，无法渲染时返回None"""
+        scene = get_canvas_scene_store().load(self.scene_id or unique_id)
+        if scene is None or not is_renderable_scene(scene):
+            return None
+        try:
+            pixels = render_fabric_scene(scene, load_scene_asset)
+        except MissingAssetError as e:
+            print(f"[Super Canvas] 场景渲染失败: {e}")
+            return None
+        transform_data = dict(scene.get('layer_transforms') or {})
+        return self._finish_output(unique_id, CanvasFrame(pixels), transform_data, dtype, state_key)
+
+    def _render_batch(self, unique_id, image, dtype=torch.float32):
+        """
+        批量模式: 保存场景中的InputImage图层依次替换为输入批次的每一帧，在服务端合成
+
+        场景只需包含布局，不要求与前端最新状态一致；没有可用场景时返回None
+        """
+        scene = get_canvas_scene_store().load(self.scene_id or unique_id)
+        if scene is None or not is_renderable_scene(scene):
+            print(f"[Super Canvas] 节点 {unique_id} 没有可用于批量模式的画布场景")
+            return None
 
-    except Exception as e:
+        frames = image[..., :3].clamp(0, 1).mul(255).round().to(torch.uint8).cpu().numpy()
+        try:
+            pixels = render_scene_batch(scene, frames, load_scene_asset)
+        except MissingAssetError as e:
+            print(f"[Super Canvas] 批量合成失败: {e}")
+            return None
+
+        batch, height, width = pixels.shape[:3]
+        layer_info = self._build_layer_info(
+            unique_id, width, height, dict(scene.get('layer_transforms') or {}), scene
+        )
+        layer_info['batch_size'] = batch
+        layer_info['frames'] = [
+            {'index': index, 'source_size': {'width': frames.shape[2], 'height': frames.shape[1]}}
+            for index in range(batch)
+        ]
+
+        if self.output_resolution == "kontext":
+            bucketed = [bucket_frame(CanvasFrame(frame_pixels)) for frame_pixels in pixels]
+            pixels = np.stack([frame.pixels for frame, _ in bucketed])
+            layer_info['output_size'] = {'width': pixels.shape[2], 'height': pixels.shape[1]}
+            layer_info['output_transform'] = bucketed[0][1]
+
+        previews = np.stack([
+            preview_frame(CanvasFrame(frame_pixels), self.preview_size).pixels for frame_pixels in pixels
+        ])
+        images = torch.from_numpy(pixels).to(dtype).div_(255.0)
+        preview = torch.from_numpy(previews).to(dtype).div_(255.0)
+        return (images, layer_info, preview)
+
+    def _materialize(self, cached_output, dtype=torch.float32):
+        """将缓存的 (CanvasFrame, layer_info) 按输出分辨率转换为节点输出"""
+        frame, layer_info = cached_output
+        if self.output_resolution == "kontext":
+            frame, transform = bucket_frame(frame)
+            # 记录输出尺寸和映射，下游可据此换算图层坐标（不修改缓存中的图层信息）
+            layer_info = dict(layer_info)
+            layer_info['output_size'] = {'width': frame.width, 'height': frame.height}
+            layer_info['output_transform'] = transform
+        preview = preview_frame(frame, self.preview_size)
+        return (frame.image_tensor(dtype), layer_info, preview.image_tensor(dtype))
+
+    def _fallback_output(self, unique_id, image=None, dtype=torch.float32, state_key=None):
+        """无法获取前端画布时的回退结果: 当前场景的磁盘缓存 > 上次输出 > 输入图像 > 空白图像"""
+        if state_key:
+            cached_output = get_canvas_disk_cache().get(state_key)
+            if cached_output is not None:
+                self._remember_output(unique_id, cached_output)
+                return self._materialize(cached_output, dtype)
+
+        cached_output = get_canvas_output_cache().get(f"{unique_id}_output", None)
+        if cached_output:
+            return self._materialize(cached_output, dtype)
+
+        if image is not None:
+            # 如果有输入图像，返回原图和空的图层信息
+            empty_layer_info = {
+                'layers': [],
+                'canvas_size': {
+                    'width': image.shape[2] if len(image.shape) > 2 else 512,
+                    'height': image.shape[1] if len(image.shape) > 1 else 512
+                },
+                'transform_data': {}
+            }
+            if self.output_resolution == "original":
+                frame = frame_from_tensor(image)
+                preview = preview_frame(frame, self.preview_size)
+                return (image.to(dtype), empty_layer_info, preview.image_tensor(dtype))
+            return self._materialize((frame_from_tensor(image), empty_layer_info), dtype)
+
+        # 如果没有输入图像，创建默认空图像
+        empty_layer_info = {
+            'layers': [],
+            'canvas_size': {'width': 512, 'height': 512},
+            'transform_data': {}
+        }
+        return self._materialize((CanvasFrame(np.zeros((512, 512, 3), dtype=np.uint8)), empty_layer_info), dtype)
+
+def array_to_frame(image_data, mask_data=None, raw_size=None):
+    """将上传的图像（及可选遮罩）解码为 uint8 画布帧，raw_size 不为空时图像为原始RGBA"""
+    try:
+        if image_data is None:
+            return None
+        # 二进制上传直接使用bytes，旧JSON格式为整数数组
+        if not isinstance(image_data, (bytes, bytearray)):
+            image_data = bytes(image_data)
+        pixels = decode_image_uint8(image_data, "image", raw_size)
+
+        mask = None
+        if mask_data is not None:
+            if not isinstance(mask_data, (bytes, bytearray)):
+                mask_data = bytes(mask_data)
+            mask = decode_image_uint8(mask_data, "mask")
+            if mask is not None and mask.shape != pixels.shape[:2]:
+                mask = None
+        return CanvasFrame(pixels, mask)
+
+    except Exception:
         return None
 
+
 # 节点注册
 NODE_CLASS_MAPPINGS = {
     "LRPGCanvas": LRPGCanvas,
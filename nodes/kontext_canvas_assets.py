@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Super Canvas 图层资源存储
+按内容哈希保存上传的图层位图，同一位图只需上传一次，并在多个画布节点间共享
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from kontext_canvas_cache import CanvasCache
+
+try:
+    import folder_paths
+    ASSET_SPILL_ROOT = folder_paths.get_temp_directory()
+except ImportError:
+    ASSET_SPILL_ROOT = tempfile.gettempdir()
+
+# 内存中保存的编码字节上限，超出后溢出到磁盘
+ASSET_MEMORY_BUDGET_BYTES = int(os.environ.get("KONTEXT_CANVAS_ASSET_MEMORY_MB", "512")) * 1024 * 1024
+# 内存+磁盘总上限，超出后删除无引用的资源
+ASSET_TOTAL_BUDGET_BYTES = int(os.environ.get("KONTEXT_CANVAS_ASSET_DISK_MB", "4096")) * 1024 * 1024
+# 解码后的RGBA位图缓存预算
+DECODED_ASSET_BUDGET_BYTES = 512 * 1024 * 1024
+
+
+def content_hash(data):
+    """计算资源的内容哈希（SHA-256十六进制）"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_asset_id(asset_id):
+    return isinstance(asset_id, str) and len(asset_id) == 64 and all(c in '0123456789abcdef' for c in asset_id)
+
+
+class _AssetEntry:
+    __slots__ = ('data', 'size', 'path', 'refs', 'last_used')
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.path = None
+        self.refs = set()
+        self.last_used = time.monotonic()
+
+
+class CanvasAssetStore:
+    """
+    内容寻址的图层资源存储
+
+    - put() 按SHA-256保存编码后的图像字节，重复上传直接返回已有ID
+    - 内存超出预算时，最久未使用的资源溢出到临时目录
+    - retain() 记录每个引用者引用的资源，引用者为 (用途, 场景键) 元组，
+      同一节点的场景、合成帧和输入图像各自登记、互不覆盖；总量超出预算时只删除无引用的资源
+    - get_rgba() 返回解码后的 uint8 (H, W, 4) 数组，解码结果按LRU缓存
+    """
+
+    def __init__(self, memory_budget_bytes=ASSET_MEMORY_BUDGET_BYTES,
+                 total_budget_bytes=ASSET_TOTAL_BUDGET_BYTES,
+                 spill_dir=None, decoded_budget_bytes=DECODED_ASSET_BUDGET_BYTES):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.total_budget_bytes = total_budget_bytes
+        self.spill_dir = spill_dir if spill_dir is not None else os.path.join(ASSET_SPILL_ROOT, 'kontext_canvas_assets')
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._referrers = {}
+        self._decoded = CanvasCache(budget_bytes=decoded_budget_bytes, default_ttl=0)
+        self.memory_bytes = 0
+        self.total_bytes = 0
+
+    def put(self, data):
+        asset_id = content_hash(data)
+        with self._lock:
+            entry = self._entries.get(asset_id)
+            if entry is not None:
+                self._touch(asset_id, entry)
+                return asset_id
+
+        # 先校验是否为可解码的图像
+        with Image.open(BytesIO(data)) as image:
+            image.verify()
+
+        with self._lock:
+            if asset_id not in self._entries:
+                entry = _AssetEntry(bytes(data))
+                self._entries[asset_id] = entry
+                self.memory_bytes += entry.size
+                self.total_bytes += entry.size
+                self._enforce_budget()
+        return asset_id
+
+    def has(self, asset_id):
+        return asset_id in self._entries
+
+    def missing(self, asset_ids):
+        """返回不在存储中的资源ID"""
+        return [asset_id for asset_id in asset_ids if asset_id not in self._entries]
+
+    def get_bytes(self, asset_id):
+        with self._lock:
+            entry = self._entries.get(asset_id)
+            if entry is None:
+                return None
+            self._touch(asset_id, entry)
+            if entry.data is not None:
+                return entry.data
+            path = entry.path
+
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            # 溢出文件被外部清理，视为资源丢失
+            with self._lock:
+                self._delete(asset_id)
+            return None
+
+    def get_rgba(self, asset_id):
+        rgba = self._decoded.get(asset_id)
+        if rgba is not None:
+            return rgba
+
+        data = self.get_bytes(asset_id)
+        if data is None:
+            return None
+        with Image.open(BytesIO(data)) as image:
+            rgba = np.array(image.convert('RGBA'))
+        self._decoded.set(asset_id, rgba)
+        return rgba
+
+    def retain(self, referrer, asset_ids):
+        """将引用者引用的资源集合替换为 asset_ids，并更新引用计数"""
+        asset_ids = {asset_id for asset_id in asset_ids if asset_id}
+        with self._lock:
+            previous = self._referrers.get(referrer, set())
+            for asset_id in previous - asset_ids:
+                entry = self._entries.get(asset_id)
+                if entry is not None:
+                    entry.refs.discard(referrer)
+            for asset_id in asset_ids - previous:
+                entry = self._entries.get(asset_id)
+                if entry is not None:
+                    entry.refs.add(referrer)
+            if asset_ids:
+                self._referrers[referrer] = asset_ids
+            else:
+                self._referrers.pop(referrer, None)
+            self._enforce_budget()
+
+    def release(self, referrer):
+        self.retain(referrer, ())
+
+    def ref_count(self, asset_id):
+        entry = self._entries.get(asset_id)
+        return len(entry.refs) if entry is not None else 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'assets': len(self._entries),
+                'memory_bytes': self.memory_bytes,
+                'total_bytes': self.total_bytes,
+                'spilled': sum(1 for entry in self._entries.values() if entry.data is None),
+                'referenced': sum(1 for entry in self._entries.values() if entry.refs),
+            }
+
+    def _touch(self, asset_id, entry):
+        entry.last_used = time.monotonic()
+        self._entries.move_to_end(asset_id)
+
+    def _spill(self, asset_id, entry):
+        """将资源字节写入磁盘并释放内存"""
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = os.path.join(self.spill_dir, asset_id)
+            if not os.path.exists(path):
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(entry.data)
+                os.replace(tmp_path, path)
+        except OSError:
+            return False
+        entry.path = path
+        entry.data = None
+        self.memory_bytes -= entry.size
+        return True
+
+    def _delete(self, asset_id):
+        entry = self._entries.pop(asset_id, None)
+        if entry is None:
+            return
+        if entry.data is not None:
+            self.memory_bytes -= entry.size
+        elif entry.path:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        self.total_bytes -= entry.size
+        self._decoded.pop(asset_id)
+
+    def _enforce_budget(self):
+        # 1. 总量超出预算时，按LRU删除无引用的资源
+        if self.total_bytes > self.total_budget_bytes:
+            for asset_id in [key for key, entry in self._entries.items() if not entry.refs]:
+                if self.total_bytes <= self.total_budget_bytes:
+                    break
+                self._delete(asset_id)
+
+        # 2. 内存超出预算时，按LRU将资源溢出到磁盘
+        if self.memory_bytes > self.memory_budget_bytes:
+            for asset_id, entry in list(self._entries.items()):
+                if self.memory_bytes <= self.memory_budget_bytes:
+                    break
+                if entry.data is not None and not self._spill(asset_id, entry):
+                    break
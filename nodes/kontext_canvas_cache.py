@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Super Canvas 缓存
+按字节预算限制的LRU缓存，支持条目过期时间和命中统计；
+画布输出另有按状态哈希索引的磁盘缓存，服务器重启后仍然有效
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+# 默认字节预算与过期时间，可通过环境变量调整（TTL为0表示不过期）
+DEFAULT_CACHE_BUDGET_BYTES = int(os.environ.get("KONTEXT_CANVAS_CACHE_MB", "1024")) * 1024 * 1024
+DEFAULT_CACHE_TTL = float(os.environ.get("KONTEXT_CANVAS_CACHE_TTL", "0"))
+
+# 磁盘输出缓存的目录与字节预算
+DISK_CACHE_DIR = Path(__file__).parent.parent / "user_data" / "canvas_outputs"
+DISK_CACHE_BUDGET_BYTES = int(os.environ.get("KONTEXT_CANVAS_DISK_CACHE_MB", "2048")) * 1024 * 1024
+
+
+# 输出张量精度
+OUTPUT_DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+}
+
+
+class CanvasFrame:
+    """
+    画布帧的紧凑存储
+
+    像素以 uint8 (H, W, 3) 保存，遮罩以 uint8 (H, W) 保存，
+    仅在交给ComfyUI时才转换为浮点张量
+    """
+
+    __slots__ = ('pixels', 'mask')
+
+    def __init__(self, pixels, mask=None):
+        self.pixels = pixels
+        self.mask = mask
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.pixels.nbytes + (self.mask.nbytes if self.mask is not None else 0)
+
+    def image_tensor(self, dtype=torch.float32):
+        """转换为 [1, H, W, 3] 浮点张量，只产生一次拷贝并原地归一化"""
+        tensor = torch.from_numpy(self.pixels).to(dtype)
+        tensor.div_(255.0)
+        return tensor.unsqueeze(0)
+
+    def mask_tensor(self, dtype=torch.float32):
+        """转换为 [1, H, W] 浮点遮罩，没有遮罩时返回全零"""
+        if self.mask is None:
+            return torch.zeros((1, self.height, self.width), dtype=dtype)
+        tensor = torch.from_numpy(self.mask).to(dtype)
+        tensor.div_(255.0)
+        return tensor.unsqueeze(0)
+
+
+def estimate_size(value):
+    """估算缓存值占用的字节数，张量和数组按实际数据大小计算"""
+    if isinstance(value, torch.Tensor):
+        return value.nelement() * value.element_size()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k) + estimate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+class CanvasCache:
+    """
+    字节预算LRU缓存
+
+    - 写入时按 estimate_size 计入字节数，超出预算时淘汰最久未使用的条目
+    - 每个条目可单独设置TTL，过期条目在访问时移除
+    - 统计命中、未命中、淘汰和过期次数
+    """
+
+    def __init__(self, budget_bytes=DEFAULT_CACHE_BUDGET_BYTES, default_ttl=DEFAULT_CACHE_TTL):
+        self.budget_bytes = budget_bytes
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, _, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = estimate_size(value)
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl and ttl > 0 else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.budget_bytes:
+                # 单个条目超过总预算时不缓存
+                return False
+            self._entries[key] = (value, size, expires_at)
+            self.total_bytes += size
+            while self.total_bytes > self.budget_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries[key][0]
+            self._remove(key)
+            return value
+
+    def __contains__(self, key):
+        return self.get(key, None) is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'total_bytes': self.total_bytes,
+                'budget_bytes': self.budget_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class CanvasCacheView:
+    """CanvasCache 的命名空间视图，提供与dict相同的常用接口"""
+
+    def __init__(self, cache, namespace):
+        self.cache = cache
+        self.namespace = namespace
+
+    def get(self, key, default=None):
+        return self.cache.get((self.namespace, key), default)
+
+    def set(self, key, value, ttl=None):
+        return self.cache.set((self.namespace, key), value, ttl)
+
+    def pop(self, key, default=None):
+        return self.cache.pop((self.namespace, key), default)
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        return (self.namespace, key) in self.cache
+
+
+class CanvasDiskCache:
+    """
+    画布输出的磁盘缓存
+
+    - 每个条目以状态哈希为键，保存为 <key>.png（像素）、可选的 <key>.mask.png 和 <key>.json（LAYER_INFO）
+    - 文件修改时间作为LRU顺序，总大小超出预算时删除最久未使用的条目
+    - warm_load() 在启动时扫描目录重建索引
+    """
+
+    def __init__(self, cache_dir=DISK_CACHE_DIR, budget_bytes=DISK_CACHE_BUDGET_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.budget_bytes = budget_bytes
+        self._lock = threading.RLock()
+        self._index = OrderedDict()  # key -> 条目总字节数
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _paths(self, key):
+        return (self.cache_dir / f"{key}.png",
+                self.cache_dir / f"{key}.mask.png",
+                self.cache_dir / f"{key}.json")
+
+    def warm_load(self):
+        """扫描缓存目录，按修改时间重建LRU索引（只执行一次，并发调用会等待首次扫描完成）"""
+        with self._load_lock:
+            if self._loaded:
+                return len(self._index)
+            count = self._scan()
+            self._loaded = True
+            return count
+
+    def _scan(self):
+        entries = []
+        try:
+            for meta_path in self.cache_dir.glob("*.json"):
+                key = meta_path.stem
+                size = 0
+                for path in self._paths(key):
+                    try:
+                        size += path.stat().st_size
+                    except OSError:
+                        pass
+                entries.append((meta_path.stat().st_mtime, key, size))
+        except OSError:
+            entries = []
+
+        entries.sort()
+        with self._lock:
+            for _, key, size in entries:
+                if key not in self._index:
+                    self._index[key] = size
+                    self.total_bytes += size
+            self._enforce_budget()
+        return len(entries)
+
+    def __contains__(self, key):
+        self.warm_load()
+        with self._lock:
+            return key in self._index
+
+    def get(self, key):
+        """
+        读取缓存的输出
+
+        Returns:
+            (CanvasFrame, layer_info)，不存在或已损坏时返回None
+        """
+        self.warm_load()
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+
+        image_path, mask_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                layer_info = json.load(f)
+            with Image.open(image_path) as image:
+                pixels = np.array(image.convert('RGB'))
+            mask = None
+            if mask_path.exists():
+                with Image.open(mask_path) as image:
+                    mask = np.array(image.convert('L'))
+            now = time.time()
+            os.utime(meta_path, (now, now))
+        except (OSError, ValueError):
+            # 条目被外部删除或损坏
+            with self._lock:
+                self._remove(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return CanvasFrame(pixels, mask), layer_info
+
+    def set(self, key, frame, layer_info):
+        """写入输出，先写临时文件再原子替换"""
+        self.warm_load()
+        image_path, mask_path, meta_path = self._paths(key)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            written = []
+            for path, array in ((image_path, frame.pixels), (mask_path, frame.mask)):
+                if array is None:
+                    continue
+                tmp_path = path.with_name(path.name + '.tmp')
+                Image.fromarray(array).save(tmp_path, format='PNG', compress_level=1)
+                os.replace(tmp_path, path)
+                written.append(path)
+            # 元数据最后写入，作为条目完整的标志
+            tmp_path = meta_path.with_name(meta_path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(layer_info, f, ensure_ascii=False)
+            os.replace(tmp_path, meta_path)
+            written.append(meta_path)
+            size = sum(path.stat().st_size for path in written)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[Super Canvas] 写入磁盘缓存失败: {e}")
+            return False
+
+        with self._lock:
+            if key in self._index:
+                self.total_bytes -= self._index.pop(key)
+            self._index[key] = size
+            self.total_bytes += size
+            self._enforce_budget()
+        return True
+
+    def _remove(self, key):
+        size = self._index.pop(key, None)
+        if size is not None:
+            self.total_bytes -= size
+        for path in self._paths(key):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def _enforce_budget(self):
+        while self.total_bytes > self.budget_bytes and self._index:
+            self._remove(next(iter(self._index)))
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._index),
+                'total_bytes': self.total_bytes,
+                'budget_bytes': self.budget_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
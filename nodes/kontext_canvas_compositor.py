@@ -0,0 +1,829 @@
+#!/usr/bin/env python3
+"""
+Super Canvas 服务端图层合成
+根据 layer_transforms 对图层位图做仿射变换和alpha混合，生成画布输出；
+并提供无需浏览器的 fabric JSON 光栅化
+"""
+
+import math
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+# 默认画布背景色
+DEFAULT_BACKGROUND = (255, 255, 255)
+
+
+class MissingAssetError(Exception):
+    """合成所需的图层资源不在服务器上"""
+
+    def __init__(self, asset_ids):
+        super().__init__(f"缺少图层资源: {', '.join(asset_ids)}")
+        self.asset_ids = list(asset_ids)
+
+
+def parse_rgba(color):
+    """解析CSS颜色为 (r, g, b, a)，a 取值0-255；透明或无法解析时返回None"""
+    if not isinstance(color, str):
+        return None
+    color = color.strip()
+    if not color or color in ('transparent', 'none'):
+        return None
+    try:
+        if color.startswith('rgba('):
+            # CSS的alpha为0-1小数，ImageColor按0-255解析
+            values = [float(v) for v in color[5:color.index(')')].split(',')]
+            value = tuple(int(round(v)) for v in values[:3]) + (int(round(values[3] * 255)),)
+        else:
+            value = ImageColor.getrgb(color)
+    except (ValueError, IndexError):
+        return None
+    if len(value) == 3:
+        return value + (255,)
+    return value if value[3] > 0 else None
+
+
+def parse_color(color, default=DEFAULT_BACKGROUND):
+    """解析背景色为 (r, g, b)"""
+    rgba = parse_rgba(color)
+    return rgba[:3] if rgba is not None else default
+
+
+def layer_affine(transform, source_width, source_height):
+    """
+    计算图层位图到画布坐标的 2x3 仿射矩阵（与fabric.js的变换顺序一致）
+
+    fabric以对象中心为原点: 平移到中心 · 旋转 · 缩放 · 翻转。
+    transform 中的 width/height 为对象的本征尺寸，位图尺寸不同时按比例换算。
+    """
+    width = float(transform.get('width') or source_width)
+    height = float(transform.get('height') or source_height)
+    sx = float(transform.get('scaleX', 1)) * width / source_width
+    sy = float(transform.get('scaleY', 1)) * height / source_height
+    if transform.get('flipX'):
+        sx = -sx
+    if transform.get('flipY'):
+        sy = -sy
+
+    theta = math.radians(float(transform.get('angle', 0)))
+    cos_t, sin_t = math.cos(theta), math.sin(theta)
+    linear = np.array([[cos_t * sx, -sin_t * sy],
+                       [sin_t * sx, cos_t * sy]], dtype=np.float64)
+    center = np.array([float(transform.get('centerX', 0)), float(transform.get('centerY', 0))])
+    offset = center - linear @ np.array([source_width / 2.0, source_height / 2.0])
+
+    # OpenCV以像素中心为整数坐标，做半像素修正
+    offset = offset + linear @ np.array([0.5, 0.5]) - 0.5
+    return np.hstack([linear, offset[:, None]])
+
+
+def _warp_bounds(matrix, source_width, source_height, canvas_width, canvas_height):
+    """计算变换后位图在画布上的包围盒（已裁剪到画布范围）"""
+    corners = np.array([[0, 0, 1], [source_width, 0, 1],
+                        [0, source_height, 1], [source_width, source_height, 1]], dtype=np.float64)
+    projected = corners @ matrix.T
+    x0 = max(int(math.floor(projected[:, 0].min())) - 1, 0)
+    y0 = max(int(math.floor(projected[:, 1].min())) - 1, 0)
+    x1 = min(int(math.ceil(projected[:, 0].max())) + 1, canvas_width)
+    y1 = min(int(math.ceil(projected[:, 1].max())) + 1, canvas_height)
+    return x0, y0, x1, y1
+
+
+def _layer_coverage(matrix, bounds, source_width, source_height):
+    """
+    位图在目标区域内每个像素的覆盖率 (y1-y0, x1-x0)，取值0-1
+
+    按像素中心到位图各边（源图 [-0.5, w-0.5] 范围）的画布距离估计，
+    边缘与像素网格对齐时内部为1、外部为0，不对齐时为抗锯齿的部分覆盖
+    """
+    x0, y0, x1, y1 = bounds
+    inverse = cv2.invertAffineTransform(matrix)
+    ys, xs = np.mgrid[y0:y1, x0:x1].astype(np.float32)
+    coverage = np.ones((y1 - y0, x1 - x0), dtype=np.float32)
+    for row, extent in ((inverse[0], source_width), (inverse[1], source_height)):
+        position = row[0] * xs + row[1] * ys + row[2]
+        # 源图坐标每单位对应的画布像素数
+        scale = 1.0 / max(math.hypot(row[0], row[1]), 1e-12)
+        distance = np.minimum(position + 0.5, extent - 0.5 - position) * scale
+        coverage *= np.clip(distance + 0.5, 0.0, 1.0)
+    return coverage
+
+
+def blend_layer(canvas, rgba, matrix, opacity=1.0):
+    """
+    将一个RGBA位图按仿射矩阵变换后混合到浮点画布上（原地修改）
+
+    canvas 为 (H, W, 3) 不透明画布，或 (H, W, 4) 预乘RGBA的透明图层
+
+    只在位图包围盒内做变换和混合；变换前预乘alpha以避免边缘色边。
+    插值时边界按最近像素延拓，再乘以位图的覆盖率，避免放大后边缘混入透明黑色
+    """
+    canvas_height, canvas_width = canvas.shape[:2]
+    source_height, source_width = rgba.shape[:2]
+    x0, y0, x1, y1 = _warp_bounds(matrix, source_width, source_height, canvas_width, canvas_height)
+    if x1 <= x0 or y1 <= y0:
+        return canvas
+
+    premultiplied = rgba.astype(np.float32)
+    alpha = premultiplied[:, :, 3:4] * (float(opacity) / 255.0)
+    premultiplied[:, :, :3] *= alpha
+    premultiplied[:, :, 3:4] = alpha
+
+    local = matrix.copy()
+    local[:, 2] -= (x0, y0)
+    warped = cv2.warpAffine(
+        premultiplied, local, (x1 - x0, y1 - y0),
+        flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE
+    )
+    warped *= _layer_coverage(matrix, (x0, y0, x1, y1), source_width, source_height)[:, :, None]
+
+    # 3通道画布为不透明结果；4通道画布为预乘RGBA，alpha同样按 over 运算累积
+    region = canvas[y0:y1, x0:x1]
+    region *= 1.0 - warped[:, :, 3:4]
+    region += warped[:, :, :region.shape[2]]
+    return canvas
+
+
+def visible_layers(layer_transforms):
+    """按 z_index 排序返回可见图层 (layer_id, transform)"""
+    layers = [
+        (layer_id, transform) for layer_id, transform in layer_transforms.items()
+        if layer_id != 'background' and isinstance(transform, dict) and transform.get('visible', True)
+    ]
+    layers.sort(key=lambda item: item[1].get('z_index', 0))
+    return layers
+
+
+def composite_layers(layer_transforms, get_asset, width, height, background=None):
+    """
+    在服务端合成画布
+
+    Args:
+        layer_transforms: 前端 extractTransformData() 的结果，图像图层带 asset_id
+        get_asset: asset_id -> uint8 (H, W, 4) 数组，不存在时返回None
+        width, height: 画布尺寸
+        background: 背景色字符串
+
+    Returns:
+        numpy.ndarray: uint8 (H, W, 3) 合成结果
+    """
+    layers = visible_layers(layer_transforms)
+    assets = {}
+    missing = []
+    for _, transform in layers:
+        asset_id = transform.get('asset_id')
+        if asset_id and asset_id not in assets:
+            rgba = get_asset(asset_id)
+            if rgba is None:
+                missing.append(asset_id)
+            assets[asset_id] = rgba
+    if missing:
+        raise MissingAssetError(missing)
+
+    canvas = np.empty((height, width, 3), dtype=np.float32)
+    canvas[:] = parse_color(background)
+
+    for _, transform in layers:
+        rgba = assets.get(transform.get('asset_id'))
+        if rgba is None:
+            continue
+        matrix = layer_affine(transform, rgba.shape[1], rgba.shape[0])
+        blend_layer(canvas, rgba, matrix, transform.get('opacity', 1.0))
+
+    np.clip(canvas, 0, 255, out=canvas)
+    return (canvas + 0.5).astype(np.uint8)
+
+
+# ---------------------------------------------------------------------------
+# fabric JSON 光栅化
+# ---------------------------------------------------------------------------
+
+# 服务端可以光栅化的fabric对象类型
+RASTER_SHAPE_TYPES = ('rect', 'circle', 'ellipse', 'line', 'path', 'polygon', 'polyline')
+RASTER_TEXT_TYPES = ('text', 'i-text', 'textbox')
+RASTER_TYPES = RASTER_SHAPE_TYPES + RASTER_TEXT_TYPES + ('image',)
+
+# 局部位图的最大超采样倍数和最大边长
+MAX_RASTER_SCALE = 8.0
+MAX_RASTER_SIDE = 8192
+
+_ORIGIN_OFFSETS = {'left': 0.0, 'center': 0.5, 'right': 1.0, 'top': 0.0, 'bottom': 1.0}
+
+
+def is_renderable_scene(scene):
+    """场景中的所有对象都能在服务端光栅化时返回True"""
+    for obj in scene.get('objects') or []:
+        if obj.get('type') not in RASTER_TYPES:
+            return False
+        if obj.get('clipPath') or obj.get('filters') or obj.get('skewX') or obj.get('skewY'):
+            return False
+        if obj.get('type') == 'image' and not obj.get('asset_id'):
+            return False
+    return True
+
+
+def _origin(value, default=0.0):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return _ORIGIN_OFFSETS.get(value, default)
+
+
+def object_transform(obj, box_width, box_height):
+    """
+    将fabric对象的 left/top/origin 换算为以中心为原点的变换（供 layer_affine 使用）
+
+    box_width / box_height 为对象本征尺寸（含描边），与fabric的 _getTransformedDimensions 一致
+    """
+    scale_x = float(obj.get('scaleX', 1))
+    scale_y = float(obj.get('scaleY', 1))
+    angle = float(obj.get('angle', 0))
+    dim_w, dim_h = box_width * scale_x, box_height * scale_y
+    offset_x = (0.5 - _origin(obj.get('originX', 'left'))) * dim_w
+    offset_y = (0.5 - _origin(obj.get('originY', 'top'))) * dim_h
+    theta = math.radians(angle)
+    cos_t, sin_t = math.cos(theta), math.sin(theta)
+    return {
+        'centerX': float(obj.get('left', 0)) + cos_t * offset_x - sin_t * offset_y,
+        'centerY': float(obj.get('top', 0)) + sin_t * offset_x + cos_t * offset_y,
+        'scaleX': scale_x,
+        'scaleY': scale_y,
+        'angle': angle,
+        'flipX': obj.get('flipX', False),
+        'flipY': obj.get('flipY', False),
+        'width': box_width,
+        'height': box_height,
+    }
+
+
+def _flatten_path(commands, steps=16):
+    """将SVG路径命令（fabric path数组）展开为折线列表 [(points, closed), ...]"""
+    polylines = []
+    current = []
+    x = y = start_x = start_y = 0.0
+    t = np.linspace(0.0, 1.0, steps + 1)[1:, None]
+
+    for command in commands or []:
+        if not command:
+            continue
+        op, args = command[0], [float(v) for v in command[1:]]
+        relative = op.islower()
+        op = op.upper()
+        base_x, base_y = (x, y) if relative else (0.0, 0.0)
+
+        if op == 'M':
+            if len(current) > 1:
+                polylines.append((np.array(current), False))
+            x, y = base_x + args[0], base_y + args[1]
+            start_x, start_y = x, y
+            current = [(x, y)]
+            # M后的额外坐标视为L
+            for i in range(2, len(args) - 1, 2):
+                x, y = (x + args[i], y + args[i + 1]) if relative else (args[i], args[i + 1])
+                current.append((x, y))
+        elif op == 'L':
+            x, y = base_x + args[0], base_y + args[1]
+            current.append((x, y))
+        elif op == 'H':
+            x = (x + args[0]) if relative else args[0]
+            current.append((x, y))
+        elif op == 'V':
+            y = (y + args[0]) if relative else args[0]
+            current.append((x, y))
+        elif op == 'Q':
+            p0 = np.array([x, y])
+            p1 = np.array([base_x + args[0], base_y + args[1]])
+            p2 = np.array([base_x + args[2], base_y + args[3]])
+            curve = (1 - t) ** 2 * p0 + 2 * (1 - t) * t * p1 + t ** 2 * p2
+            current.extend(map(tuple, curve))
+            x, y = p2
+        elif op == 'C':
+            p0 = np.array([x, y])
+            p1 = np.array([base_x + args[0], base_y + args[1]])
+            p2 = np.array([base_x + args[2], base_y + args[3]])
+            p3 = np.array([base_x + args[4], base_y + args[5]])
+            curve = ((1 - t) ** 3 * p0 + 3 * (1 - t) ** 2 * t * p1
+                     + 3 * (1 - t) * t ** 2 * p2 + t ** 3 * p3)
+            current.extend(map(tuple, curve))
+            x, y = p3
+        elif op == 'Z':
+            if len(current) > 1:
+                polylines.append((np.array(current), True))
+            x, y = start_x, start_y
+            current = [(x, y)]
+
+    if len(current) > 1:
+        polylines.append((np.array(current), False))
+    return polylines
+
+
+def shape_geometry(obj):
+    """
+    返回对象在本地坐标系（以对象中心为原点，未含描边）中的几何
+
+    Returns:
+        (width, height, polylines): polylines 为 [(N x 2 数组, 是否闭合), ...]
+    """
+    kind = obj.get('type')
+    width = float(obj.get('width', 0))
+    height = float(obj.get('height', 0))
+
+    if kind == 'rect':
+        w2, h2 = width / 2.0, height / 2.0
+        return width, height, [(np.array([[-w2, -h2], [w2, -h2], [w2, h2], [-w2, h2]]), True)]
+
+    if kind in ('circle', 'ellipse'):
+        if kind == 'circle':
+            rx = ry = float(obj.get('radius', width / 2.0))
+        else:
+            rx, ry = float(obj.get('rx', width / 2.0)), float(obj.get('ry', height / 2.0))
+        start = float(obj.get('startAngle', 0))
+        end = float(obj.get('endAngle', 2 * math.pi))
+        # fabric 4 中角度以弧度保存
+        theta = np.linspace(start, end, 96)
+        points = np.stack([rx * np.cos(theta), ry * np.sin(theta)], axis=1)
+        return 2 * rx, 2 * ry, [(points, abs(end - start) >= 2 * math.pi - 1e-6)]
+
+    if kind == 'line':
+        x1, y1 = float(obj.get('x1', 0)), float(obj.get('y1', 0))
+        x2, y2 = float(obj.get('x2', 0)), float(obj.get('y2', 0))
+        cx, cy = (min(x1, x2) + max(x1, x2)) / 2.0, (min(y1, y2) + max(y1, y2)) / 2.0
+        return abs(x2 - x1), abs(y2 - y1), [(np.array([[x1 - cx, y1 - cy], [x2 - cx, y2 - cy]]), False)]
+
+    if kind in ('polygon', 'polyline'):
+        points = np.array([[float(p.get('x', 0)), float(p.get('y', 0))] for p in obj.get('points') or []])
+        if points.size == 0:
+            return width, height, []
+        offset = (points.min(axis=0) + points.max(axis=0)) / 2.0
+        return width, height, [(points - offset, kind == 'polygon')]
+
+    if kind == 'path':
+        polylines = _flatten_path(obj.get('path'))
+        if not polylines:
+            return width, height, []
+        all_points = np.concatenate([points for points, _ in polylines])
+        # fabric的 pathOffset 为路径包围盒中心
+        offset = (all_points.min(axis=0) + all_points.max(axis=0)) / 2.0
+        return width, height, [(points - offset, closed) for points, closed in polylines]
+
+    return width, height, []
+
+
+def _raster_scale(obj):
+    scale = max(abs(float(obj.get('scaleX', 1))), abs(float(obj.get('scaleY', 1))), 1.0)
+    return min(scale, MAX_RASTER_SCALE)
+
+
+def rasterize_shape(obj):
+    """
+    将形状对象绘制为本地RGBA位图
+
+    Returns:
+        (rgba, box_width, box_height) 或 None
+    """
+    width, height, polylines = shape_geometry(obj)
+    stroke = parse_rgba(obj.get('stroke'))
+    stroke_width = float(obj.get('strokeWidth', 0) or 0) if stroke else 0.0
+    fill = parse_rgba(obj.get('fill'))
+    if obj.get('type') in ('line', 'polyline'):
+        fill = None
+    if not polylines or (fill is None and stroke is None):
+        return None
+
+    box_w, box_h = width + stroke_width, height + stroke_width
+    k = _raster_scale(obj)
+    k = min(k, MAX_RASTER_SIDE / max(box_w, box_h, 1.0))
+    bitmap_w = max(int(math.ceil(box_w * k)), 1)
+    bitmap_h = max(int(math.ceil(box_h * k)), 1)
+    rgba = np.zeros((bitmap_h, bitmap_w, 4), dtype=np.uint8)
+
+    # 使用cv2的亚像素坐标（shift=4）绘制抗锯齿图形
+    shift = 4
+    factor = float(1 << shift)
+    center = np.array([bitmap_w / 2.0, bitmap_h / 2.0])
+    scaled = [((((points * k) + center - 0.5) * factor).round().astype(np.int32), closed)
+              for points, closed in polylines]
+
+    # 分别绘制填充和描边的覆盖率，再按非预乘alpha合成（描边在上）
+    premultiplied = np.zeros((bitmap_h, bitmap_w, 3), dtype=np.float32)
+    alpha = np.zeros((bitmap_h, bitmap_w), dtype=np.float32)
+    layers = []
+    if fill is not None:
+        coverage = np.zeros((bitmap_h, bitmap_w), dtype=np.uint8)
+        cv2.fillPoly(coverage, [points for points, _ in scaled], 255, lineType=cv2.LINE_AA, shift=shift)
+        layers.append((coverage, fill))
+    if stroke is not None and stroke_width > 0:
+        coverage = np.zeros((bitmap_h, bitmap_w), dtype=np.uint8)
+        thickness = max(int(round(stroke_width * k)), 1)
+        for points, closed in scaled:
+            cv2.polylines(coverage, [points], closed, 255, thickness=thickness,
+                          lineType=cv2.LINE_AA, shift=shift)
+        layers.append((coverage, stroke))
+
+    for coverage, color in layers:
+        layer_alpha = coverage.astype(np.float32) * (color[3] / (255.0 * 255.0))
+        premultiplied *= (1.0 - layer_alpha)[:, :, None]
+        premultiplied += layer_alpha[:, :, None] * np.array(color[:3], dtype=np.float32)
+        alpha = layer_alpha + alpha * (1.0 - layer_alpha)
+
+    rgba[:, :, :3] = np.clip(premultiplied / np.maximum(alpha, 1e-6)[:, :, None] + 0.5, 0, 255)
+    rgba[:, :, 3] = np.clip(alpha * 255.0 + 0.5, 0, 255)
+    return rgba, box_w, box_h
+
+
+def _load_font(font_size, font_family=None):
+    for name in filter(None, [font_family, 'DejaVuSans.ttf', 'arial.ttf']):
+        try:
+            return ImageFont.truetype(name, font_size)
+        except (OSError, AttributeError):
+            continue
+    try:
+        return ImageFont.load_default(size=font_size)
+    except TypeError:
+        # Pillow < 10.1 的默认字体不支持缩放
+        return ImageFont.load_default()
+
+
+def rasterize_text(obj):
+    """将文本对象绘制为本地RGBA位图（字体与浏览器可能略有差异）"""
+    fill = parse_rgba(obj.get('fill')) or (0, 0, 0, 255)
+    text = str(obj.get('text', ''))
+    if not text:
+        return None
+
+    k = _raster_scale(obj)
+    font_size = float(obj.get('fontSize', 40))
+    font = _load_font(max(int(round(font_size * k)), 1), obj.get('fontFamily'))
+    line_height = float(obj.get('lineHeight', 1.16)) * font_size * k
+    width = float(obj.get('width', 0))
+    height = float(obj.get('height', 0))
+    bitmap_w = max(int(math.ceil(width * k)), 1)
+    bitmap_h = max(int(math.ceil(height * k)), 1)
+
+    image = Image.new('RGBA', (bitmap_w, bitmap_h), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    align = obj.get('textAlign', 'left')
+    for index, line in enumerate(text.split('\n')):
+        line_width = draw.textlength(line, font=font) if hasattr(draw, 'textlength') else font.getsize(line)[0]
+        if align == 'center':
+            x = (bitmap_w - line_width) / 2.0
+        elif align == 'right':
+            x = bitmap_w - line_width
+        else:
+            x = 0
+        draw.text((x, index * line_height), line, font=font, fill=tuple(fill))
+    return np.array(image), width, height
+
+
+def render_objects(canvas, objects, get_asset):
+    """
+    将fabric对象依次混合到画布上（原地修改）
+
+    Returns:
+        list: 缺失的图层资源ID
+    """
+    missing = []
+    for obj in objects:
+        if not obj.get('visible', True):
+            continue
+        kind = obj.get('type')
+        opacity = float(obj.get('opacity', 1.0))
+
+        if kind == 'image':
+            rgba = get_asset(obj.get('asset_id'))
+            if rgba is None:
+                missing.append(obj.get('asset_id'))
+                continue
+            box_w = float(obj.get('width') or rgba.shape[1])
+            box_h = float(obj.get('height') or rgba.shape[0])
+        elif kind in RASTER_TEXT_TYPES:
+            result = rasterize_text(obj)
+            if result is None:
+                continue
+            rgba, box_w, box_h = result
+        elif kind in RASTER_SHAPE_TYPES:
+            result = rasterize_shape(obj)
+            if result is None:
+                continue
+            rgba, box_w, box_h = result
+        else:
+            continue
+
+        transform = object_transform(obj, box_w, box_h)
+        matrix = layer_affine(transform, rgba.shape[1], rgba.shape[0])
+        blend_layer(canvas, rgba, matrix, opacity)
+    return missing
+
+
+def render_fabric_scene(scene, get_asset):
+    """
+    在服务端渲染保存的fabric画布场景
+
+    Args:
+        scene: {'width', 'height', 'background', 'objects': fabric toJSON()的对象列表，
+               图像对象以 asset_id 代替 src}
+        get_asset: asset_id -> uint8 (H, W, 4) 数组
+
+    Returns:
+        numpy.ndarray: uint8 (H, W, 3)
+    """
+    width = int(scene.get('width', 512))
+    height = int(scene.get('height', 512))
+    canvas = np.empty((height, width, 3), dtype=np.float32)
+    canvas[:] = parse_color(scene.get('background'))
+
+    missing = render_objects(canvas, scene.get('objects') or [], get_asset)
+    if missing:
+        raise MissingAssetError(missing)
+
+    np.clip(canvas, 0, 255, out=canvas)
+    return (canvas + 0.5).astype(np.uint8)
+
+
+# ---------------------------------------------------------------------------
+# 批量合成
+# ---------------------------------------------------------------------------
+
+# 前端放置上游输入图像的图层名称
+INPUT_LAYER_NAME = 'InputImage'
+
+# 每次变换的帧数，限制中间张量的内存
+BATCH_CHUNK_SIZE = 16
+
+
+def split_input_layer(scene):
+    """
+    将场景对象拆分为 (输入图层下方的对象, 输入图层, 输入图层上方的对象)
+
+    没有输入图层时返回的输入图层为None，批量帧铺满画布作为最底层
+    """
+    objects = scene.get('objects') or []
+    for index, obj in enumerate(objects):
+        if obj.get('type') == 'image' and obj.get('name') == INPUT_LAYER_NAME:
+            return objects[:index], obj, objects[index + 1:]
+    return [], None, objects
+
+
+def _warp_frames(frames, matrix, bounds, opacity):
+    """
+    用 grid_sample 对一组帧做同一个仿射变换
+
+    Args:
+        frames: float32 张量 (B, 4, h, w)，第4通道为全1覆盖率
+        matrix: 源图到画布的 2x3 矩阵（OpenCV像素中心约定）
+        bounds: 画布上的目标区域 (x0, y0, x1, y1)
+
+    Returns:
+        张量 (B, y1-y0, x1-x0, 4): 预乘RGB与alpha，与 blend_layer 的 warpAffine 结果一致
+    """
+    x0, y0, x1, y1 = bounds
+    source_h, source_w = frames.shape[2:]
+    inverse = cv2.invertAffineTransform(matrix)
+    ys, xs = torch.meshgrid(
+        torch.arange(y0, y1, dtype=torch.float32),
+        torch.arange(x0, x1, dtype=torch.float32),
+        indexing='ij'
+    )
+    src_x = inverse[0, 0] * xs + inverse[0, 1] * ys + inverse[0, 2]
+    src_y = inverse[1, 0] * xs + inverse[1, 1] * ys + inverse[1, 2]
+    grid = torch.stack([
+        src_x * (2.0 / max(source_w - 1, 1)) - 1.0,
+        src_y * (2.0 / max(source_h - 1, 1)) - 1.0,
+    ], dim=-1).unsqueeze(0).expand(frames.shape[0], -1, -1, -1)
+    warped = F.grid_sample(frames, grid, mode='bilinear', padding_mode='border', align_corners=True)
+    warped = warped.permute(0, 2, 3, 1)
+    # 边界延拓后按位图覆盖率预乘，再乘以图层不透明度
+    coverage = torch.from_numpy(_layer_coverage(matrix, bounds, source_w, source_h))
+    return warped.mul_(coverage[None, :, :, None] * float(opacity))
+
+
+def render_scene_batch(scene, frames, get_asset, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    将同一场景布局应用到一批帧上
+
+    输入图层（InputImage）依次替换为每一帧；其下方和上方的对象只渲染一次，
+    每批帧只做一次向量化的变换和混合
+
+    Args:
+        scene: 保存的fabric场景
+        frames: uint8 (B, h, w, 3) 数组
+        get_asset: asset_id -> uint8 (H, W, 4) 数组
+
+    Returns:
+        numpy.ndarray: uint8 (B, H, W, 3)
+    """
+    width = int(scene.get('width', 512))
+    height = int(scene.get('height', 512))
+    below, input_obj, above = split_input_layer(scene)
+
+    base = np.empty((height, width, 3), dtype=np.float32)
+    base[:] = parse_color(scene.get('background'))
+    overlay = np.zeros((height, width, 4), dtype=np.float32)
+    missing = render_objects(base, below, get_asset) + render_objects(overlay, above, get_asset)
+    if missing:
+        raise MissingAssetError(missing)
+
+    source_h, source_w = frames.shape[1:3]
+    if input_obj is not None:
+        transform = object_transform(
+            input_obj, float(input_obj.get('width') or source_w), float(input_obj.get('height') or source_h)
+        )
+        opacity = float(input_obj.get('opacity', 1.0)) if input_obj.get('visible', True) else 0.0
+    else:
+        transform = {'centerX': width / 2.0, 'centerY': height / 2.0,
+                     'scaleX': width / source_w, 'scaleY': height / source_h,
+                     'width': source_w, 'height': source_h}
+        opacity = 1.0
+    matrix = layer_affine(transform, source_w, source_h)
+    bounds = _warp_bounds(matrix, source_w, source_h, width, height)
+    x0, y0, x1, y1 = bounds
+
+    base_t = torch.from_numpy(base)
+    overlay_t = torch.from_numpy(overlay)
+    output = np.empty((frames.shape[0], height, width, 3), dtype=np.uint8)
+    for start in range(0, frames.shape[0], chunk_size):
+        chunk = torch.from_numpy(frames[start:start + chunk_size]).permute(0, 3, 1, 2).to(torch.float32)
+        result = base_t.unsqueeze(0).repeat(chunk.shape[0], 1, 1, 1)
+        if x1 > x0 and y1 > y0 and opacity > 0:
+            coverage = torch.full_like(chunk[:, :1], 255.0)
+            warped = _warp_frames(torch.cat([chunk, coverage], dim=1), matrix, bounds, opacity)
+            region = result[:, y0:y1, x0:x1]
+            region.mul_(1.0 - warped[..., 3:] / 255.0).add_(warped[..., :3])
+        # 上方对象为预乘RGBA图层
+        result.mul_(1.0 - overlay_t[..., 3:]).add_(overlay_t[..., :3])
+        output[start:start + chunk.shape[0]] = result.clamp_(0, 255).add_(0.5).to(torch.uint8).numpy()
+    return output
+
+
+# ---------------------------------------------------------------------------
+# 标注遮罩
+# ---------------------------------------------------------------------------
+
+# 生成遮罩的标注类型（文本按其包围框生成遮罩）
+ANNOTATION_TYPES = RASTER_SHAPE_TYPES + RASTER_TEXT_TYPES
+
+# 遮罩的超采样倍数: 每个像素的覆盖率由 SxS 个子像素求得
+MASK_SUPERSAMPLE = 4
+
+
+def object_matrix(obj, box_width, box_height):
+    """对象本地坐标（以对象中心为原点）到画布坐标的 2x3 仿射矩阵，与fabric的 calcTransformMatrix 一致（不含斜切）"""
+    transform = object_transform(obj, box_width, box_height)
+    theta = math.radians(transform['angle'])
+    cos_t, sin_t = math.cos(theta), math.sin(theta)
+    sx = transform['scaleX'] * (-1.0 if transform['flipX'] else 1.0)
+    sy = transform['scaleY'] * (-1.0 if transform['flipY'] else 1.0)
+    return np.array([
+        [cos_t * sx, -sin_t * sy, transform['centerX']],
+        [sin_t * sx, cos_t * sy, transform['centerY']],
+    ], dtype=np.float64)
+
+
+def canvas_to_target_matrix(canvas_size, target_size, output_transform=None):
+    """
+    画布坐标到目标遮罩坐标的 2x3 矩阵
+
+    output_transform 为分辨率对齐时记录的裁剪框和缩放（见 kontext_canvas_resample.fit_frame），
+    目标尺寸与输出尺寸不同时再整体缩放
+    """
+    if output_transform:
+        x0, y0 = output_transform['crop'][:2]
+        sx, sy = output_transform['scale_x'], output_transform['scale_y']
+        base_w, base_h = output_transform['width'], output_transform['height']
+    else:
+        x0 = y0 = 0.0
+        sx = sy = 1.0
+        base_w, base_h = canvas_size
+    sx *= target_size[0] / base_w
+    sy *= target_size[1] / base_h
+    return np.array([[sx, 0.0, -x0 * sx], [0.0, sy, -y0 * sy]], dtype=np.float64)
+
+
+def _coverage_raster(target_size, filled, strokes, thickness, antialias=True):
+    """
+    在几何包围盒内超采样绘制，返回每个像素的覆盖率
+
+    antialias 为True时返回软遮罩（覆盖率0-255，边缘平滑且面积与图形一致）；
+    为False时覆盖过半的像素为255、其余为0，遮罩同样不会向外扩大
+
+    Args:
+        filled: 需要填充的闭合多边形（目标坐标系的连续坐标）
+        strokes: 需要描边的 [(点, 是否闭合), ...]
+        thickness: 描边宽度（目标像素）
+    """
+    width, height = target_size
+    mask = np.zeros((height, width), dtype=np.uint8)
+    all_points = np.concatenate(filled + [points for points, _ in strokes])
+    margin = thickness / 2.0 + 1.0 if strokes else 1.0
+    x0 = max(int(math.floor(all_points[:, 0].min() - margin)), 0)
+    y0 = max(int(math.floor(all_points[:, 1].min() - margin)), 0)
+    x1 = min(int(math.ceil(all_points[:, 0].max() + margin)), width)
+    y1 = min(int(math.ceil(all_points[:, 1].max() + margin)), height)
+    if x1 <= x0 or y1 <= y0:
+        return mask
+
+    s = MASK_SUPERSAMPLE
+    shift = 4
+    factor = float(1 << shift)
+    origin = np.array([x0, y0], dtype=np.float64)
+
+    def to_fixed(points):
+        # 连续坐标转换为子像素中心坐标
+        return (((points - origin) * s - 0.5) * factor).round().astype(np.int32)
+
+    canvas = np.zeros(((y1 - y0) * s, (x1 - x0) * s), dtype=np.uint8)
+    if filled:
+        cv2.fillPoly(canvas, [to_fixed(points) for points in filled], 255, lineType=cv2.LINE_8, shift=shift)
+    for points, closed in strokes:
+        cv2.polylines(canvas, [to_fixed(points)], closed, 255, thickness=max(int(round(thickness * s)), 1),
+                      lineType=cv2.LINE_8, shift=shift)
+    # cv2 的扫描线填充包含右端和下端的子像素，去掉后子像素面积与图形一致
+    canvas[:-1, :-1] &= canvas[1:, :-1] & canvas[:-1, 1:]
+    canvas[-1, :] = 0
+    canvas[:, -1] = 0
+    # 区域插值得到每个像素的子像素覆盖率（0-255）
+    coverage = cv2.resize(canvas, (x1 - x0, y1 - y0), interpolation=cv2.INTER_AREA)
+    if not antialias:
+        coverage = np.where(coverage > 128, 255, 0).astype(np.uint8)
+    mask[y0:y1, x0:x1] = coverage
+    return mask
+
+
+def rasterize_annotation(obj, matrix, target_size, antialias=True):
+    """
+    将单个标注对象光栅化为遮罩
+
+    闭合图形按区域填充（与填充色无关），开放路径和线条按描边宽度绘制；
+    antialias 为True时边缘为按覆盖率的软过渡，为False时为二值遮罩
+
+    Returns:
+        numpy.ndarray: uint8 (H, W)，对象不可见或没有几何时返回None
+    """
+    if not obj.get('visible', True):
+        return None
+    kind = obj.get('type')
+    if kind in RASTER_TEXT_TYPES:
+        width, height = float(obj.get('width', 0)), float(obj.get('height', 0))
+        w2, h2 = width / 2.0, height / 2.0
+        polylines = [(np.array([[-w2, -h2], [w2, -h2], [w2, h2], [-w2, h2]]), True)]
+        stroke_width = 0.0
+    elif kind in RASTER_SHAPE_TYPES:
+        width, height, polylines = shape_geometry(obj)
+        stroke_width = float(obj.get('strokeWidth', 0) or 0) if parse_rgba(obj.get('stroke')) else 0.0
+    else:
+        return None
+    if not polylines:
+        return None
+
+    # 没有描边颜色时 stroke_width 为0，对象尺寸不包含描边
+    local = object_matrix(obj, width + stroke_width, height + stroke_width)
+    full = matrix[:, :2] @ local[:, :2]
+    offset = matrix[:, :2] @ local[:, 2] + matrix[:, 2]
+    # 线宽按变换的平均缩放换算，开放路径至少1像素
+    thickness = max(stroke_width * math.sqrt(abs(np.linalg.det(full))), 1.0)
+
+    filled = []
+    strokes = []
+    for points, closed in polylines:
+        target = points @ full.T + offset
+        if closed and kind not in ('line', 'polyline'):
+            filled.append(target)
+        if stroke_width > 0 or not closed:
+            strokes.append((target, closed))
+    return _coverage_raster(target_size, filled, strokes, thickness, antialias)
+
+
+def rasterize_annotation_masks(annotations, canvas_size, target_size=None, output_transform=None,
+                               antialias=True):
+    """
+    将标注对象光栅化为逐标注遮罩和并集遮罩
+
+    Args:
+        annotations: fabric对象列表（画布坐标）
+        canvas_size: 画布尺寸 (宽, 高)
+        target_size: 遮罩尺寸 (宽, 高)，为空时使用输出尺寸
+        output_transform: 画布输出的裁剪/缩放映射
+        antialias: 是否生成边缘抗锯齿的软遮罩
+
+    Returns:
+        (masks, union): masks 为 [uint8 (H, W), ...]，union 为 uint8 (H, W)
+    """
+    if target_size is None:
+        target_size = ((output_transform['width'], output_transform['height'])
+                       if output_transform else canvas_size)
+    target_size = (int(target_size[0]), int(target_size[1]))
+    matrix = canvas_to_target_matrix(canvas_size, target_size, output_transform)
+
+    masks = []
+    union = np.zeros((target_size[1], target_size[0]), dtype=np.uint8)
+    for obj in annotations or []:
+        if obj.get('type') not in ANNOTATION_TYPES:
+            continue
+        mask = rasterize_annotation(obj, matrix, target_size, antialias)
+        if mask is None:
+            continue
+        masks.append(mask)
+        np.maximum(union, mask, out=union)
+    return masks, union
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Super Canvas 区域裁剪/拼回节点
+按画布标注的范围裁出带上下文的区域送入 Kontext 编辑，编辑结果再羽化拼回原图
+"""
+
+import os
+import sys
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from kontext_canvas_compositor import rasterize_annotation_masks
+from kontext_canvas_resample import nearest_kontext_bucket
+
+CATEGORY_TYPE = "🎨 Super Canvas"
+
+# 裁剪区域对齐方式（默认 multiple_of_16，不会放大裁剪区域）:
+# multiple_of_16 只将裁剪尺寸扩展为16的倍数；none 不做对齐；
+# kontext 对齐宽高比并等比缩放到约1MP的 Kontext 分辨率，小区域会被放大（例如 85x115 -> 880x1184）
+CROP_ALIGNMENTS = ["multiple_of_16", "kontext", "none"]
+
+
+def resize_images(images, width, height):
+    """缩放 [B, H, W, C] 图像，缩小使用区域插值，放大使用双三次插值"""
+    if images.shape[1] == height and images.shape[2] == width:
+        return images
+    x = images.movedim(-1, 1)
+    if width <= images.shape[2] and height <= images.shape[1]:
+        x = F.interpolate(x, size=(height, width), mode='area')
+    else:
+        x = F.interpolate(x, size=(height, width), mode='bicubic', align_corners=False).clamp_(0, 1)
+    return x.movedim(1, -1)
+
+
+def resize_masks(masks, width, height):
+    """缩放 [B, H, W] 遮罩"""
+    return resize_images(masks.unsqueeze(-1), width, height).squeeze(-1)
+
+
+def _expand_span(start, end, length, limit):
+    """将区间 [start, end) 以中心扩展到 length，并平移到 [0, limit) 内"""
+    length = min(length, limit)
+    center = (start + end) / 2.0
+    start = int(round(center - length / 2.0))
+    start = min(max(start, 0), limit - length)
+    return start, start + length
+
+
+def _uniform_kontext_target(width, height):
+    """
+    与裁剪区域等比的 Kontext 目标尺寸（16的倍数）
+
+    面积取最接近的 Kontext 分辨率的面积；裁剪宽高比与该分辨率一致时即为该分辨率
+    """
+    bucket_w, bucket_h = nearest_kontext_bucket(width, height)
+    scale = (bucket_w * bucket_h / float(width * height)) ** 0.5
+    return max(int(round(width * scale / 16)) * 16, 16), max(int(round(height * scale / 16)) * 16, 16)
+
+
+def compute_crop_box(bounds, image_width, image_height, padding, alignment):
+    """
+    计算裁剪框
+
+    除 kontext 外目标尺寸都不大于裁剪区域；kontext 会等比缩放（通常为放大）到约1MP，
+    图像边界限制了宽高比扩展时按实际裁剪区域等比缩放，不做非等比拉伸
+
+    Args:
+        bounds: 标注包围框 (x0, y0, x1, y1)
+        padding: 四周额外保留的上下文像素
+        alignment: CROP_ALIGNMENTS 之一
+
+    Returns:
+        ((x0, y0, x1, y1), (目标宽, 目标高))
+    """
+    x0, y0, x1, y1 = bounds
+    x0, y0 = max(x0 - padding, 0), max(y0 - padding, 0)
+    x1, y1 = min(x1 + padding, image_width), min(y1 + padding, image_height)
+    width, height = x1 - x0, y1 - y0
+
+    if alignment == "kontext":
+        target_w, target_h = nearest_kontext_bucket(width, height)
+        # 扩展较短的一边以匹配目标宽高比（不拉伸）
+        aspect = target_w / target_h
+        if width / height < aspect:
+            width = max(width, int(round(height * aspect)))
+        else:
+            height = max(height, int(round(width / aspect)))
+    elif alignment == "multiple_of_16":
+        width = -(-width // 16) * 16
+        height = -(-height // 16) * 16
+        target_w, target_h = width, height
+    else:
+        target_w, target_h = width, height
+
+    x0, x1 = _expand_span(x0, x1, width, image_width)
+    y0, y1 = _expand_span(y0, y1, height, image_height)
+    if alignment == "kontext":
+        if (x1 - x0, y1 - y0) != (width, height):
+            # 图像边界限制了扩展，宽高比不再与目标一致，改为按实际裁剪等比缩放
+            target_w, target_h = _uniform_kontext_target(x1 - x0, y1 - y0)
+    else:
+        # 图像边界限制了扩展时，目标尺寸与实际裁剪一致（multiple_of_16 时再向下取整）
+        target_w, target_h = x1 - x0, y1 - y0
+        if alignment == "multiple_of_16":
+            target_w, target_h = max(target_w // 16 * 16, 16), max(target_h // 16 * 16, 16)
+    return (x0, y0, x1, y1), (target_w, target_h)
+
+
+class CanvasRegionCrop:
+    """按画布标注裁出带上下文的编辑区域"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "layer_info": ("LAYER_INFO",),
+            },
+            "optional": {
+                "padding": ("INT", {"default": 64, "min": 0, "max": 4096, "step": 8}),
+                "alignment": (CROP_ALIGNMENTS, {"default": "multiple_of_16"}),
+                # -1 表示所有标注的并集
+                "annotation_index": ("INT", {"default": -1, "min": -1, "max": 999}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "MASK", "CANVAS_CROP")
+    RETURN_NAMES = ("image", "mask", "crop_info")
+    FUNCTION = "crop"
+    CATEGORY = CATEGORY_TYPE
+
+    def crop(self, image, layer_info, padding=64, alignment="multiple_of_16", annotation_index=-1):
+        """
+        裁剪标注区域
+
+        Returns:
+            tuple: (裁剪图像 [B, h, w, 3], 裁剪区域内的标注遮罩 [B, h, w], 裁剪信息)
+        """
+        batch, image_height, image_width = image.shape[:3]
+        layer_info = layer_info or {}
+        canvas_size = layer_info.get('canvas_size') or {}
+        canvas_size = (int(canvas_size.get('width', image_width)), int(canvas_size.get('height', image_height)))
+
+        # 在输入图像分辨率上光栅化标注
+        masks, union = rasterize_annotation_masks(
+            layer_info.get('annotations') or [], canvas_size,
+            (image_width, image_height), layer_info.get('output_transform')
+        )
+        mask = masks[annotation_index] if 0 <= annotation_index < len(masks) else union
+
+        ys, xs = np.nonzero(mask)
+        if xs.size:
+            bounds = (int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1)
+        else:
+            # 没有标注时使用整张图像
+            bounds = (0, 0, image_width, image_height)
+
+        (x0, y0, x1, y1), (target_w, target_h) = compute_crop_box(
+            bounds, image_width, image_height, padding, alignment
+        )
+
+        cropped = resize_images(image[:, y0:y1, x0:x1, :], target_w, target_h)
+        mask_tensor = torch.from_numpy(mask[y0:y1, x0:x1].copy()).to(torch.float32).div_(255.0)
+        mask_tensor = resize_masks(mask_tensor.unsqueeze(0), target_w, target_h).expand(batch, -1, -1)
+
+        crop_info = {
+            'x': x0,
+            'y': y0,
+            'width': x1 - x0,
+            'height': y1 - y0,
+            'target_width': target_w,
+            'target_height': target_h,
+            'original_width': image_width,
+            'original_height': image_height,
+        }
+        return (cropped, mask_tensor.contiguous(), crop_info)
+
+
+class CanvasRegionStitch:
+    """将编辑后的裁剪区域羽化拼回原图"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "original": ("IMAGE",),
+                "edited": ("IMAGE",),
+                "crop_info": ("CANVAS_CROP",),
+            },
+            "optional": {
+                "feather": ("INT", {"default": 16, "min": 0, "max": 512}),
+                # 可选: 只替换遮罩区域（裁剪坐标系）
+                "mask": ("MASK",),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("image",)
+    FUNCTION = "stitch"
+    CATEGORY = CATEGORY_TYPE
+
+    def stitch(self, original, edited, crop_info, feather=16, mask=None):
+        x0, y0 = crop_info['x'], crop_info['y']
+        width, height = crop_info['width'], crop_info['height']
+        x1, y1 = x0 + width, y0 + height
+
+        edited = resize_images(edited.to(original.device, original.dtype), width, height)
+        if edited.shape[0] != original.shape[0]:
+            edited = edited[:1].expand(original.shape[0], -1, -1, -1)
+
+        weight = self._edge_weight(crop_info, feather, original.device, original.dtype)
+        if mask is not None:
+            region = resize_masks(mask.to(original.device, original.dtype), width, height)
+            if feather > 0:
+                # 遮罩边缘同样羽化
+                kernel = feather * 2 + 1
+                region = F.avg_pool2d(region.unsqueeze(1), kernel, stride=1, padding=feather,
+                                      count_include_pad=False).squeeze(1)
+            if region.shape[0] != original.shape[0]:
+                region = region[:1].expand(original.shape[0], -1, -1)
+            weight = weight.unsqueeze(0) * region
+        else:
+            weight = weight.unsqueeze(0)
+
+        result = original.clone()
+        patch = result[:, y0:y1, x0:x1, :]
+        patch.lerp_(edited, weight.unsqueeze(-1).expand_as(patch))
+        return (result,)
+
+    @staticmethod
+    def _edge_weight(crop_info, feather, device, dtype):
+        """裁剪框内的羽化权重: 离框边越近越接近原图；贴着图像边界的一侧不羽化"""
+        width, height = crop_info['width'], crop_info['height']
+        ones_x = torch.ones(width, device=device, dtype=dtype)
+        ones_y = torch.ones(height, device=device, dtype=dtype)
+        if feather <= 0:
+            return ones_y[:, None] * ones_x[None, :]
+
+        def ramp(length, at_start, at_end):
+            position = torch.arange(length, device=device, dtype=dtype)
+            weight = torch.ones(length, device=device, dtype=dtype)
+            if not at_start:
+                weight = torch.minimum(weight, (position + 0.5) / feather)
+            if not at_end:
+                weight = torch.minimum(weight, (length - position - 0.5) / feather)
+            return weight.clamp_(0, 1)
+
+        x0, y0 = crop_info['x'], crop_info['y']
+        wx = ramp(width, x0 == 0, x0 + width >= crop_info['original_width'])
+        wy = ramp(height, y0 == 0, y0 + height >= crop_info['original_height'])
+        return wy[:, None] * wx[None, :]
+
+
+NODE_CLASS_MAPPINGS = {
+    "CanvasRegionCrop": CanvasRegionCrop,
+    "CanvasRegionStitch": CanvasRegionStitch,
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "CanvasRegionCrop": "✂️ Canvas Region Crop",
+    "CanvasRegionStitch": "🧩 Canvas Region Stitch",
+}
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Super Canvas 标注遮罩节点
+根据 LAYER_INFO 中的标注图形在服务端光栅化遮罩，无需浏览器再次上传
+"""
+
+import os
+import sys
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from kontext_canvas_compositor import rasterize_annotation_masks
+
+
+class CanvasAnnotationMask:
+    """将画布标注（矩形、圆形、路径、文本框等）转换为 MASK"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "layer_info": ("LAYER_INFO",),
+            },
+            "optional": {
+                # 0 表示使用画布输出尺寸
+                "width": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 8}),
+                "height": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 8}),
+                # 关闭后输出边缘为硬边的二值遮罩
+                "antialias": ("BOOLEAN", {"default": True}),
+            }
+        }
+
+    RETURN_TYPES = ("MASK", "MASK")
+    RETURN_NAMES = ("union_mask", "annotation_masks")
+    FUNCTION = "rasterize"
+    CATEGORY = "🎨 Super Canvas"
+
+    def rasterize(self, layer_info, width=0, height=0, antialias=True):
+        """
+        光栅化标注遮罩
+
+        Args:
+            layer_info: Super Canvas 输出的图层信息
+            width / height: 遮罩尺寸，为0时与画布输出一致
+            antialias: 边缘抗锯齿（软遮罩），关闭时为二值遮罩
+
+        Returns:
+            tuple: (并集遮罩 [1, H, W], 逐标注遮罩 [N, H, W])
+        """
+        layer_info = layer_info or {}
+        canvas_size = layer_info.get('canvas_size') or {}
+        canvas_size = (int(canvas_size.get('width', 512)), int(canvas_size.get('height', 512)))
+        output_transform = layer_info.get('output_transform')
+
+        target_size = None
+        if width > 0 and height > 0:
+            target_size = (width, height)
+
+        masks, union = rasterize_annotation_masks(
+            layer_info.get('annotations') or [], canvas_size, target_size, output_transform, antialias
+        )
+        if not masks:
+            masks = [union]
+
+        union_tensor = torch.from_numpy(union).to(torch.float32).div_(255.0).unsqueeze(0)
+        masks_tensor = torch.from_numpy(np.stack(masks)).to(torch.float32).div_(255.0)
+        return (union_tensor, masks_tensor)
+
+
+NODE_CLASS_MAPPINGS = {
+    "CanvasAnnotationMask": CanvasAnnotationMask,
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "CanvasAnnotationMask": "🎭 Canvas Annotation Mask",
+}
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Super Canvas 等待注册表
+按 node_id / request_id 索引正在等待前端响应的画布节点
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+# 画布往返超时的上下限（秒）
+MIN_ROUND_TRIP_TIMEOUT = 3.0
+MAX_ROUND_TRIP_TIMEOUT = 30.0
+
+# 前端报告仍在编码/上传时，每次将截止时间延后的秒数，以及单次往返的总时长上限
+ROUND_TRIP_EXTENSION = 10.0
+MAX_EXTENDED_ROUND_TRIP = 300.0
+
+# 尚未测得上传吞吐量时假定的速率（字节/秒），以及参与吞吐量估计的最小上传大小
+DEFAULT_UPLOAD_RATE = 4 * 1024 * 1024
+MIN_RATE_SAMPLE_BYTES = 256 * 1024
+
+
+class CanvasWaiter:
+    """一次画布状态请求的等待句柄"""
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.request_id = uuid.uuid4().hex
+        self.future = Future()
+        self.started = time.monotonic()
+        self.deadline = self.started
+
+    def extend(self, seconds):
+        """将截止时间延后到至少 now + seconds（不超过总时长上限）"""
+        limit = self.started + MAX_EXTENDED_ROUND_TRIP
+        self.deadline = min(limit, max(self.deadline, time.monotonic() + seconds))
+
+    def cancel(self):
+        if not self.future.done():
+            self.future.cancel()
+
+
+class RoundTripEstimator:
+    """
+    按节点估计画布往返延迟，计算自适应超时
+
+    往返时间分为固定延迟和上传耗时两部分: 固定部分采用与TCP RTO相同的平滑方式
+    (srtt + 4 * rttvar)，上传部分按观测到的吞吐量和本次预计的上传大小估算
+    """
+
+    def __init__(self, min_timeout=MIN_ROUND_TRIP_TIMEOUT, max_timeout=MAX_ROUND_TRIP_TIMEOUT):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._stats = {}
+        self._rates = {}
+
+    def observe(self, node_id, seconds, upload_bytes=0):
+        """记录一次完成的往返；upload_bytes 为本次上传的字节数"""
+        rate = self._rates.get(node_id)
+        if upload_bytes >= MIN_RATE_SAMPLE_BYTES and seconds > 0:
+            sample = upload_bytes / seconds
+            rate = sample if rate is None else 0.875 * rate + 0.125 * sample
+            self._rates[node_id] = rate
+        # 扣除上传耗时后的固定延迟
+        seconds = max(0.0, seconds - upload_bytes / (rate or DEFAULT_UPLOAD_RATE))
+
+        stats = self._stats.get(node_id)
+        if stats is None:
+            self._stats[node_id] = (seconds, seconds / 2)
+            return
+        srtt, rttvar = stats
+        rttvar = 0.75 * rttvar + 0.25 * abs(srtt - seconds)
+        srtt = 0.875 * srtt + 0.125 * seconds
+        self._stats[node_id] = (srtt, rttvar)
+
+    def timeout(self, node_id, upload_bytes=0):
+        """
+        Args:
+            node_id: 节点ID
+            upload_bytes: 本次往返预计上传的字节数（画布整帧重新上传时的上限估计）
+        """
+        stats = self._stats.get(node_id)
+        if stats is None:
+            # 尚无样本，使用上限
+            return self.max_timeout
+        srtt, rttvar = stats
+        upload_time = upload_bytes / self._rates.get(node_id, DEFAULT_UPLOAD_RATE)
+        return min(self.max_timeout, max(self.min_timeout, srtt + 4 * rttvar + upload_time))
+
+
+class CanvasWaiterRegistry:
+    """
+    画布等待注册表
+
+    - 每个 node_id 同一时间只有一个有效请求，新请求会取消旧请求
+    - 响应通过 request_id 匹配，过期执行的响应会被拒绝
+    - 前端仍在编码/上传时可通过 extend 延后等待的截止时间
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._by_request = {}
+        self.latency = RoundTripEstimator()
+
+    def begin(self, node_id):
+        """为节点创建新的等待请求，并取消该节点之前未完成的请求"""
+        waiter = CanvasWaiter(node_id)
+        with self._lock:
+            previous = self._pending.pop(node_id, None)
+            if previous is not None:
+                self._by_request.pop(previous.request_id, None)
+            self._pending[node_id] = waiter
+            self._by_request[waiter.request_id] = waiter
+        if previous is not None:
+            previous.cancel()
+        return waiter
+
+    def finish(self, waiter):
+        """结束等待（成功、超时或异常）"""
+        with self._lock:
+            self._by_request.pop(waiter.request_id, None)
+            if self._pending.get(waiter.node_id) is waiter:
+                del self._pending[waiter.node_id]
+        waiter.cancel()
+
+    def expects(self, node_id, request_id=None):
+        """检查是否有请求在等待该响应（用于在解码图像前丢弃过期响应）"""
+        with self._lock:
+            if request_id:
+                waiter = self._by_request.get(request_id)
+                return waiter is not None and waiter.node_id == node_id
+            return node_id in self._pending
+
+    def extend(self, node_id, request_id, seconds=ROUND_TRIP_EXTENSION):
+        """
+        前端报告仍在处理请求时延后其截止时间
+
+        Returns:
+            bool: 是否有匹配的等待请求
+        """
+        with self._lock:
+            waiter = self._by_request.get(request_id)
+            if waiter is None or waiter.node_id != node_id:
+                return False
+            waiter.extend(seconds)
+        return True
+
+    def resolve(self, node_id, data, request_id=None, upload_bytes=0):
+        """
+        将前端响应交给等待中的请求
+
+        Args:
+            node_id: 节点ID
+            data: 处理后的画布数据
+            request_id: 前端回传的请求ID；旧版前端不回传时按 node_id 匹配当前请求
+            upload_bytes: 本次响应的上传字节数，用于估计上传吞吐量
+
+        Returns:
+            bool: 是否有请求接收了该响应
+        """
+        with self._lock:
+            if request_id:
+                waiter = self._by_request.get(request_id)
+                if waiter is None or waiter.node_id != node_id:
+                    return False
+            else:
+                waiter = self._pending.get(node_id)
+                if waiter is None:
+                    return False
+        if waiter.future.done():
+            return False
+        try:
+            waiter.future.set_result(data)
+        except Exception:
+            # 与取消/超时竞争时视为过期响应
+            return False
+        self.latency.observe(node_id, time.monotonic() - waiter.started, upload_bytes)
+        return True
+
+
+# 全局注册表，不随 INPUT_TYPES 重置
+canvas_registry = CanvasWaiterRegistry()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Super Canvas 输出分辨率
+将画布帧对齐到 FLUX Kontext 偏好的分辨率，并生成缩小的预览；
+全部在 uint8 缓冲区上完成，之后才转换为浮点张量
+"""
+
+import os
+import sys
+
+import cv2
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from kontext_canvas_cache import CanvasFrame
+
+# FLUX Kontext 偏好的分辨率 (宽, 高)，均为16的倍数，面积约为1MP
+KONTEXT_RESOLUTIONS = [
+    (672, 1568), (688, 1504), (720, 1456), (752, 1392), (800, 1328),
+    (832, 1248), (880, 1184), (944, 1104), (1024, 1024), (1104, 944),
+    (1184, 880), (1248, 832), (1328, 800), (1392, 752), (1456, 720),
+    (1504, 688), (1568, 672),
+]
+
+# 输出分辨率模式: original 保持浏览器渲染尺寸；kontext 对齐到最接近的 Kontext 分辨率
+OUTPUT_RESOLUTIONS = ["original", "kontext"]
+
+DEFAULT_PREVIEW_SIZE = 512
+
+
+def nearest_kontext_bucket(width, height):
+    """返回宽高比最接近的 Kontext 分辨率 (宽, 高)"""
+    aspect = width / max(height, 1)
+    return min(KONTEXT_RESOLUTIONS, key=lambda size: abs(size[0] / size[1] - aspect))
+
+
+def resize_uint8(array, width, height):
+    """缩小使用区域插值，放大使用Lanczos插值"""
+    src_h, src_w = array.shape[:2]
+    if (src_w, src_h) == (width, height):
+        return array
+    interpolation = cv2.INTER_AREA if width <= src_w and height <= src_h else cv2.INTER_LANCZOS4
+    return cv2.resize(array, (width, height), interpolation=interpolation)
+
+
+def fit_frame(frame, width, height):
+    """
+    等比缩放并居中裁剪到目标尺寸（不拉伸）
+
+    先在源图上裁出与目标宽高比一致的区域，再缩放到目标尺寸，避免对被裁掉的像素做插值
+
+    Returns:
+        (CanvasFrame, transform): transform 记录源图裁剪框和缩放比例，用于映射图层坐标
+    """
+    src_w, src_h = frame.width, frame.height
+    scale = max(width / src_w, height / src_h)
+    crop_w = min(src_w, max(1, round(width / scale)))
+    crop_h = min(src_h, max(1, round(height / scale)))
+    x0 = (src_w - crop_w) // 2
+    y0 = (src_h - crop_h) // 2
+
+    pixels = resize_uint8(frame.pixels[y0:y0 + crop_h, x0:x0 + crop_w], width, height)
+    mask = None
+    if frame.mask is not None:
+        mask = resize_uint8(frame.mask[y0:y0 + crop_h, x0:x0 + crop_w], width, height)
+
+    transform = {
+        'crop': [x0, y0, crop_w, crop_h],
+        'scale_x': width / crop_w,
+        'scale_y': height / crop_h,
+        'width': width,
+        'height': height,
+    }
+    return CanvasFrame(np.ascontiguousarray(pixels), mask), transform
+
+
+def bucket_frame(frame):
+    """将画布帧对齐到最接近的 Kontext 分辨率"""
+    return fit_frame(frame, *nearest_kontext_bucket(frame.width, frame.height))
+
+
+def preview_frame(frame, max_side=DEFAULT_PREVIEW_SIZE):
+    """生成长边不超过 max_side 的预览帧（不放大）"""
+    scale = min(1.0, max_side / max(frame.width, frame.height))
+    if scale >= 1.0:
+        return frame
+    width = max(1, round(frame.width * scale))
+    height = max(1, round(frame.height * scale))
+    return CanvasFrame(resize_uint8(frame.pixels, width, height))
+
+
+def frame_from_tensor(image):
+    """将 ComfyUI IMAGE 张量的第一帧转换为 uint8 画布帧"""
+    pixels = image[0, ..., :3].clamp(0, 1).mul(255).round().to(torch.uint8).cpu().numpy()
+    return CanvasFrame(pixels)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Super Canvas 场景持久化
+保存每个画布节点最近一次的 fabric 场景（图像对象以 asset_id 引用），
+供服务端在没有浏览器时直接渲染；场景按 工作流ID + 节点ID 索引
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+SCENE_DIR = Path(__file__).parent.parent / "user_data" / "canvas_scenes"
+
+
+def scene_key(node_id, workflow_id=None):
+    """场景存储键: 不同工作流中ID相同的节点互不影响；未知工作流时只用节点ID"""
+    if workflow_id:
+        return f"{workflow_id}:{node_id}"
+    return str(node_id)
+
+
+def _scene_filename(key):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(key)) + '.json'
+
+
+class CanvasSceneStore:
+    """
+    画布场景存储
+
+    场景保存在内存并写入 user_data/canvas_scenes，场景引用的图层资源
+    复制到 assets 子目录，服务器重启后仍可渲染；
+    不再被任何已保存场景引用的资源会被清理
+    """
+
+    def __init__(self, scene_dir=SCENE_DIR):
+        self.scene_dir = Path(scene_dir)
+        self.asset_dir = self.scene_dir / "assets"
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._scenes = {}
+        self._collected = False
+
+    def save(self, key, scene, get_asset_bytes=None):
+        """
+        保存节点场景
+
+        Args:
+            key: 场景键，见 scene_key()
+            scene: {'canvas_state', 'width', 'height', 'background', 'objects', 'layer_transforms'}
+            get_asset_bytes: asset_id -> 编码字节，用于持久化场景引用的资源
+        """
+        previous = self.load(key)
+        scene = dict(scene)
+        scene['saved_at'] = time.time()
+        with self._lock:
+            self._scenes[key] = scene
+
+        try:
+            with self._disk_lock:
+                self.scene_dir.mkdir(parents=True, exist_ok=True)
+                path = self.scene_dir / _scene_filename(key)
+                tmp_path = path.with_suffix('.json.tmp')
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(scene, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+
+                if get_asset_bytes is not None:
+                    for asset_id in scene_asset_ids(scene):
+                        self._persist_asset(asset_id, get_asset_bytes)
+
+                # 首次保存时清理历史遗留的资源；之后只在场景不再引用某些资源时清理
+                dropped = previous is not None and bool(scene_asset_ids(previous) - scene_asset_ids(scene))
+                if dropped or not self._collected:
+                    self._collected = True
+                    self._collect_assets()
+        except OSError as e:
+            print(f"[Super Canvas] 保存画布场景失败: {e}")
+
+    def load(self, key):
+        with self._lock:
+            scene = self._scenes.get(key)
+        if scene is not None:
+            return scene
+
+        scene = self._read_scene(self.scene_dir / _scene_filename(key))
+        if scene is None:
+            return None
+        with self._lock:
+            self._scenes[key] = scene
+        return scene
+
+    @staticmethod
+    def _read_scene(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                scene = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return scene if isinstance(scene, dict) else None
+
+    def _collect_assets(self):
+        """删除没有任何已保存场景引用的持久化资源（调用方持有 _disk_lock）"""
+        if not self.asset_dir.is_dir():
+            return
+        referenced = set()
+        for path in self.scene_dir.glob("*.json"):
+            scene = self._read_scene(path)
+            if scene is not None:
+                referenced |= scene_asset_ids(scene)
+        removed = 0
+        for path in self.asset_dir.iterdir():
+            if path.name in referenced or path.suffix == '.tmp':
+                continue
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass
+        if removed:
+            print(f"[Super Canvas] 清理了 {removed} 个未被场景引用的图层资源")
+
+    def load_asset(self, asset_id):
+        """读取持久化的资源字节"""
+        path = self.asset_dir / asset_id
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _persist_asset(self, asset_id, get_asset_bytes):
+        path = self.asset_dir / asset_id
+        if path.exists():
+            return
+        data = get_asset_bytes(asset_id)
+        if data is None:
+            return
+        self.asset_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+def scene_asset_ids(scene):
+    """返回场景中图像对象引用的资源ID"""
+    return {
+        obj.get('asset_id') for obj in scene.get('objects') or []
+        if obj.get('type') == 'image' and obj.get('asset_id')
+    }
+
+
+def scene_state_key(scene):
+    """
+    由场景内容计算强哈希，作为磁盘输出缓存的键
+
+    只包含影响渲染结果的字段；图像以asset_id（内容哈希）引用，
+    缺少asset_id的图像无法确定内容，此时返回None
+    """
+    if not scene:
+        return None
+    objects = scene.get('objects') or []
+    if any(obj.get('type') == 'image' and not obj.get('asset_id') for obj in objects):
+        return None
+    content = {
+        'width': scene.get('width'),
+        'height': scene.get('height'),
+        'background': scene.get('background'),
+        'objects': objects,
+    }
+    encoded = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+_MASK32 = 0xFFFFFFFF
+
+
+def _imul(a, b):
+    return (a * b) & _MASK32
+
+
+def _fmix32(h):
+    h ^= h >> 16
+    h = _imul(h, 0x85ebca6b)
+    h ^= h >> 13
+    h = _imul(h, 0xc2b2ae35)
+    h ^= h >> 16
+    return h
+
+
+def hash128(text):
+    """
+    128位非加密哈希，与前端 hash128() 逐位一致（按UTF-16码元计算）
+
+    Returns:
+        str: 32位十六进制字符串
+    """
+    h1, h2, h3, h4 = 0x811c9dc5, 0x9e3779b9, 0x85ebca6b, 0xc2b2ae35
+    data = text.encode('utf-16-le')
+    for i in range(0, len(data), 2):
+        c = data[i] | (data[i + 1] << 8)
+        h1 = _imul(h1 ^ c, 0x01000193)
+        h2 = _imul(h2 ^ c, 0x5bd1e995)
+        h2 ^= h2 >> 15
+        h3 = _imul((h3 + c) & _MASK32, 0x27d4eb2f)
+        h3 ^= h3 >> 13
+        h4 = _imul(h4 ^ c, 0x165667b1)
+        h4 = ((h4 << 13) | (h4 >> 19)) & _MASK32
+    return ''.join(f"{_fmix32(h):08x}" for h in (h1, h2, h3, h4))
+
+
+def combine_state_digest(state_parts):
+    """
+    由各对象哈希组合出画布状态摘要，与前端 combineStateDigest() 一致
+
+    Args:
+        state_parts: {'width', 'height', 'background', 'objects': [对象哈希, ...]}
+    """
+    background = state_parts.get('background')
+    return hash128("{}x{}|{}|{}".format(
+        state_parts.get('width'),
+        state_parts.get('height'),
+        background if background is not None else '',
+        ','.join(state_parts.get('objects') or [])
+    ))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Super Canvas 上传协议解析
+支持 multipart / application/octet-stream 二进制上传，并兼容旧的 JSON 整数数组格式
+"""
+
+import json
+import os
+import zlib
+
+import numpy as np
+
+# 单次画布上传的最大字节数（解压后），可通过环境变量调整
+MAX_CANVAS_UPLOAD_BYTES = int(os.environ.get("KONTEXT_CANVAS_MAX_UPLOAD_MB", "256")) * 1024 * 1024
+
+# 流式读取的分块大小
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# multipart 中作为二进制读取的字段
+BINARY_FIELDS = ('main_image', 'main_mask', 'tiles')
+
+
+class CanvasPayloadError(Exception):
+    """画布上传数据无效，status 为返回给客户端的HTTP状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _check_declared_size(request, limit):
+    """根据Content-Length提前拒绝过大的请求，避免读取请求体"""
+    if request.content_length is not None and request.content_length > limit:
+        raise CanvasPayloadError(f"上传数据过大: {request.content_length} > {limit}", status=413)
+
+
+async def _read_stream(stream, limit):
+    """分块读取流，超出限制时立即中止"""
+    buffer = bytearray()
+    async for chunk in stream.iter_chunked(UPLOAD_CHUNK_SIZE):
+        buffer.extend(chunk)
+        if len(buffer) > limit:
+            raise CanvasPayloadError(f"上传数据超过限制 {limit} 字节", status=413)
+    return bytes(buffer)
+
+
+async def _read_part(part, limit):
+    """分块读取 multipart 字段"""
+    buffer = bytearray()
+    while True:
+        chunk = await part.read_chunk(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        if len(buffer) > limit:
+            raise CanvasPayloadError(f"字段 {part.name} 超过限制 {limit} 字节", status=413)
+    return bytes(buffer)
+
+
+def decode_payload(data, encoding, limit=MAX_CANVAS_UPLOAD_BYTES):
+    """
+    解码客户端压缩的数据
+
+    Args:
+        data: 原始字节
+        encoding: 'gzip'、'deflate' 或空
+        limit: 解压后的最大字节数，防止压缩炸弹
+
+    Returns:
+        bytes: 解码后的数据
+    """
+    if not encoding or encoding == 'identity':
+        return data
+
+    if encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        decompressor = zlib.decompressobj()
+    else:
+        raise CanvasPayloadError(f"不支持的编码: {encoding}", status=415)
+
+    try:
+        result = decompressor.decompress(data, limit + 1)
+    except zlib.error as e:
+        raise CanvasPayloadError(f"解压失败: {e}")
+    if len(result) > limit or decompressor.unconsumed_tail:
+        raise CanvasPayloadError(f"解压后数据超过限制 {limit} 字节", status=413)
+    return result
+
+
+def _meta_from_headers(headers):
+    """从请求头中读取 octet-stream 模式的元数据"""
+    meta = {}
+    raw_meta = headers.get('X-Canvas-Meta')
+    if raw_meta:
+        try:
+            meta = json.loads(raw_meta)
+        except ValueError:
+            raise CanvasPayloadError("X-Canvas-Meta 不是有效的JSON")
+    if headers.get('X-Node-Id'):
+        meta['node_id'] = headers['X-Node-Id']
+    if headers.get('X-Canvas-State'):
+        meta['canvas_state'] = headers['X-Canvas-State']
+    return meta
+
+
+async def read_canvas_payload(request, limit=MAX_CANVAS_UPLOAD_BYTES):
+    """
+    读取 /lrpg_canvas 请求
+
+    支持三种格式:
+      - multipart/form-data: 'meta' 字段为JSON，'main_image'/'main_mask' 为二进制图像
+      - application/octet-stream: 请求体为 main_image，元数据在 X-Canvas-Meta / X-Node-Id 请求头
+      - application/json: 旧格式，main_image 为整数数组
+
+    二进制字段可通过 meta['encoding'] 或 X-Canvas-Encoding 声明 gzip/deflate 压缩。
+    main_image 可为PNG/WebP；meta['image_format'] 为 'raw' 时是 image_width x image_height 的原始RGBA像素。
+
+    Returns:
+        dict: 与旧JSON格式字段一致，main_image/main_mask 为 bytes、整数列表或 None
+    """
+    _check_declared_size(request, limit)
+    content_type = request.content_type
+
+    if content_type == 'multipart/form-data':
+        data = {}
+        binaries = {}
+        encodings = {}
+        reader = await request.multipart()
+        total = 0
+        while True:
+            part = await reader.next()
+            if part is None:
+                break
+            raw = await _read_part(part, limit - total)
+            total += len(raw)
+            if part.name == 'meta':
+                try:
+                    data.update(json.loads(raw.decode('utf-8')))
+                except ValueError:
+                    raise CanvasPayloadError("meta 字段不是有效的JSON")
+            elif part.name in BINARY_FIELDS:
+                binaries[part.name] = raw
+                encodings[part.name] = part.headers.get('Content-Encoding')
+            else:
+                data[part.name] = raw.decode('utf-8')
+
+        default_encoding = data.get('encoding')
+        for name, raw in binaries.items():
+            data[name] = decode_payload(raw, encodings.get(name) or default_encoding, limit)
+        return data
+
+    if content_type == 'application/octet-stream':
+        data = _meta_from_headers(request.headers)
+        raw = await _read_stream(request.content, limit)
+        encoding = request.headers.get('X-Canvas-Encoding') or data.get('encoding')
+        data['main_image'] = decode_payload(raw, encoding, limit) if raw else None
+        return data
+
+    # 旧格式: JSON整数数组
+    raw = await _read_stream(request.content, limit)
+    try:
+        return json.loads(raw.decode('utf-8')) if raw else {}
+    except ValueError:
+        raise CanvasPayloadError("请求体不是有效的JSON")
+
+
+async def read_binary_body(request, limit=MAX_CANVAS_UPLOAD_BYTES):
+    """读取原始二进制请求体（用于图层资源上传），支持 X-Canvas-Encoding 压缩"""
+    _check_declared_size(request, limit)
+    raw = await _read_stream(request.content, limit)
+    return decode_payload(raw, request.headers.get('X-Canvas-Encoding'), limit)
+
+
+def apply_tile_delta(base_pixels, delta, tile_data):
+    """
+    将增量上传的脏瓦片应用到上一帧
+
+    Args:
+        base_pixels: 服务器保存的上一帧 uint8 (H, W, 3)
+        delta: {'width', 'height', 'tile_size', 'tiles': [[tx, ty], ...]}
+        tile_data: 按 tiles 顺序拼接的原始RGB字节，每块按行优先排列
+
+    Returns:
+        numpy.ndarray: 新的 uint8 (H, W, 3) 帧（不修改 base_pixels）
+    """
+    height, width = base_pixels.shape[:2]
+    if delta.get('width') != width or delta.get('height') != height:
+        raise CanvasPayloadError("画布尺寸已变化，需要完整上传", status=409)
+
+    tile_size = int(delta.get('tile_size', 0))
+    tiles = delta.get('tiles') or []
+    if tile_size <= 0:
+        raise CanvasPayloadError("无效的瓦片尺寸")
+
+    buffer = np.frombuffer(tile_data or b'', dtype=np.uint8)
+    if not tiles:
+        if buffer.size:
+            raise CanvasPayloadError("瓦片数据长度不匹配")
+        # 没有变化时直接复用上一帧（帧数据不会被原地修改）
+        return base_pixels
+
+    pixels = base_pixels.copy()
+    offset = 0
+    for tx, ty in tiles:
+        x0, y0 = int(tx) * tile_size, int(ty) * tile_size
+        if x0 < 0 or y0 < 0 or x0 >= width or y0 >= height:
+            raise CanvasPayloadError(f"瓦片越界: ({tx}, {ty})")
+        x1, y1 = min(x0 + tile_size, width), min(y0 + tile_size, height)
+        size = (x1 - x0) * (y1 - y0) * 3
+        if offset + size > buffer.size:
+            raise CanvasPayloadError("瓦片数据长度不足")
+        pixels[y0:y1, x0:x1] = buffer[offset:offset + size].reshape(y1 - y0, x1 - x0, 3)
+        offset += size
+
+    if offset != buffer.size:
+        raise CanvasPayloadError("瓦片数据长度不匹配")
+    return pixels
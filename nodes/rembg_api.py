@@ -5,191 +5,296 @@ rembg API 服务端
 """
 
 import io
-import base64
+import os
+import sys
+import math
+import threading
+from collections import OrderedDict
 from PIL import Image
 import numpy as np
+import torch
 
 try:
-    from rembg import remove, new_session
+    from rembg import new_session
     REMBG_AVAILABLE = True
 except ImportError:
     REMBG_AVAILABLE = False
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from rembg_refine import guided_upsample, resize_nchw, tile_boxes, tile_window
+from rembg_matting import matte_alpha
+
+# 静态模型目录: 节点名称 -> rembg 模型名称、说明及预处理参数（与 rembg 各会话的 predict 一致），
+# 查询可用模型时无需加载任何会话
+_IMAGENET_MEAN = (0.485, 0.456, 0.406)
+_IMAGENET_STD = (0.229, 0.224, 0.225)
+
+MODEL_CATALOG = OrderedDict([
+    # U²-Net - 通用人像背景移除，速度快
+    ('u2net', {
+        'rembg_name': 'u2net', 'description': '通用背景移除，速度快',
+        'input_size': (320, 320), 'mean': _IMAGENET_MEAN, 'std': _IMAGENET_STD, 'activation': None,
+    }),
+    # U²-Net Human - 专用于人体分割
+    ('u2net_human_seg', {
+        'rembg_name': 'u2net_human_seg', 'description': '人体分割',
+        'input_size': (320, 320), 'mean': _IMAGENET_MEAN, 'std': _IMAGENET_STD, 'activation': None,
+    }),
+    # BiRefNet - 最新最准确的模型，适合复杂场景
+    ('birefnet', {
+        'rembg_name': 'birefnet-general', 'description': '复杂场景，精度最高',
+        'input_size': (1024, 1024), 'mean': _IMAGENET_MEAN, 'std': _IMAGENET_STD, 'activation': 'sigmoid',
+    }),
+    # ISNet - 适合高分辨率图像
+    ('isnet', {
+        'rembg_name': 'isnet-general-use', 'description': '高分辨率图像',
+        'input_size': (1024, 1024), 'mean': (0.5, 0.5, 0.5), 'std': (1.0, 1.0, 1.0), 'activation': None,
+    }),
+])
+
+DEFAULT_MODEL = 'u2net'
+
+# 同时驻留内存的模型会话上限，超出时淘汰最久未使用的会话
+MAX_RESIDENT_SESSIONS = max(1, int(os.environ.get("KONTEXT_REMBG_MAX_SESSIONS", "2")))
+
+# 每次送入ONNX会话的帧数（微批次大小）
+INFERENCE_BATCH_SIZE = max(1, int(os.environ.get("KONTEXT_REMBG_BATCH_SIZE", "4")))
+
+# 长边超过该像素数的图像额外按重叠分块推理，细化边缘带（0 表示不分块）
+TILE_THRESHOLD = max(0, int(os.environ.get("KONTEXT_REMBG_TILE_THRESHOLD", "4096")))
+
+# 分块时每个维度大约切成的块数，分块推理次数因此有上限
+TILE_GRID = 4
+
+# 启动后在后台预热的模型（逗号分隔，如 "u2net,isnet"），默认不预热
+WARMUP_MODELS = [
+    name.strip() for name in os.environ.get("KONTEXT_REMBG_WARMUP", "").split(",") if name.strip()
+]
+
+
 class RemBGProcessor:
     """背景移除处理器"""
     
-    def __init__(self):
-        self.sessions = {}
-        self._initialize_sessions()
-    
-    def _initialize_sessions(self):
-        """初始化不同的模型会话"""
-        if not REMBG_AVAILABLE:
-            return
-            
-        # 预加载常用模型
-        try:
-            # U²-Net - 通用人像背景移除，速度快
-            self.sessions['u2net'] = new_session('u2net')
-            
-            # U²-Net Human - 专用于人体分割
-            self.sessions['u2net_human_seg'] = new_session('u2net_human_seg') 
-            
-            # BiRefNet - 最新最准确的模型，适合复杂场景
-            self.sessions['birefnet'] = new_session('birefnet')
-            
-            # ISNet - 适合高分辨率图像
-            self.sessions['isnet'] = new_session('isnet-general-use')
-            
-        except Exception as e:
-            pass
+    def __init__(self, max_sessions=MAX_RESIDENT_SESSIONS, warmup_models=None):
+        # 模型会话按需创建，按最近使用顺序排列
+        self.sessions = OrderedDict()
+        self.max_sessions = max(1, int(max_sessions))
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._failed = set()
+
+        if warmup_models is None:
+            warmup_models = WARMUP_MODELS
+        if warmup_models:
+            self.warm_up(warmup_models)
+
+    def get_session(self, model_name):
+        """
+        获取模型会话，首次使用时创建
+        
+        同一模型的并发请求只加载一次；加载失败的模型不再重试
+        
+        Returns:
+            rembg 会话，不可用时返回None
+        """
+        if not REMBG_AVAILABLE or model_name not in MODEL_CATALOG:
+            return None
+
+        with self._lock:
+            session = self.sessions.get(model_name)
+            if session is not None:
+                self.sessions.move_to_end(model_name)
+                return session
+            if model_name in self._failed:
+                return None
+            load_lock = self._load_locks.setdefault(model_name, threading.Lock())
+
+        with load_lock:
+            # 等待期间可能已由其他线程加载完成
+            with self._lock:
+                session = self.sessions.get(model_name)
+                if session is not None:
+                    self.sessions.move_to_end(model_name)
+                    return session
+                if model_name in self._failed:
+                    return None
+
+            try:
+                session = new_session(MODEL_CATALOG[model_name]['rembg_name'])
+            except Exception as e:
+                print(f"[RemBG] 加载模型 {model_name} 失败: {e}")
+                with self._lock:
+                    self._failed.add(model_name)
+                return None
+
+            with self._lock:
+                self.sessions[model_name] = session
+                self.sessions.move_to_end(model_name)
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            return session
+
+    def warm_up(self, model_names):
+        """在后台线程中预先加载模型会话"""
+        model_names = [name for name in model_names if name in MODEL_CATALOG]
+        if not REMBG_AVAILABLE or not model_names:
+            return None
+
+        def load():
+            for name in model_names[:self.max_sessions]:
+                self.get_session(name)
+
+        thread = threading.Thread(target=load, name="rembg-warmup", daemon=True)
+        thread.start()
+        return thread
     
-    def remove_background(self, input_image, model_name='u2net', alpha_matting=False):
+    def predict_masks(self, frames, model_name=DEFAULT_MODEL, batch_size=INFERENCE_BATCH_SIZE,
+                      return_model=False):
         """
-        移除背景
+        批量推理，不经过任何图像编解码
         
         Args:
-            input_image: PIL Image对象或字节数据
-            model_name: 模型名称 ('u2net', 'birefnet', 'isnet', 'u2net_human_seg')
-            alpha_matting: 是否启用Alpha Matting边缘优化
+            frames: uint8 RGB帧 [B, H, W, 3]（numpy数组或张量）
+            model_name: 模型名称，不可用时回退到默认模型
+            batch_size: 每次送入会话的帧数
+            return_model: 同时返回实际使用的模型名称（使用备用算法时为None）
         
         Returns:
-            PIL Image: 移除背景后的图像
+            numpy array: 原图尺寸的uint8 alpha遮罩 [B, H, W]；
+            return_model 为True时返回 (遮罩, 模型名称)
+        """
+        frames = torch.as_tensor(frames)
+        session = self.get_session(model_name)
+        if session is None:
+            model_name = DEFAULT_MODEL
+            session = self.get_session(model_name)
+
+        masks = None
+        if session is not None:
+            try:
+                masks = run_session(session, MODEL_CATALOG[model_name], frames, batch_size).numpy()
+            except Exception as e:
+                print(f"[RemBG] 模型 {model_name} 推理失败，使用备用算法: {e}")
+
+        if masks is None:
+            model_name = None
+            masks = np.stack([self._fallback_mask(frame) for frame in frames.cpu().numpy()])
+        return (masks, model_name) if return_model else masks
+
+    def predict_mask(self, image, model_name=DEFAULT_MODEL):
         """
+        单帧推理
         
-        if not REMBG_AVAILABLE:
-            return self._fallback_remove_background(input_image)
+        Args:
+            image: uint8 RGB数组 [H, W, 3]（也接受PIL Image或字节数据）
         
-        try:
-            # 转换输入图像格式
-            if isinstance(input_image, bytes):
-                input_image = Image.open(io.BytesIO(input_image))
-            elif not isinstance(input_image, Image.Image):
-                raise ValueError("不支持的输入图像格式")
-            
-            # 确保图像为RGB格式
-            if input_image.mode != 'RGB':
-                input_image = input_image.convert('RGB')
-            
-            # 获取会话
-            session = self.sessions.get(model_name)
-            if session is None:
-                session = self.sessions.get('u2net')
-                if session is None:
-                    return self._fallback_remove_background(input_image)
-            
-            # 执行背景移除
-            input_bytes = io.BytesIO()
-            input_image.save(input_bytes, format='PNG')
-            input_bytes = input_bytes.getvalue()
-            
-            # 使用rembg移除背景
-            output_bytes = remove(input_bytes, session=session)
-            
-            # 转换为PIL图像
-            output_image = Image.open(io.BytesIO(output_bytes)).convert('RGBA')
-            
-            # 如果启用Alpha Matting，进行边缘优化
-            if alpha_matting:
-                output_image = self._apply_alpha_matting(input_image, output_image)
-            
-            return output_image
-            
-        except Exception as e:
-            return self._fallback_remove_background(input_image)
-    
-    def _apply_alpha_matting(self, original_image, mask_image):
+        Returns:
+            numpy array: 原图尺寸的uint8 alpha遮罩 [H, W]
         """
-        应用Alpha Matting边缘优化
+        return self.predict_masks(to_rgb_array(image)[None], model_name)[0]
+
+    def predict_alpha(self, frames, model_name=DEFAULT_MODEL, alpha_matting=False,
+                      batch_size=INFERENCE_BATCH_SIZE, return_model=False):
+        """
+        批量生成最终alpha遮罩（可选Alpha Matting），不合成RGBA
         
         Args:
-            original_image: 原始图像
-            mask_image: 带透明通道的掩膜图像
-            
+            frames: uint8 RGB帧 [B, H, W, 3]（numpy数组或张量）
+            return_model: 同时返回实际使用的模型名称，见 predict_masks
+        
         Returns:
-            PIL Image: 边缘优化后的图像
+            numpy array: uint8 alpha遮罩 [B, H, W]
         """
-        try:
-            # 将图像转换为numpy数组
-            original_array = np.array(original_image)
-            mask_array = np.array(mask_image)
-            
-            # 提取alpha通道作为trimap
-            alpha = mask_array[:, :, 3] / 255.0
-            
-            # 简化的Alpha Matting实现
-            # 对边缘区域进行高斯模糊平滑
-            from scipy.ndimage import gaussian_filter
-            
-            # 检测边缘区域
-            edge_mask = self._detect_edges(alpha)
-            
-            # 对边缘区域应用高斯模糊
-            blurred_alpha = gaussian_filter(alpha, sigma=1.0)
-            
-            # 只在边缘区域使用模糊结果
-            final_alpha = np.where(edge_mask, blurred_alpha, alpha)
-            
-            # 创建最终图像
-            result = original_array.copy()
-            result = np.dstack([result, (final_alpha * 255).astype(np.uint8)])
-            
-            return Image.fromarray(result, 'RGBA')
-            
-        except Exception as e:
-            return mask_image
+        frames = np.asarray(frames)
+        alpha, used_model = self.predict_masks(frames, model_name, batch_size, return_model=True)
+        if alpha_matting:
+            alpha = np.stack([
+                self._apply_alpha_matting(frame, a, decontaminate=False)[0] for frame, a in zip(frames, alpha)
+            ])
+        return (alpha, used_model) if return_model else alpha
+
+    def remove_background_batch(self, frames, model_name=DEFAULT_MODEL, alpha_matting=False,
+                                batch_size=INFERENCE_BATCH_SIZE, return_model=False):
+        """
+        批量移除背景
+        
+        Args:
+            frames: uint8 RGB帧 [B, H, W, 3]（numpy数组或张量）
+            return_model: 同时返回实际使用的模型名称，见 predict_masks
+        
+        Returns:
+            numpy array: uint8 RGBA数组 [B, H, W, 4]
+        """
+        frames = np.asarray(frames)
+        alpha, used_model = self.predict_masks(frames, model_name, batch_size, return_model=True)
+
+        if alpha_matting:
+            # 抠图与前景颜色去污染共用同一条未知带
+            matted = [self._apply_alpha_matting(frame, a) for frame, a in zip(frames, alpha)]
+            alpha = np.stack([a for a, _ in matted])
+            rgb = np.stack([colors for _, colors in matted])
+        else:
+            # 与 rembg.remove 的 naive_cutout 一致: 颜色按alpha合成到透明背景上
+            rgb = (frames.astype(np.uint16) * alpha[..., None] + 127) // 255
+            rgb = rgb.astype(np.uint8)
+        rgba = np.concatenate([rgb, alpha[..., None]], axis=-1)
+        return (rgba, used_model) if return_model else rgba
+
+    def remove_background_array(self, image, model_name=DEFAULT_MODEL, alpha_matting=False):
+        """
+        移除背景，输入输出均为numpy数组
+        
+        Returns:
+            numpy array: uint8 RGBA数组 [H, W, 4]
+        """
+        return self.remove_background_batch(to_rgb_array(image)[None], model_name, alpha_matting)[0]
+
+    def remove_background(self, input_image, model_name='u2net', alpha_matting=False):
+        """
+        移除背景
+        
+        Args:
+            input_image: PIL Image对象、numpy数组或字节数据
+            model_name: 模型名称 ('u2net', 'birefnet', 'isnet', 'u2net_human_seg')
+            alpha_matting: 是否启用Alpha Matting边缘优化
+        
+        Returns:
+            PIL Image: 移除背景后的图像
+        """
+        return Image.fromarray(self.remove_background_array(input_image, model_name, alpha_matting), 'RGBA')
     
-    def _detect_edges(self, alpha):
+    def _apply_alpha_matting(self, image, alpha, decontaminate=True):
         """
-        检测alpha通道中的边缘区域
+        应用Alpha Matting边缘优化
+        
+        由模型遮罩生成三分图，只在未知带内求解闭式抠图，并可在同一条带内估计前景颜色
         
         Args:
-            alpha: Alpha通道数组
+            image: 原始图像 uint8 [H, W, 3]
+            alpha: 模型输出的 uint8 alpha遮罩 [H, W]
+            decontaminate: 是否去除未知带内的背景色溢出
             
         Returns:
-            numpy array: 边缘掩膜
+            (numpy array, numpy array): 边缘优化后的 uint8 alpha遮罩，uint8 RGB图像
         """
         try:
-            from scipy.ndimage import sobel
-            
-            # 计算梯度
-            dx = sobel(alpha, axis=1)
-            dy = sobel(alpha, axis=0)
-            magnitude = np.hypot(dx, dy)
-            
-            # 阈值化得到边缘
-            threshold = np.percentile(magnitude, 85)  # 取85%分位数作为阈值
-            edge_mask = magnitude > threshold
-            
-            # 膨胀操作，扩大边缘区域
-            from scipy.ndimage import binary_dilation
-            edge_mask = binary_dilation(edge_mask, iterations=2)
-            
-            return edge_mask
-            
-        except Exception:
-            # 如果scipy不可用，使用简单的差分检测
-            edge_mask = np.zeros_like(alpha, dtype=bool)
-            edge_mask[1:-1, 1:-1] = (
-                np.abs(alpha[1:-1, 2:] - alpha[1:-1, :-2]) > 0.1) | \
-                (np.abs(alpha[2:, 1:-1] - alpha[:-2, 1:-1]) > 0.1
-            )
-            return edge_mask
+            return matte_alpha(image, alpha, decontaminate=decontaminate)
+        except Exception as e:
+            print(f"[RemBG] Alpha Matting失败: {e}")
+            return alpha, image
     
-    def _fallback_remove_background(self, input_image):
+    def _fallback_mask(self, img_array):
         """
         备用背景移除算法（不依赖rembg）
         使用基于阈值的简单分割
         
         Args:
-            input_image: PIL Image对象
+            img_array: uint8 RGB数组 [H, W, 3]
             
         Returns:
-            PIL Image: 处理后的图像
+            numpy array: uint8 alpha遮罩 [H, W]
         """
         try:
-            # 转换为numpy数组
-            img_array = np.array(input_image)
             height, width = img_array.shape[:2]
             
             # 检测背景色（取四个角落的平均色）
@@ -216,29 +321,159 @@ class RemBGProcessor:
             except ImportError:
                 pass  # 如果没有scipy，跳过模糊
             
-            # 创建RGBA图像
-            result = np.dstack([img_array, alpha])
-            
-            return Image.fromarray(result, 'RGBA')
+            return alpha
             
-        except Exception as e:
-            # 返回原图像，添加完全不透明的alpha通道
-            img_array = np.array(input_image)
-            alpha = np.full((img_array.shape[0], img_array.shape[1]), 255, dtype=np.uint8)
-            result = np.dstack([img_array, alpha])
-            return Image.fromarray(result, 'RGBA')
+        except Exception:
+            # 完全不透明
+            return np.full(img_array.shape[:2], 255, dtype=np.uint8)
     
     def get_available_models(self):
         """获取可用的模型列表"""
         if not REMBG_AVAILABLE:
             return ['fallback']
         
-        available = []
-        for model_name, session in self.sessions.items():
-            if session is not None:
-                available.append(model_name)
-        
-        return available if available else ['fallback']
+        return list(MODEL_CATALOG)
+
+def to_rgb_array(image):
+    """将PIL Image、字节数据或numpy数组统一为 uint8 RGB数组 [H, W, 3]"""
+    if isinstance(image, bytes):
+        image = Image.open(io.BytesIO(image))
+    if isinstance(image, Image.Image):
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.array(image)
+    if not isinstance(image, np.ndarray):
+        raise ValueError("不支持的输入图像格式")
+
+    if image.ndim == 2:
+        image = np.repeat(image[..., None], 3, axis=2)
+    elif image.shape[2] == 1:
+        image = np.repeat(image, 3, axis=2)
+    elif image.shape[2] > 3:
+        image = image[..., :3]
+    if image.dtype != np.uint8:
+        image = np.clip(image, 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(image)
+
+
+def normalize_batch(x, spec):
+    """
+    按模型参数归一化已缩放到模型输入尺寸的图像
+    
+    Args:
+        x: float32 NCHW 图像，取值0-255
+    
+    Returns:
+        numpy array: float32 NCHW 输入
+    """
+    # 与 rembg 一致: 每帧先除以自身最大值，再按均值/方差归一化
+    x = x / x.amax(dim=(1, 2, 3), keepdim=True).clamp(min=1e-6)
+    x -= torch.tensor(spec['mean'], dtype=torch.float32).view(1, 3, 1, 1)
+    x /= torch.tensor(spec['std'], dtype=torch.float32).view(1, 3, 1, 1)
+    return x.contiguous().numpy()
+
+
+def infer_batch(inner, input_meta, spec, frames):
+    """
+    在模型输入分辨率上推理
+    
+    Args:
+        frames: uint8 RGB帧张量 [B, H, W, 3]
+    
+    Returns:
+        (torch.Tensor, torch.Tensor): 前景概率 [B, 1, h, w]，同尺寸的RGB引导图 [B, 3, h, w]（0-1）
+    """
+    width, height = spec['input_size']
+    x = resize_nchw(frames.permute(0, 3, 1, 2).to(torch.float32), width, height).clamp_(0, 255)
+    outputs = inner.run(None, {input_meta.name: normalize_batch(x, spec)})
+    prediction = torch.from_numpy(np.ascontiguousarray(outputs[0][:, :1], dtype=np.float32))
+    if spec.get('activation') == 'sigmoid':
+        prediction = torch.sigmoid(prediction)
+    return prediction, x.div_(255.0)
+
+
+def normalize_prediction(prediction):
+    """与 rembg 一致，将每帧模型输出线性拉伸到0-1"""
+    lo = prediction.amin(dim=(1, 2, 3), keepdim=True)
+    hi = prediction.amax(dim=(1, 2, 3), keepdim=True)
+    return (prediction - lo) / (hi - lo).clamp_(min=1e-6)
+
+
+def refine_with_tiles(inner, input_meta, spec, frame, mask, band, batch_size):
+    """
+    超大图像按重叠分块在较高分辨率上推理，只替换不确定带内的遮罩
+    
+    只推理与不确定带相交的分块；分块尺寸随图像增大，总块数不超过约 TILE_GRID²
+    
+    Args:
+        frame: 全分辨率 uint8 RGB帧 [H, W, 3]
+        mask: 导向上采样后的遮罩 [H, W]
+        band: 不确定带 [H, W] bool
+    """
+    height, width = frame.shape[:2]
+    tile = max(max(spec['input_size']), int(math.ceil(max(height, width) / TILE_GRID)))
+    overlap = tile // 4
+    boxes = [box for box in tile_boxes(height, width, tile, overlap)
+             if band[box[1]:box[3], box[0]:box[2]].any()]
+    if not boxes:
+        return mask
+
+    accum = torch.zeros_like(mask)
+    weight = torch.zeros_like(mask)
+    for start in range(0, len(boxes), batch_size):
+        chunk_boxes = boxes[start:start + batch_size]
+        # 同一批内的分块尺寸需一致，贴边的小块单独推理
+        groups = OrderedDict()
+        for box in chunk_boxes:
+            groups.setdefault((box[2] - box[0], box[3] - box[1]), []).append(box)
+        for (tile_w, tile_h), group in groups.items():
+            crops = torch.stack([frame[y0:y1, x0:x1] for x0, y0, x1, y1 in group])
+            prediction, guide = infer_batch(inner, input_meta, spec, crops)
+            refined, _ = guided_upsample(prediction.clamp_(0, 1), guide, crops)
+            window = tile_window(tile_h, tile_w, overlap)
+            for (x0, y0, x1, y1), tile_mask in zip(group, refined):
+                accum[y0:y1, x0:x1] += tile_mask * window
+                weight[y0:y1, x0:x1] += window
+
+    covered = band & (weight > 0)
+    mask[covered] = accum[covered] / weight[covered]
+    return mask
+
+
+def run_session(session, spec, frames, batch_size=INFERENCE_BATCH_SIZE):
+    """
+    直接调用rembg会话内部的ONNX推理，跳过 rembg.remove 的PNG编解码
+    
+    帧按微批次组成一个 NCHW 张量，在模型输入分辨率上推理；遮罩以原图为引导
+    做导向滤波上采样，长边超过 TILE_THRESHOLD 的图像再分块细化边缘带
+    
+    Args:
+        frames: uint8 RGB帧张量 [B, H, W, 3]
+    
+    Returns:
+        torch.Tensor: 原图尺寸的uint8 alpha遮罩 [B, H, W]
+    """
+    inner = session.inner_session
+    input_meta = inner.get_inputs()[0]
+    batch_size = max(1, int(batch_size))
+    # 导出时固定了批次维度的模型只能逐帧推理
+    if isinstance(input_meta.shape[0], int) and input_meta.shape[0] > 0:
+        batch_size = 1
+
+    frames = frames.cpu()
+    height, width = frames.shape[1:3]
+    use_tiles = TILE_THRESHOLD > 0 and max(height, width) > TILE_THRESHOLD
+    masks = []
+    for start in range(0, frames.shape[0], batch_size):
+        chunk = frames[start:start + batch_size]
+        prediction, guide = infer_batch(inner, input_meta, spec, chunk)
+        mask, band = guided_upsample(normalize_prediction(prediction), guide, chunk)
+        if use_tiles:
+            for i in range(chunk.shape[0]):
+                mask[i] = refine_with_tiles(inner, input_meta, spec, chunk[i], mask[i], band[i], batch_size)
+        masks.append(mask.clamp_(0, 1).mul_(255).to(torch.uint8))
+    return torch.cat(masks)
+
 
 # 全局处理器实例
 _processor = None
@@ -250,19 +485,23 @@ def get_processor():
         _processor = RemBGProcessor()
     return _processor
 
-def remove_background_api(image_data, model_name='u2net', alpha_matting=False):
+def remove_background_api(image_data, model_name='u2net', alpha_matting=False, mask_only=False):
     """
     API接口函数
     
     Args:
-        image_data: 图像数据（bytes或PIL Image）
+        image_data: 图像数据（bytes、PIL Image或numpy数组）
         model_name: 模型名称
         alpha_matting: 是否启用边缘优化
+        mask_only: 只返回alpha遮罩，跳过RGBA合成和PNG编码
         
     Returns:
-        bytes: 处理后的PNG图像数据
+        bytes: 处理后的PNG图像数据；mask_only 时为 uint8 遮罩数组 [H, W]
     """
     processor = get_processor()
+    if mask_only:
+        return processor.predict_alpha(to_rgb_array(image_data)[None], model_name, alpha_matting)[0]
+
     result_image = processor.remove_background(image_data, model_name, alpha_matting)
     
     # 转换为bytes
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+背景移除结果缓存
+按输入帧内容哈希、模型和后处理参数索引逐帧结果；
+内存部分复用 Super Canvas 的字节预算LRU缓存，可选磁盘缓存在重启后仍然有效
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from kontext_canvas_cache import CanvasCache
+
+# 内存缓存字节预算
+RESULT_CACHE_BUDGET_BYTES = int(os.environ.get("KONTEXT_REMBG_CACHE_MB", "512")) * 1024 * 1024
+
+# 磁盘缓存目录与字节预算（为0表示不启用磁盘缓存）
+RESULT_DISK_CACHE_DIR = Path(__file__).parent.parent / "user_data" / "rembg_results"
+RESULT_DISK_CACHE_BUDGET_BYTES = int(os.environ.get("KONTEXT_REMBG_DISK_CACHE_MB", "0")) * 1024 * 1024
+
+
+def frame_digest(frame):
+    """uint8 帧的快速内容哈希（包含尺寸）"""
+    frame = np.ascontiguousarray(frame)
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(str(frame.shape).encode('ascii'))
+    hasher.update(memoryview(frame).cast('B'))
+    return hasher.hexdigest()
+
+
+def result_key(digest, **params):
+    """由帧哈希和影响结果的参数组成缓存键（可直接用作文件名）"""
+    encoded = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    return f"{digest}-{hashlib.blake2b(encoded.encode('utf-8'), digest_size=8).hexdigest()}"
+
+
+class ResultDiskCache:
+    """
+    结果的磁盘缓存
+
+    - 每个条目保存为 <key>.png（遮罩为灰度，RGBA结果为四通道）
+    - 文件修改时间作为LRU顺序，总大小超出预算时删除最久未使用的条目
+    """
+
+    def __init__(self, cache_dir=RESULT_DISK_CACHE_DIR, budget_bytes=RESULT_DISK_CACHE_BUDGET_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.budget_bytes = budget_bytes
+        self._lock = threading.RLock()
+        self._index = OrderedDict()  # key -> 文件字节数
+        self._loaded = False
+        self.total_bytes = 0
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.png"
+
+    def _warm_load(self):
+        """首次访问时按修改时间重建LRU索引"""
+        if self._loaded:
+            return
+        entries = []
+        try:
+            for path in self.cache_dir.glob("*.png"):
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.stem, stat.st_size))
+        except OSError:
+            entries = []
+        entries.sort()
+        for _, key, size in entries:
+            self._index[key] = size
+            self.total_bytes += size
+        self._loaded = True
+        self._enforce_budget()
+
+    def get(self, key):
+        with self._lock:
+            self._warm_load()
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+
+        path = self._path(key)
+        try:
+            with Image.open(path) as image:
+                array = np.array(image)
+            now = time.time()
+            os.utime(path, (now, now))
+        except (OSError, ValueError):
+            with self._lock:
+                self._remove(key)
+            return None
+        return array
+
+    def set(self, key, array):
+        path = self._path(key)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + '.tmp')
+            Image.fromarray(array).save(tmp_path, format='PNG', compress_level=1)
+            os.replace(tmp_path, path)
+            size = path.stat().st_size
+        except (OSError, ValueError) as e:
+            print(f"[RemBG] 写入磁盘缓存失败: {e}")
+            return False
+
+        with self._lock:
+            self._warm_load()
+            if key in self._index:
+                self.total_bytes -= self._index.pop(key)
+            self._index[key] = size
+            self.total_bytes += size
+            self._enforce_budget()
+        return True
+
+    def _remove(self, key):
+        size = self._index.pop(key, None)
+        if size is not None:
+            self.total_bytes -= size
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
+
+    def _enforce_budget(self):
+        while self.total_bytes > self.budget_bytes and self._index:
+            self._remove(next(iter(self._index)))
+
+    def __len__(self):
+        return len(self._index)
+
+
+class ResultCache:
+    """
+    逐帧结果缓存: 先查内存，再查磁盘（命中后放回内存）
+
+    值为 uint8 数组；统计内存命中、磁盘命中和未命中次数
+    """
+
+    def __init__(self, budget_bytes=RESULT_CACHE_BUDGET_BYTES, disk_cache=None):
+        self.memory = CanvasCache(budget_bytes, 0)
+        self.disk = disk_cache
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+                with self._lock:
+                    self.disk_hits += 1
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def stats(self):
+        memory = self.memory.stats()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'entries': memory['entries'],
+                'total_bytes': memory['total_bytes'],
+                'budget_bytes': memory['budget_bytes'],
+                'evictions': memory['evictions'],
+                'disk_entries': len(self.disk) if self.disk is not None else 0,
+                'disk_bytes': self.disk.total_bytes if self.disk is not None else 0,
+            }
+
+
+# 全局结果缓存
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """获取全局结果缓存，配置了磁盘预算时同时启用磁盘缓存"""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            disk_cache = None
+            if RESULT_DISK_CACHE_BUDGET_BYTES > 0:
+                disk_cache = ResultDiskCache()
+            _result_cache = ResultCache(disk_cache=disk_cache)
+        return _result_cache
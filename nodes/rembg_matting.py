@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+背景移除 Alpha Matting
+由模型遮罩生成三分图，只在未知带内求解闭式抠图（稀疏线性方程组），
+并在同一条带内做前景颜色去污染；耗时随边缘长度而不是图像面积增长
+"""
+
+import cv2
+import numpy as np
+import torch
+
+# 模型alpha高于/低于该值视为确定前景/背景
+MATTING_FG_THRESHOLD = 240
+MATTING_BG_THRESHOLD = 15
+
+# 闭式抠图的正则项（图像取值0-1）
+MATTING_EPS = 1e-5
+
+# 未知像素对模型alpha的先验权重，保证方程组正定并在纹理平坦处贴近模型结果
+MATTING_PRIOR_WEIGHT = 1e-2
+
+# 已知像素的约束权重
+MATTING_KNOWN_WEIGHT = 100.0
+
+MATTING_MAX_ITERATIONS = 200
+MATTING_TOLERANCE = 1e-4
+
+# 未知带半宽（像素）；固定值，未知带面积只随边缘长度增长
+MATTING_BAND_WIDTH = 6
+
+# 分块求解: 每块的核心尺寸与外扩的上下文像素，单块方程组的内存因此有上限
+MATTING_TILE_SIZE = 384
+MATTING_TILE_MARGIN = 16
+
+# 3x3窗口内的偏移
+_WINDOW_DY, _WINDOW_DX = np.mgrid[-1:2, -1:2]
+_WINDOW_DY = _WINDOW_DY.ravel()
+_WINDOW_DX = _WINDOW_DX.ravel()
+
+
+def build_trimap(alpha, band_width):
+    """
+    由模型alpha生成三分图
+
+    确定前景/背景各自腐蚀 band_width 像素，剩余部分为未知带
+
+    Returns:
+        (numpy array, numpy array): 确定前景 [H, W] bool，未知带 [H, W] bool
+    """
+    kernel = np.ones((band_width * 2 + 1, band_width * 2 + 1), np.uint8)
+    foreground = cv2.erode((alpha >= MATTING_FG_THRESHOLD).astype(np.uint8), kernel) > 0
+    background = cv2.erode((alpha <= MATTING_BG_THRESHOLD).astype(np.uint8), kernel) > 0
+    return foreground, ~(foreground | background)
+
+
+class MattingSystem:
+    """
+    未知带上的闭式抠图方程组 (L + Λ) x = Λ g
+
+    只包含中心落在未知带（及其1像素邻域）内的3x3窗口；矩阵不显式组装，
+    按窗口做 9x9 乘加后散射累加，内存和耗时都与窗口数成正比。
+    已知像素以大权重约束到0/1，未知像素以小权重贴近模型alpha
+    """
+
+    def __init__(self, image, unknown, foreground, prior):
+        height, width = unknown.shape
+        centers = cv2.dilate(unknown.astype(np.uint8), np.ones((3, 3), np.uint8)) > 0
+        centers[0, :] = centers[-1, :] = False
+        centers[:, 0] = centers[:, -1] = False
+        cy, cx = np.nonzero(centers)
+
+        # 每个窗口的9个像素 [K, 9]，映射到参与求解像素的紧凑索引
+        neighbours = (cy[:, None] + _WINDOW_DY[None, :]) * width + (cx[:, None] + _WINDOW_DX[None, :])
+        self.pixels, local = np.unique(neighbours, return_inverse=True)
+        local = local.reshape(neighbours.shape)
+
+        colors = image.reshape(-1, 3)[neighbours]
+        centered = colors - colors.mean(axis=1, keepdims=True)
+        covariance = np.einsum('kni,knj->kij', centered, centered) / 9.0
+        covariance += np.eye(3) * (MATTING_EPS / 9.0)
+        inverse = np.linalg.inv(covariance)
+        affinity = (1.0 + np.einsum('kni,kij,kmj->knm', centered, inverse, centered)) / 9.0
+        values = np.eye(9)[None] - affinity
+
+        pixel_count = self.pixels.size
+        self.is_unknown = unknown.ravel()[self.pixels]
+        initial = prior.ravel()[self.pixels]
+        target = np.where(self.is_unknown, initial, foreground.ravel()[self.pixels].astype(np.float64))
+        weight = np.where(self.is_unknown, MATTING_PRIOR_WEIGHT, MATTING_KNOWN_WEIGHT)
+
+        self.local = torch.from_numpy(local)
+        self.flat_local = self.local.reshape(-1)
+        self.values = torch.from_numpy(values)
+        self.weight = torch.from_numpy(weight)
+        self.rhs = torch.from_numpy(weight * target)
+        self.initial = torch.from_numpy(initial.astype(np.float64))
+        self.diagonal = torch.from_numpy(
+            np.bincount(local.ravel(), weights=np.diagonal(values, axis1=1, axis2=2).ravel(),
+                        minlength=pixel_count) + weight
+        )
+
+    def matvec(self, x):
+        """计算 (L + Λ) x"""
+        products = torch.bmm(self.values, x[self.local].unsqueeze(-1)).reshape(-1)
+        return (self.weight * x).index_add_(0, self.flat_local, products)
+
+    def solve(self, iterations=MATTING_MAX_ITERATIONS, tolerance=MATTING_TOLERANCE):
+        """Jacobi预条件共轭梯度，以模型alpha为初值"""
+        x = self.initial.clone()
+        residual = self.rhs - self.matvec(x)
+        z = residual / self.diagonal
+        direction = z.clone()
+        rz = residual @ z
+        threshold = tolerance * max(float(self.rhs.norm()), 1e-12)
+        for _ in range(iterations):
+            product = self.matvec(direction)
+            step = rz / (direction @ product)
+            x += step * direction
+            residual -= step * product
+            if float(residual.norm()) <= threshold:
+                break
+            z = residual / self.diagonal
+            rz_next = residual @ z
+            direction = z + (rz_next / rz) * direction
+            rz = rz_next
+        return x.clamp_(0, 1).numpy()
+
+
+def _window_means(integral, count_integral, ys, xs, radius, height, width):
+    """用积分图求 (ys, xs) 处方形窗口内的颜色和与像素数"""
+    y0 = np.clip(ys - radius, 0, height)
+    y1 = np.clip(ys + radius + 1, 0, height)
+    x0 = np.clip(xs - radius, 0, width)
+    x1 = np.clip(xs + radius + 1, 0, width)
+
+    def box(table):
+        return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+    return box(integral), box(count_integral)
+
+
+def decontaminate_colors(image, alpha, foreground, background, unknown, band_width):
+    """
+    在未知带内估计前景颜色: 用附近确定前景/背景的平均颜色作为 F/B 的局部估计，
+    再由 I = αF + (1-α)B 反解 F，去除背景色溢出
+
+    Returns:
+        numpy array: uint8 RGB [H, W, 3]
+    """
+    height, width = alpha.shape
+    ys, xs = np.nonzero(unknown)
+    result = image.copy()
+    if ys.size == 0:
+        return result
+
+    image_float = image.astype(np.float32) / 255.0
+    radius = band_width * 2 + 1
+    estimates = []
+    for known in (foreground, background):
+        known_float = known.astype(np.float32)
+        color_sum, count = _window_means(
+            cv2.integral(image_float * known_float[..., None]), cv2.integral(known_float),
+            ys, xs, radius, height, width
+        )
+        count = count.reshape(-1, 1)
+        local = np.where(count > 0, color_sum / np.maximum(count, 1e-6), image_float[ys, xs])
+        estimates.append(local)
+    local_fg, local_bg = estimates
+
+    a = (alpha[ys, xs].astype(np.float32) / 255.0)[:, None]
+    observed = image_float[ys, xs]
+    solved = np.clip((observed - (1.0 - a) * local_bg) / np.maximum(a, 1e-3), 0.0, 1.0)
+    # alpha很小时反解不稳定，改用附近前景颜色
+    colors = np.where(a > 0.1, solved, local_fg)
+    result[ys, xs] = np.round(colors * 255.0).astype(np.uint8)
+    return result
+
+
+def _solve_tiles(image, alpha, unknown, foreground):
+    """
+    按块求解未知带: 每块连同外扩的上下文一起求解，只写回块核心内的结果
+
+    Returns:
+        numpy array: 抠图后的 uint8 alpha [H, W]
+    """
+    height, width = alpha.shape
+    matted = alpha.copy()
+    ys, xs = np.nonzero(unknown)
+    y_start, y_end = int(ys.min()), int(ys.max()) + 1
+    x_start, x_end = int(xs.min()), int(xs.max()) + 1
+
+    for ty in range(y_start, y_end, MATTING_TILE_SIZE):
+        for tx in range(x_start, x_end, MATTING_TILE_SIZE):
+            core_y1 = min(ty + MATTING_TILE_SIZE, y_end)
+            core_x1 = min(tx + MATTING_TILE_SIZE, x_end)
+            if not unknown[ty:core_y1, tx:core_x1].any():
+                continue
+            y0 = max(ty - MATTING_TILE_MARGIN, 0)
+            x0 = max(tx - MATTING_TILE_MARGIN, 0)
+            y1 = min(core_y1 + MATTING_TILE_MARGIN, height)
+            x1 = min(core_x1 + MATTING_TILE_MARGIN, width)
+            if y1 - y0 < 3 or x1 - x0 < 3:
+                continue
+
+            region_unknown = unknown[y0:y1, x0:x1]
+            system = MattingSystem(
+                image[y0:y1, x0:x1].astype(np.float64) / 255.0, region_unknown,
+                foreground[y0:y1, x0:x1], alpha[y0:y1, x0:x1].astype(np.float64) / 255.0
+            )
+            solved = np.round(system.solve() * 255.0).astype(np.uint8)
+
+            region = alpha[y0:y1, x0:x1].copy().reshape(-1)
+            region[system.pixels[system.is_unknown]] = solved[system.is_unknown]
+            region = region.reshape(y1 - y0, x1 - x0)
+
+            # 只写回块核心内的未知像素
+            cy0, cx0 = ty - y0, tx - x0
+            cy1, cx1 = core_y1 - y0, core_x1 - x0
+            core_unknown = region_unknown[cy0:cy1, cx0:cx1]
+            matted[ty:core_y1, tx:core_x1][core_unknown] = region[cy0:cy1, cx0:cx1][core_unknown]
+    return matted
+
+
+def matte_alpha(image, alpha, band_width=MATTING_BAND_WIDTH, decontaminate=True):
+    """
+    在模型遮罩的未知带内做闭式抠图
+
+    Args:
+        image: uint8 RGB [H, W, 3]
+        alpha: 模型输出的 uint8 alpha [H, W]
+        band_width: 未知带半宽（像素）
+        decontaminate: 是否同时估计未知带内的前景颜色
+
+    Returns:
+        (numpy array, numpy array): uint8 alpha [H, W]，uint8 RGB [H, W, 3]（不去污染时为原图）
+    """
+    height, width = alpha.shape
+    foreground, unknown = build_trimap(alpha, band_width)
+    if height < 3 or width < 3 or not unknown.any():
+        return alpha, image
+
+    matted = _solve_tiles(image, alpha, unknown, foreground)
+
+    if not decontaminate:
+        return matted, image
+    background = ~(foreground | unknown)
+    return matted, decontaminate_colors(image, matted, foreground, background, unknown, band_width)
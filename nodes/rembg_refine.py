@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+背景移除遮罩细化
+低分辨率遮罩以全分辨率原图为引导做快速导向滤波上采样，
+只在前景/背景不确定的边缘带内计算；超大图像再按重叠分块推理细化边缘带
+"""
+
+import math
+
+import torch
+import torch.nn.functional as F
+
+# 低分辨率遮罩中介于两者之间的像素视为不确定，需要细化
+BAND_LOW = 0.02
+BAND_HIGH = 0.98
+
+# 导向滤波正则项（引导图取值0-1），越小越贴合原图边缘
+GUIDED_EPS = 1e-3
+
+# 灰度引导图的通道权重
+_GRAY_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def resize_nchw(x, width, height):
+    """缩放 NCHW 浮点张量，缩小使用区域插值，放大使用双三次插值"""
+    if x.shape[-2:] == (height, width):
+        return x
+    if width <= x.shape[-1] and height <= x.shape[-2]:
+        return F.interpolate(x, size=(height, width), mode='area')
+    return F.interpolate(x, size=(height, width), mode='bicubic', align_corners=False)
+
+
+def _box_mean_1d(x, radius, dim):
+    """沿NCHW的宽（dim=-1）或高（dim=-2）用累加和求窗口均值，耗时与半径无关"""
+    length = x.shape[dim]
+    csum = torch.cat([torch.zeros_like(x.narrow(dim, 0, 1)), x.cumsum(dim)], dim=dim)
+    # 两端按边界值延拓累加和，窗口超出图像的部分贡献为0
+    pad = (radius, radius, 0, 0) if dim == -1 else (0, 0, radius, radius)
+    csum = F.pad(csum, pad, mode='replicate')
+    total = csum.narrow(dim, 2 * radius + 1, length) - csum.narrow(dim, 0, length)
+
+    index = torch.arange(length, device=x.device)
+    count = (index + radius + 1).clamp_(max=length) - (index - radius).clamp_(min=0)
+    shape = [1, 1, 1, length] if dim == -1 else [1, 1, length, 1]
+    return total / count.to(x.dtype).view(shape)
+
+
+def box_filter(x, radius):
+    """NCHW 均值滤波（按行、列分两次），边界处只对图像内像素取平均"""
+    return _box_mean_1d(_box_mean_1d(x, radius, -1), radius, -2)
+
+
+def guided_coefficients(guide, src, radius, eps=GUIDED_EPS):
+    """
+    导向滤波的线性系数 q = a * I + b（已做均值平滑）
+
+    Args:
+        guide: 灰度引导图 [B, 1, h, w]
+        src: 待滤波遮罩 [B, 1, h, w]
+
+    Returns:
+        torch.Tensor: [B, 2, h, w]，通道0为a，通道1为b
+    """
+    mean_i = box_filter(guide, radius)
+    mean_p = box_filter(src, radius)
+    cov_ip = box_filter(guide * src, radius) - mean_i * mean_p
+    var_i = box_filter(guide * guide, radius) - mean_i * mean_i
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    return torch.cat([box_filter(a, radius), box_filter(b, radius)], dim=1)
+
+
+def uncertain_band(masks, low=BAND_LOW, high=BAND_HIGH):
+    """不确定带: 取值在 (low, high) 之间的像素，再向外扩展1像素 [B, 1, h, w] bool"""
+    band = ((masks > low) & (masks < high)).to(masks.dtype)
+    return F.max_pool2d(band, 3, stride=1, padding=1) > 0
+
+
+def guided_upsample(masks, guide, frames, radius=None, eps=GUIDED_EPS):
+    """
+    以全分辨率原图为引导上采样低分辨率遮罩
+
+    导向滤波系数在低分辨率上求解，只在不确定带内按全分辨率像素求值，
+    带外直接使用双三次上采样结果（接近0或1）
+
+    Args:
+        masks: 低分辨率遮罩 [B, 1, h, w]，取值0-1
+        guide: 与遮罩同尺寸的低分辨率RGB图 [B, 3, h, w]，取值0-1
+        frames: 全分辨率 uint8 RGB帧 [B, H, W, 3]
+        radius: 低分辨率上的滤波半径，默认按尺寸自动选择
+
+    Returns:
+        (torch.Tensor, torch.Tensor): 全分辨率遮罩 [B, H, W]，不确定带 [B, H, W] bool
+    """
+    height, width = frames.shape[1:3]
+    low_h, low_w = masks.shape[-2:]
+    upsampled = resize_nchw(masks, width, height).clamp(0, 1)[:, 0].contiguous()
+    if height <= low_h and width <= low_w:
+        return upsampled, torch.zeros_like(upsampled, dtype=torch.bool)
+
+    if radius is None:
+        radius = max(1, min(low_h, low_w) // 160)
+    gray_weights = torch.tensor(_GRAY_WEIGHTS, dtype=guide.dtype)
+    gray = (guide * gray_weights.view(1, 3, 1, 1)).sum(dim=1, keepdim=True)
+    coefficients = guided_coefficients(gray, masks, radius, eps)
+
+    band = uncertain_band(masks)
+    band = F.interpolate(band.to(masks.dtype), size=(height, width), mode='nearest')[:, 0] > 0
+
+    for i in range(frames.shape[0]):
+        ys, xs = band[i].nonzero(as_tuple=True)
+        if ys.numel() == 0:
+            continue
+        # 只在带内像素处双线性采样系数
+        grid = torch.stack([
+            (xs.to(torch.float32) + 0.5) / width * 2 - 1,
+            (ys.to(torch.float32) + 0.5) / height * 2 - 1,
+        ], dim=-1).view(1, 1, -1, 2)
+        ab = F.grid_sample(coefficients[i:i + 1], grid, mode='bilinear',
+                           padding_mode='border', align_corners=False)[0, :, 0]
+        pixels = frames[i, ys, xs].to(torch.float32).div_(255.0)
+        intensity = pixels @ gray_weights.to(torch.float32)
+        upsampled[i, ys, xs] = (ab[0] * intensity + ab[1]).clamp_(0, 1)
+    return upsampled, band
+
+
+def tile_starts(length, tile, overlap):
+    """沿一个维度排列重叠分块的起点，最后一块贴齐末端"""
+    if length <= tile:
+        return [0]
+    step = max(1, tile - overlap)
+    count = int(math.ceil((length - tile) / step)) + 1
+    starts = [min(i * step, length - tile) for i in range(count)]
+    return sorted(set(starts))
+
+
+def tile_boxes(height, width, tile, overlap):
+    """返回覆盖整幅图像的重叠分块 (x0, y0, x1, y1)"""
+    return [
+        (x0, y0, min(x0 + tile, width), min(y0 + tile, height))
+        for y0 in tile_starts(height, tile, overlap)
+        for x0 in tile_starts(width, tile, overlap)
+    ]
+
+
+def tile_window(height, width, overlap):
+    """分块融合权重: 重叠区内从块边缘线性过渡 [h, w]"""
+    def ramp(length):
+        position = torch.arange(length, dtype=torch.float32)
+        distance = torch.minimum(position + 0.5, length - position - 0.5)
+        return (distance / max(overlap, 1)).clamp_(1e-3, 1.0)
+
+    return ramp(height)[:, None] * ramp(width)[None, :]
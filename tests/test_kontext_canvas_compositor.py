@@ -0,0 +1,81 @@
+"""服务端合成与标注遮罩: 放大后的图层边缘保持原值，遮罩面积与图形一致"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'nodes'))
+from kontext_canvas_compositor import (
+    INPUT_LAYER_NAME, composite_layers, rasterize_annotation, render_scene_batch
+)
+
+FLAT_VALUE = 50
+
+
+def _flat_layer(size=10):
+    rgba = np.full((size, size, 4), FLAT_VALUE, dtype=np.uint8)
+    rgba[:, :, 3] = 255
+    return rgba
+
+
+def _expected(canvas_size, rect):
+    """白色画布上 rect=(x0, y0, x1, y1) 内为图层颜色"""
+    x0, y0, x1, y1 = rect
+    expected = np.full((canvas_size, canvas_size, 3), 255, dtype=np.uint8)
+    expected[y0:y1, x0:x1] = FLAT_VALUE
+    return expected
+
+
+def test_composite_scaled_layer_edges():
+    # 10x10 图层放大2倍，像素对齐地占据 [10, 30)
+    transforms = {'layer': {'asset_id': 'flat', 'centerX': 20, 'centerY': 20,
+                            'scaleX': 2, 'scaleY': 2, 'width': 10, 'height': 10}}
+    result = composite_layers(transforms, lambda _: _flat_layer(), 40, 40, '#ffffff')
+    expected = _expected(40, (10, 10, 30, 30))
+    np.testing.assert_array_equal(result[10, 10:30], expected[10, 10:30])
+    np.testing.assert_array_equal(result[29, 10:30], expected[29, 10:30])
+    np.testing.assert_array_equal(result[10:30, 10], expected[10:30, 10])
+    np.testing.assert_array_equal(result[10:30, 29], expected[10:30, 29])
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_batch_scaled_layer_edges():
+    frames = np.full((2, 10, 10, 3), FLAT_VALUE, dtype=np.uint8)
+    scene = {'width': 40, 'height': 40, 'background': '#ffffff', 'objects': [{
+        'type': 'image', 'name': INPUT_LAYER_NAME, 'left': 10, 'top': 10,
+        'scaleX': 2, 'scaleY': 2, 'width': 10, 'height': 10,
+    }]}
+    result = render_scene_batch(scene, frames, lambda _: None)
+    expected = _expected(40, (10, 10, 30, 30))
+    for frame in result:
+        np.testing.assert_array_equal(frame, expected)
+
+
+def test_batch_fill_canvas_edges():
+    # 没有输入图层时帧铺满画布，四周边缘也应为原值
+    frames = np.full((1, 10, 10, 3), FLAT_VALUE, dtype=np.uint8)
+    scene = {'width': 40, 'height': 40, 'background': '#ffffff', 'objects': []}
+    result = render_scene_batch(scene, frames, lambda _: None)
+    np.testing.assert_array_equal(result[0], np.full((40, 40, 3), FLAT_VALUE, dtype=np.uint8))
+
+
+IDENTITY = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+
+
+def test_annotation_mask_matches_shape_area():
+    rect = {'type': 'rect', 'left': 5, 'top': 5, 'width': 50, 'height': 80, 'stroke': None, 'strokeWidth': 3}
+    for antialias in (True, False):
+        mask = rasterize_annotation(rect, IDENTITY, (100, 100), antialias)
+        assert (mask > 0).sum() == 4000
+        assert mask[5:85, 5:55].min() == 255
+
+
+def test_annotation_mask_soft_edges():
+    # 非整数位置的矩形: 软遮罩边缘为部分覆盖，总面积保持不变
+    rect = {'type': 'rect', 'left': 3.5, 'top': 2, 'width': 10, 'height': 10}
+    soft = rasterize_annotation(rect, IDENTITY, (32, 32), antialias=True)
+    assert soft[5, 3] == 128 and soft[5, 13] == 128
+    assert abs(soft.sum() / 255.0 - 100.0) < 0.5
+    binary = rasterize_annotation(rect, IDENTITY, (32, 32), antialias=False)
+    assert set(np.unique(binary)) == {0, 255}
@@ -14,12 +14,214 @@ const CANVAS_SIZE = {
     SIDEBAR_WIDTH: 50
 };
 
+// 增量上传的瓦片尺寸，以及超过该比例的瓦片变化时改为完整上传
+const DELTA_TILE_SIZE = 128;
+const DELTA_MAX_DIRTY_RATIO = 0.5;
+
+// 处理执行请求期间向服务器报告进度的间隔，服务器据此延后等待超时
+const PROGRESS_INTERVAL_MS = 2000;
+
+// 完整上传的编码格式: png、webp（无损）或 raw（原始RGBA + deflate），在ComfyUI设置中切换
+const UPLOAD_FORMAT_SETTING_ID = 'LRPG.Canvas.UploadFormat';
+const UPLOAD_FORMATS = ['png', 'webp', 'raw'];
+
+function computeTileHashes(pixels, width, height, tileSize) {
+    // 按瓦片计算64位哈希（两个32位FNV变体），按行优先顺序返回
+    const data32 = new Uint32Array(pixels.buffer, pixels.byteOffset, width * height);
+    const tilesX = Math.ceil(width / tileSize);
+    const tilesY = Math.ceil(height / tileSize);
+    const hashes = new Array(tilesX * tilesY);
+
+    for (let ty = 0; ty < tilesY; ty++) {
+        const y1 = Math.min((ty + 1) * tileSize, height);
+        for (let tx = 0; tx < tilesX; tx++) {
+            const x0 = tx * tileSize;
+            const x1 = Math.min(x0 + tileSize, width);
+            let h1 = 0x811c9dc5;
+            let h2 = 0x9e3779b9;
+            for (let y = ty * tileSize; y < y1; y++) {
+                const row = y * width;
+                for (let x = x0; x < x1; x++) {
+                    const v = data32[row + x];
+                    h1 = Math.imul(h1 ^ v, 0x01000193);
+                    h2 = Math.imul(h2 ^ v, 0x85ebca6b);
+                    h2 ^= h2 >>> 13;
+                }
+            }
+            hashes[ty * tilesX + tx] = (h1 >>> 0).toString(36) + ':' + (h2 >>> 0).toString(36);
+        }
+    }
+    return hashes;
+}
+
+async function packTileDelta(pixels, width, height, tileHashes, baseline, tileSize, maxDirtyRatio) {
+    // 与上次被服务器接受的帧对比，只打包变化的瓦片（RGB原始数据）
+    if (!baseline || baseline.width !== width || baseline.height !== height) {
+        return null;
+    }
+
+    const tilesX = Math.ceil(width / tileSize);
+    const dirty = [];
+    for (let i = 0; i < tileHashes.length; i++) {
+        if (tileHashes[i] !== baseline.tileHashes[i]) {
+            dirty.push([i % tilesX, Math.floor(i / tilesX)]);
+        }
+    }
+    // 变化过多时完整上传更划算
+    if (dirty.length > tileHashes.length * maxDirtyRatio) {
+        return null;
+    }
+
+    let byteLength = 0;
+    const bounds = dirty.map(([tx, ty]) => {
+        const x0 = tx * tileSize;
+        const y0 = ty * tileSize;
+        const w = Math.min(tileSize, width - x0);
+        const h = Math.min(tileSize, height - y0);
+        byteLength += w * h * 3;
+        return [x0, y0, w, h];
+    });
+
+    const rgb = new Uint8Array(byteLength);
+    let offset = 0;
+    for (const [x0, y0, w, h] of bounds) {
+        for (let y = y0; y < y0 + h; y++) {
+            let src = (y * width + x0) * 4;
+            for (let x = 0; x < w; x++, src += 4) {
+                rgb[offset++] = pixels[src];
+                rgb[offset++] = pixels[src + 1];
+                rgb[offset++] = pixels[src + 2];
+            }
+        }
+    }
+
+    let tiles = new Blob([rgb], { type: 'application/octet-stream' });
+    let encoding = null;
+    if (typeof CompressionStream !== 'undefined') {
+        tiles = await new Response(tiles.stream().pipeThrough(new CompressionStream('gzip'))).blob();
+        encoding = 'gzip';
+    }
+    return { dirty, tiles, encoding };
+}
+
+// 画布Worker: 读取像素、计算瓦片哈希、打包增量并在OffscreenCanvas上编码，避免阻塞编辑器。
+// 瓦片哈希与增量打包复用上面的函数，主线程回退路径与Worker结果一致
+const ENCODER_WORKER_SOURCE = `
+${computeTileHashes}
+${packTileDelta}
+
+// 已读取、等待编码或释放的帧
+const frames = new Map();
+
+async function encodePixels(pixels, width, height, format) {
+    if (format === 'raw') {
+        const stream = new Blob([pixels]).stream().pipeThrough(new CompressionStream('deflate'));
+        const blob = await new Response(stream).blob();
+        return { blob, format: 'raw', encoding: 'deflate' };
+    }
+    const canvas = new OffscreenCanvas(width, height);
+    canvas.getContext('2d').putImageData(new ImageData(pixels, width, height), 0, 0);
+    // WebP在quality为1时使用无损编码；浏览器不支持WebP时返回PNG
+    const blob = await canvas.convertToBlob(
+        format === 'webp' ? { type: 'image/webp', quality: 1 } : { type: 'image/png' }
+    );
+    return { blob, format: blob.type === 'image/webp' ? 'webp' : 'png', encoding: null };
+}
+
+self.onmessage = async (event) => {
+    const { id, type } = event.data;
+    try {
+        if (type === 'capture') {
+            const { bitmap, baseline, tileSize, maxDirtyRatio } = event.data;
+            const { width, height } = bitmap;
+            const canvas = new OffscreenCanvas(width, height);
+            const context = canvas.getContext('2d', { willReadFrequently: true });
+            context.drawImage(bitmap, 0, 0);
+            bitmap.close();
+            const pixels = context.getImageData(0, 0, width, height).data;
+            const tileHashes = computeTileHashes(pixels, width, height, tileSize);
+            const delta = await packTileDelta(pixels, width, height, tileHashes, baseline, tileSize, maxDirtyRatio);
+            frames.set(id, { pixels, width, height });
+            self.postMessage({ id, frameId: id, width, height, tileHashes, delta });
+        } else if (type === 'encode') {
+            const frame = frames.get(event.data.frameId);
+            frames.delete(event.data.frameId);
+            if (!frame) throw new Error('frame released');
+            const encoded = await encodePixels(frame.pixels, frame.width, frame.height, event.data.format);
+            self.postMessage({ id, ...encoded });
+        } else if (type === 'release') {
+            frames.delete(event.data.frameId);
+        }
+    } catch (error) {
+        self.postMessage({ id, error: String(error) });
+    }
+};
+`;
+
+let encoderWorker = null;
+let encoderRequestId = 0;
+const encoderPending = new Map();
+
+function getEncoderWorker() {
+    // 所有画布节点共享一个编码Worker；环境不支持时返回null
+    if (encoderWorker !== null) return encoderWorker || null;
+    if (typeof Worker === 'undefined' || typeof OffscreenCanvas === 'undefined') {
+        encoderWorker = false;
+        return null;
+    }
+    try {
+        const url = URL.createObjectURL(new Blob([ENCODER_WORKER_SOURCE], { type: 'text/javascript' }));
+        encoderWorker = new Worker(url);
+        encoderWorker.onmessage = (event) => {
+            const pending = encoderPending.get(event.data.id);
+            if (!pending) return;
+            encoderPending.delete(event.data.id);
+            if (event.data.error) {
+                pending.reject(new Error(event.data.error));
+            } else {
+                pending.resolve(event.data);
+            }
+        };
+        encoderWorker.onerror = (event) => {
+            // Worker无法运行（例如CSP限制）时，拒绝所有等待中的请求并停用Worker
+            for (const pending of encoderPending.values()) {
+                pending.reject(new Error(event.message || 'encoder worker failed'));
+            }
+            encoderPending.clear();
+            encoderWorker.terminate();
+            encoderWorker = false;
+        };
+    } catch (error) {
+        encoderWorker = false;
+    }
+    return encoderWorker || null;
+}
+
+function postToEncoder(worker, message, transfer = []) {
+    // 向Worker发送请求并等待带相同id的响应
+    const id = ++encoderRequestId;
+    const result = new Promise((resolve, reject) => encoderPending.set(id, { resolve, reject }));
+    try {
+        worker.postMessage({ ...message, id }, transfer);
+    } catch (error) {
+        encoderPending.delete(id);
+        throw error;
+    }
+    return result;
+}
+
 class LRPGCanvas {
     constructor(node, initialSize = null) {
         this.node = node;
         this.lastCanvasState = null; 
         this.lastCanvasStateHash = null; // 用于检测画布内容变化
         this.isSendingData = false; // 防重复发送标志
+        this.deltaBaseline = null; // 服务器已接受的上一帧（用于瓦片增量上传）
+        this.layerAssetIds = new WeakMap(); // 图层位图元素 -> 服务器资源ID
+        this.objectStateHashes = new WeakMap(); // 对象 -> {guard, hash}，对象修改时失效
+        this.payloadHashes = new WeakMap(); // 图像元素/路径数组 -> 内容哈希，避免重复序列化大数据
+        this.inputAssetId = null; // 当前画布上的上游输入图像资源ID
+        this.pendingInputImage = null; // 正在加载的上游输入图像
         this.customEventsActive = false; // 自定义事件监听器状态标志
         
         // 使用传入的初始尺寸或默认尺寸
@@ -1833,6 +2035,7 @@ class LRPGCanvas {
         
         // 文字编辑完成事件
         this.canvas.on('text:editing:exited', (e) => {
+            this.invalidateObjectHash(e.target);
             this.markCanvasChanged();
         });
         
@@ -1853,7 +2056,8 @@ class LRPGCanvas {
             this.markCanvasChanged();
         });
         
-        this.canvas.on('object:modified', () => {
+        this.canvas.on('object:modified', (e) => {
+            this.invalidateObjectHash(e.target);
             this.markCanvasChanged();
         });
     }
@@ -2112,16 +2316,15 @@ class LRPGCanvas {
         if (!this.canvas) return;
         
         try {
+            // 图层位图以资源ID引用，场景可在服务端无浏览器渲染
+            await this.ensureLayerAssets();
+            // 只重新计算被修改对象的哈希
+            const { stateHash, stateParts } = this.computeCanvasStateHash();
+            if (stateHash === this.lastCanvasStateHash) return;
             const canvasJSON = this.canvas.toJSON();
             const layer_transforms = this.extractTransformData();
-            const stateString = JSON.stringify({
-                objects: canvasJSON.objects,
-                background: canvasJSON.background,
-                transforms: layer_transforms
-            });
-            const stateHash = this.hashString(stateString);
             
-            // 只发送状态哈希，不发送图像数据
+            // 只发送状态哈希和场景描述，不发送图像数据
             await fetch('/lrpg_canvas', {
                 method: 'POST',
                 headers: {
@@ -2130,7 +2333,10 @@ class LRPGCanvas {
                 body: JSON.stringify({
                     node_id: this.node.id.toString(),
                     canvas_state: stateHash,
+                    state_parts: stateParts,
                     layer_transforms: {},
+                    scene: this.buildCanvasScene(canvasJSON, layer_transforms),
+                    workflow_id: this.getWorkflowId(),
                     main_image: null,
                     main_mask: null
                 })
@@ -2182,11 +2388,74 @@ class LRPGCanvas {
         api.addEventListener("lrpg_canvas_get_state", async (event) => {
             const data = event.detail;
             if (data && data.node_id && data.node_id === this.node.id.toString()) {
-                await this.sendCanvasState();
+                await this.sendCanvasState(data.request_id);
+            }
+        });
+
+        // 上游输入图像以资源引用推送，图像本身通过可缓存的URL加载
+        api.addEventListener("lrpg_canvas_input_image", (event) => {
+            const data = event.detail;
+            if (data && data.node_id && data.node_id === this.node.id.toString()) {
+                const loading = this.applyInputImage(data);
+                this.pendingInputImage = loading;
+                loading.finally(() => {
+                    if (this.pendingInputImage === loading) this.pendingInputImage = null;
+                });
             }
         });
     }
 
+    async applyInputImage(data) {
+        // 替换（或添加）InputImage图层；同一资源不重复加载
+        if (!this.canvas || this.inputAssetId === data.asset_id) return;
+        try {
+            const fabricImg = await new Promise((resolve, reject) => {
+                fabric.Image.fromURL(data.url, (img) => img ? resolve(img) : reject(new Error('load failed')), {
+                    crossOrigin: 'anonymous'
+                });
+            });
+            const element = fabricImg.getElement();
+            // 资源已在服务器上，服务端合成时无需再上传
+            this.layerAssetIds.set(element, data.asset_id);
+
+            const existing = this.canvas.getObjects().find(obj => obj.name === 'InputImage' && obj.type === 'image');
+            if (existing) {
+                // 保持原图层的显示尺寸和变换
+                const displayWidth = existing.getScaledWidth();
+                const displayHeight = existing.getScaledHeight();
+                existing.setElement(element);
+                existing.set({
+                    scaleX: displayWidth / existing.width,
+                    scaleY: displayHeight / existing.height
+                });
+                existing.setCoords();
+                this.invalidateObjectHash(existing);
+            } else {
+                fabricImg.set({
+                    left: 0,
+                    top: 0,
+                    scaleX: this.originalSize.width / fabricImg.width,
+                    scaleY: this.originalSize.height / fabricImg.height,
+                    originX: 'left',
+                    originY: 'top',
+                    selectable: true,
+                    evented: true,
+                    name: 'InputImage'
+                });
+                // 作为最底层加入，保留已有的标注
+                this.canvas.insertAt(fabricImg, 0);
+            }
+            this.inputAssetId = data.asset_id;
+            this.canvas.renderAll();
+            if (this.layerPanel && this.layerPanel.isExpanded) {
+                this.updateLayerList();
+            }
+            this.markCanvasChanged();
+        } catch (error) {
+            console.warn('[LRPG Canvas] 输入图像加载失败:', error);
+        }
+    }
+
     // updateCanvas和addLayers方法已移除，因为不再使用lrpg_data输入端口
     // 现在使用"从输入"功能和loadImageFromConnectedNode方法来加载图像
 
@@ -2468,7 +2737,7 @@ class LRPGCanvas {
         }
     }
 
-    async sendCanvasState() {
+    async sendCanvasState(requestId = null) {
         if (!this.canvas) return;
         
         // 防重复执行机制 - 关键修复
@@ -2477,8 +2746,15 @@ class LRPGCanvas {
         }
         
         this.isSendingData = true;
+        // 渲染、编码或上传耗时较长时持续报告进度，避免服务器按历史延迟提前超时
+        const progressTimer = requestId ? setInterval(() => this.reportCanvasProgress(requestId), PROGRESS_INTERVAL_MS) : null;
         
         try {
+            // 等待上游输入图像加载完成，确保导出的画布包含它
+            if (this.pendingInputImage) {
+                await this.pendingInputImage;
+            }
+
             // 确保画布完全渲染后再导出 - 关键修复
             await new Promise(resolve => {
                 this.canvas.renderAll();
@@ -2487,52 +2763,105 @@ class LRPGCanvas {
                 });
             });
             
+            // 仅包含图像图层时，由服务端根据变换数据合成，无需上传整张画布
+            const composeOnServer = this.canComposeOnServer() && await this.ensureLayerAssets();
             const layer_transforms = this.extractTransformData();
             
-            // 生成画布状态哈希用于变化检测
+            // 生成画布状态哈希用于变化检测；执行时全部重新计算，不依赖修改事件
             const canvasJSON = this.canvas.toJSON();
-            const stateString = JSON.stringify({
-                objects: canvasJSON.objects,
-                background: canvasJSON.background,
-                transforms: layer_transforms
-            });
-            const stateHash = this.hashString(stateString);
-            
-            // 获取画布图像数据（包含背景）
-            const canvasDataURL = this.canvas.toDataURL({
-                format: 'png',
-                quality: 1.0,
-                multiplier: 1,
-                withoutBackground: false  // 包含背景
-            });
-            
-            // 转换为字节数组
-            const base64Data = canvasDataURL.split(',')[1];
-            const binaryData = atob(base64Data);
-            const uint8Array = new Uint8Array(binaryData.length);
+            this.objectStateHashes = new WeakMap();
+            const { stateHash, stateParts } = this.computeCanvasStateHash();
+
+            const meta = {
+                node_id: this.node.id.toString(),
+                layer_transforms: layer_transforms,
+                canvas_state: stateHash,  // 添加状态哈希
+                state_parts: stateParts,  // 各对象哈希，服务器据此校验摘要
+                request_id: requestId,    // 回传请求ID，后端据此丢弃过期响应
+                scene: this.buildCanvasScene(canvasJSON, layer_transforms),
+                workflow_id: this.getWorkflowId()  // 场景按工作流 + 节点保存
+            };
+
+            if (composeOnServer) {
+                const composed = await this.postCanvasBinary({
+                    ...meta,
+                    compose: true,
+                    background: this.canvas.backgroundColor
+                }, {});
+                if (composed && composed.ok) {
+                    // 服务端合成的帧没有对应的瓦片哈希，下次光栅上传需完整发送
+                    this.deltaBaseline = null;
+                    this.lastCanvasStateHash = stateHash;
+                    return;
+                }
+                if (composed && composed.status === 409) {
+                    // 服务器缺少图层资源（例如重启后），下次重新上传
+                    this.layerAssetIds = new WeakMap();
+                }
+            }
             
-            for (let i = 0; i < binaryData.length; i++) {
-                uint8Array[i] = binaryData.charCodeAt(i);
+            // 由fabric渲染画布（包含背景），像素读取、瓦片哈希与编码交给Worker
+            const baseline = this.deltaBaseline;
+            const canvasElement = this.canvas.toCanvasElement(1);
+            const capture = await this.captureCanvasFrame(canvasElement, baseline);
+            const { width, height, tileHashes } = capture;
+
+            // 优先只上传变化的瓦片，服务器基准帧缺失时(409)回退到完整上传
+            let response = null;
+            try {
+                if (capture.delta) {
+                    const { dirty, tiles, encoding } = capture.delta;
+                    response = await this.postCanvasBinary({
+                        ...meta,
+                        encoding: encoding,
+                        delta: {
+                            base_frame: baseline.frameId,
+                            width: width,
+                            height: height,
+                            tile_size: DELTA_TILE_SIZE,
+                            tiles: dirty
+                        }
+                    }, { tiles: tiles });
+                }
+
+                if (!response || !response.ok) {
+                    const encoded = await capture.encode(this.getUploadFormat());
+                    const imageBlob = encoded.blob;
+                    const imageMeta = encoded.format === 'raw'
+                        ? { image_format: 'raw', image_width: width, image_height: height, encoding: encoded.encoding }
+                        : { image_format: encoded.format };
+
+                    // 优先使用二进制multipart上传，避免JSON整数数组的体积膨胀
+                    response = await this.postCanvasBinary({ ...meta, ...imageMeta }, { main_image: imageBlob });
+                    if (encoded.format !== 'raw' && (!response || (!response.ok && response.status !== 413))) {
+                        // 回退到旧的JSON格式（超出大小限制时不重试）
+                        const uint8Array = new Uint8Array(await imageBlob.arrayBuffer());
+                        response = await fetch('/lrpg_canvas', {
+                            method: 'POST',
+                            headers: {
+                                'Content-Type': 'application/json',
+                            },
+                            body: JSON.stringify({
+                                ...meta,
+                                main_image: Array.from(uint8Array),
+                                main_mask: null
+                            })
+                        });
+                    }
+                }
+            } finally {
+                capture.release();
             }
 
-            const response = await fetch('/lrpg_canvas', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    node_id: this.node.id.toString(),
-                    layer_transforms: layer_transforms,
-                    main_image: Array.from(uint8Array),
-                    main_mask: null,
-                    canvas_state: stateHash  // 添加状态哈希
-                })
-            });
-            
             // 更新最后的状态哈希
             this.lastCanvasStateHash = stateHash;
 
             if (response.ok) {
+                // 服务器接受本帧后才更新增量基准
+                const result = await response.json().catch(() => ({}));
+                if (result.frame_id) {
+                    this.deltaBaseline = { frameId: result.frame_id, width, height, tileHashes };
+                }
             } else {
                 console.error('[LRPG Canvas] 数据发送失败:', response.statusText);
             }
@@ -2540,20 +2869,285 @@ class LRPGCanvas {
             console.error('[LRPG Canvas] 发送数据时出错:', error);
         } finally {
             // 确保标志被重置
+            if (progressTimer) clearInterval(progressTimer);
             this.isSendingData = false;
         }
     }
+
+    getWorkflowId() {
+        // 与执行时 extra_pnginfo.workflow.id 一致
+        return app.graph?.id ?? null;
+    }
+
+    reportCanvasProgress(requestId) {
+        // 仅作提示，失败时忽略
+        fetch('/lrpg_canvas/progress', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ node_id: this.node.id.toString(), request_id: requestId })
+        }).catch(() => {});
+    }
     
-    // 简单的字符串哈希函数
-    hashString(str) {
-        let hash = 0;
-        if (str.length === 0) return hash;
+    getUploadFormat() {
+        const format = app.ui?.settings?.getSettingValue?.(UPLOAD_FORMAT_SETTING_ID, 'png');
+        return UPLOAD_FORMATS.includes(format) ? format : 'png';
+    }
+
+    async captureCanvasFrame(canvasElement, baseline) {
+        // 优先由Worker读取像素、计算瓦片哈希并打包增量（位图转移给Worker）；
+        // Worker不可用或失败时在主线程处理，并用toBlob编码为PNG
+        const worker = getEncoderWorker();
+        if (worker && typeof createImageBitmap === 'function') {
+            try {
+                const bitmap = await createImageBitmap(canvasElement);
+                const capture = await postToEncoder(worker, {
+                    type: 'capture',
+                    bitmap: bitmap,
+                    baseline: baseline && { width: baseline.width, height: baseline.height, tileHashes: baseline.tileHashes },
+                    tileSize: DELTA_TILE_SIZE,
+                    maxDirtyRatio: DELTA_MAX_DIRTY_RATIO
+                }, [bitmap]);
+                return {
+                    width: capture.width,
+                    height: capture.height,
+                    tileHashes: capture.tileHashes,
+                    delta: capture.delta,
+                    encode: async (format) => {
+                        try {
+                            return await postToEncoder(worker, { type: 'encode', frameId: capture.frameId, format });
+                        } catch (error) {
+                            console.debug('[LRPG Canvas] Worker编码失败，改为主线程编码:', error);
+                            return this.encodeOnMainThread(canvasElement);
+                        }
+                    },
+                    release: () => worker.postMessage({ type: 'release', frameId: capture.frameId })
+                };
+            } catch (error) {
+                console.debug('[LRPG Canvas] Worker读取画布失败，改为主线程处理:', error);
+            }
+        }
+
+        const width = canvasElement.width;
+        const height = canvasElement.height;
+        const pixels = canvasElement.getContext('2d').getImageData(0, 0, width, height).data;
+        const tileHashes = computeTileHashes(pixels, width, height, DELTA_TILE_SIZE);
+        return {
+            width: width,
+            height: height,
+            tileHashes: tileHashes,
+            delta: await packTileDelta(pixels, width, height, tileHashes, baseline, DELTA_TILE_SIZE, DELTA_MAX_DIRTY_RATIO),
+            encode: () => this.encodeOnMainThread(canvasElement),
+            release: () => {}
+        };
+    }
+
+    async encodeOnMainThread(canvasElement) {
+        const blob = await new Promise(resolve => canvasElement.toBlob(resolve, 'image/png'));
+        return { blob, format: 'png', encoding: null };
+    }
+
+    async postCanvasBinary(meta, parts) {
+        // multipart上传: meta为JSON字段，图像/瓦片为二进制字段
+        try {
+            const formData = new FormData();
+            formData.append('meta', new Blob([JSON.stringify(meta)], { type: 'application/json' }));
+            for (const [name, blob] of Object.entries(parts)) {
+                if (blob) {
+                    formData.append(name, blob, name);
+                }
+            }
+            return await fetch('/lrpg_canvas', {
+                method: 'POST',
+                body: formData
+            });
+        } catch (error) {
+            console.warn('[LRPG Canvas] 二进制上传失败，回退到JSON格式:', error);
+            return null;
+        }
+    }
+
+    canComposeOnServer() {
+        // 服务端合成只支持无滤镜、无裁剪、无斜切的图像图层
+        if (this.canvas.backgroundImage || this.canvas.overlayImage) return false;
+        const objects = this.canvas.getObjects();
+        return objects.length > 0 && objects.every(obj =>
+            obj.type === 'image' &&
+            !obj.clipPath &&
+            !(obj.filters && obj.filters.length) &&
+            !obj.skewX && !obj.skewY &&
+            !obj.cropX && !obj.cropY
+        );
+    }
+
+    async ensureLayerAssets() {
+        // 每个图层位图按内容哈希上传一次；服务器已有的资源（包括其他节点上传的）直接复用
+        try {
+            const pending = [];
+            for (const obj of this.canvas.getObjects()) {
+                if (obj.type !== 'image') continue;
+                const element = obj.getElement();
+                if (this.layerAssetIds.has(element)) continue;
+                const blob = await (await fetch(obj.getSrc())).blob();
+                pending.push({ element, blob, assetId: await this.hashAssetBlob(blob) });
+            }
+            if (pending.length === 0) return true;
+
+            let missing = new Set(pending.map(item => item.assetId));
+            const hashed = pending.filter(item => item.assetId).map(item => item.assetId);
+            if (hashed.length > 0) {
+                const probe = await fetch('/lrpg_canvas/asset/probe', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ asset_ids: hashed })
+                });
+                if (probe.ok) {
+                    missing = new Set((await probe.json()).missing);
+                }
+            }
+
+            for (const item of pending) {
+                if (item.assetId && !missing.has(item.assetId)) {
+                    this.layerAssetIds.set(item.element, item.assetId);
+                    continue;
+                }
+                const response = await fetch('/lrpg_canvas/asset', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: item.blob
+                });
+                if (!response.ok) return false;
+                const result = await response.json();
+                this.layerAssetIds.set(item.element, result.asset_id);
+            }
+            return true;
+        } catch (error) {
+            console.debug('[LRPG Canvas] 图层资源上传失败，改为上传整张画布:', error);
+            return false;
+        }
+    }
+
+    buildCanvasScene(canvasJSON, layer_transforms) {
+        // 可在服务端重放的场景: 图像src替换为资源ID，避免在场景中内联位图
+        const objects = this.canvas.getObjects().filter(obj => !obj.excludeFromExport);
+        const sceneObjects = canvasJSON.objects.map((json, index) => {
+            const obj = objects[index];
+            if (json.type !== 'image' || !obj) return json;
+            const { src, ...rest } = json;
+            return { ...rest, asset_id: this.layerAssetIds.get(obj.getElement()) || null };
+        });
+        return {
+            width: this.originalSize.width,
+            height: this.originalSize.height,
+            background: canvasJSON.background || this.canvas.backgroundColor,
+            objects: sceneObjects,
+            layer_transforms: layer_transforms
+        };
+    }
+
+    async hashAssetBlob(blob) {
+        // SHA-256内容哈希，与服务器的资源ID一致；非安全上下文中不可用时返回null
+        if (!(window.crypto && window.crypto.subtle)) return null;
+        const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+        return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    // 128位非加密哈希（四路32位），与后端 kontext_canvas_scene.hash128 逐位一致
+    hash128(str) {
+        let h1 = 0x811c9dc5, h2 = 0x9e3779b9, h3 = 0x85ebca6b, h4 = 0xc2b2ae35;
         for (let i = 0; i < str.length; i++) {
-            const char = str.charCodeAt(i);
-            hash = ((hash << 5) - hash) + char;
-            hash = hash & hash; // Convert to 32bit integer
+            const c = str.charCodeAt(i);
+            h1 = Math.imul(h1 ^ c, 0x01000193);
+            h2 = Math.imul(h2 ^ c, 0x5bd1e995);
+            h2 ^= h2 >>> 15;
+            h3 = Math.imul(h3 + c, 0x27d4eb2f);
+            h3 ^= h3 >>> 13;
+            h4 = Math.imul(h4 ^ c, 0x165667b1);
+            h4 = (h4 << 13) | (h4 >>> 19);
+        }
+        const fmix = (h) => {
+            h ^= h >>> 16;
+            h = Math.imul(h, 0x85ebca6b);
+            h ^= h >>> 13;
+            h = Math.imul(h, 0xc2b2ae35);
+            h ^= h >>> 16;
+            return (h >>> 0).toString(16).padStart(8, '0');
+        };
+        return fmix(h1) + fmix(h2) + fmix(h3) + fmix(h4);
+    }
+
+    payloadHash(key, serialize) {
+        // 大数据（图像src、路径点）按对象身份缓存哈希，内容不变时不再序列化
+        let hash = this.payloadHashes.get(key);
+        if (hash === undefined) {
+            hash = this.hash128(serialize());
+            this.payloadHashes.set(key, hash);
+        }
+        return hash;
+    }
+
+    objectStateGuard(obj) {
+        // 廉价的变换指纹，用于发现未触发修改事件的程序化修改
+        return [
+            obj.left, obj.top, obj.width, obj.height, obj.scaleX, obj.scaleY, obj.angle,
+            obj.skewX, obj.skewY, obj.flipX, obj.flipY, obj.opacity, obj.visible,
+            obj.fill, obj.stroke, obj.strokeWidth, obj.text, obj.path,
+            obj.type === 'image' ? obj.getElement() : null
+        ];
+    }
+
+    objectStateHash(obj) {
+        // 单个对象的128位哈希；图像src以内容ID代替，对象未修改时直接复用
+        const guard = this.objectStateGuard(obj);
+        const cached = this.objectStateHashes.get(obj);
+        if (cached && cached.guard.length === guard.length && cached.guard.every((v, i) => v === guard[i])) {
+            return cached.hash;
         }
-        return hash.toString(36);
+
+        const json = obj.toObject(['name', 'selectable']);
+        if (obj.type === 'image') {
+            const element = obj.getElement();
+            delete json.src;
+            // 始终按src计算，避免资源上传前后同一图像得到不同哈希
+            json.content = this.payloadHash(element, () => obj.getSrc() || '');
+        }
+        if (Array.isArray(obj.path)) {
+            json.path = this.payloadHash(obj.path, () => JSON.stringify(obj.path));
+        }
+        if (json.objects && typeof obj.getObjects === 'function') {
+            json.objects = obj.getObjects().map(child => this.objectStateHash(child));
+        }
+
+        const hash = this.hash128(JSON.stringify(json));
+        this.objectStateHashes.set(obj, { guard, hash });
+        return hash;
+    }
+
+    invalidateObjectHash(obj) {
+        // 对象（及其所在的组）被修改后，下次计算状态时重新哈希
+        while (obj) {
+            this.objectStateHashes.delete(obj);
+            obj = obj.group;
+        }
+    }
+
+    computeCanvasStateHash() {
+        // 画布状态摘要 = 尺寸、背景和各对象哈希的组合，只有修改过的对象需要重新计算
+        const stateParts = {
+            width: this.originalSize.width,
+            height: this.originalSize.height,
+            background: typeof this.canvas.backgroundColor === 'string' ? this.canvas.backgroundColor : '',
+            objects: this.canvas.getObjects()
+                .filter(obj => !obj.excludeFromExport)
+                .map(obj => this.objectStateHash(obj))
+        };
+        return { stateHash: this.combineStateDigest(stateParts), stateParts };
+    }
+
+    combineStateDigest(stateParts) {
+        // 与后端 combine_state_digest 一致
+        return this.hash128(
+            `${stateParts.width}x${stateParts.height}|${stateParts.background}|${stateParts.objects.join(',')}`
+        );
     }
 
     extractTransformData() {
@@ -2585,6 +3179,9 @@ class LRPGCanvas {
                 visible: obj.visible !== false, // 默认为true
                 locked: obj.selectable === false, // locked状态通过selectable判断
                 z_index: index, // 图层层级
+                opacity: obj.opacity !== undefined ? obj.opacity : 1,
+                // 已上传到服务器的图层位图ID（内容哈希），用于服务端合成
+                asset_id: obj.type === 'image' ? (this.layerAssetIds.get(obj.getElement()) || null) : null,
                 name: obj.name || `图层 ${index + 1}`, // 图层名称
                 // 添加缩略图数据用于后续重构
                 thumbnail: this.generateObjectThumbnailData(obj)
@@ -3351,6 +3948,16 @@ class LRPGCanvas {
 // 注册ComfyUI节点
 app.registerExtension({
     name: "LRPG.Canvas",
+    async setup() {
+        // 完整上传的编码格式（设置 → LRPG）
+        app.ui?.settings?.addSetting?.({
+            id: UPLOAD_FORMAT_SETTING_ID,
+            name: "Super Canvas 上传格式 (png / webp 无损 / raw 原始RGBA)",
+            type: "combo",
+            options: UPLOAD_FORMATS,
+            defaultValue: 'png'
+        });
+    },
     async beforeRegisterNodeDef(nodeType, nodeData) {
         if (nodeData.name === "LRPGCanvas") {           
             const onNodeCreated = nodeType.prototype.onNodeCreated;